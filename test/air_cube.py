@@ -0,0 +1,575 @@
+import glob
+import os
+import sys
+
+import numpy as np
+import pandas as pd
+
+import gazetteer
+
+
+# ==================================================
+# 縣市 × 行政區 × 小時 × 污染物 彙總立方體（NumPy 陣列）
+# ==================================================
+# 「某週高 PM2.5 縣市的平均 PM2.5，以及各行政區有幾個檢驗站」這類查詢
+# 不必再以 pandas 對明細 groupby，直接讀預先彙總好的陣列：
+#   檢驗站：station_count[行政區]，行政區為 gazetteer 的 368 個（固定維度）
+#   空汙  ：以小時為第一維的前綴和（prefix sum）
+#             cum_sum[t, 行政區, 污染物]   = 第 t 小時之前的數值總和
+#             cum_count[t, 行政區, 污染物] = 第 t 小時之前的筆數
+#           任意時段 [t0, t1) 的總和 / 筆數 = cum[t1] − cum[t0]，與時段長短無關；
+#           另存每小時的最小 / 最大值（時段查詢時沿小時維度取 fmin / fmax）
+#   縣市層級由行政區彙總（每個縣市最多 38 個行政區）
+#
+# 空汙的行政區維度只包含有空品測站的行政區（約 80 個，出現新的才加入），
+# 每小時約 80 × 7 × 20 bytes ≈ 11 KB（每日分區約 270 KB）；小時維度以倍增預留容量，逐小時附加不必每次搬移陣列
+#
+# 增量更新：
+#   - seen[小時, 測站] 記錄已併入的快照，重複匯入同一快照不會重複計算
+#   - 新資料只加到它所在小時之後的前綴和；依時間順序附加時只動到最後幾列
+#   - 檢驗站數量取自 SQLite 彙總表（station_summary），匯入檢驗站後整個向量更新，
+#     並記錄來源資料庫的路徑（stations_from），讀取端據此確認是同一份資料庫
+#
+# 檔案（CUBE_DIR 目錄內，各由一個流程階段寫入）：
+#   air.npz             : 空汙部分的索引（維度標籤、起點、小時數、各分區檔名；main.load_air / bulk_ingest）
+#   air-<日期>-<代>.npz : 空汙陣列依小時維度切成每天一個分區，存檔時只重寫有變動的分區
+#                         （依時間順序附加時只有最後一兩天；晚到的舊資料會改到之後所有的前綴和，
+#                         該日之後的分區全部重寫）。新分區以新的代號寫入、最後才換上新的索引，
+#                         中斷時索引仍指向完整的舊分區
+#   stations.npz        : 檢驗站部分（main.ingest_stations / bulk_ingest）
+# 行政區 / 測站維度只會往後加，較早的分區欄數較少，讀取時補上空值
+CUBE_DIR = "air_cube"
+AIR_FILE = "air.npz"
+STATION_FILE = "stations.npz"
+
+PARTITION = np.timedelta64(1, "D")
+
+POLLUTANTS = ["pm2.5", "pm10", "o3", "no2", "so2", "co", "aqi"]
+
+LEVELS = ["district", "city"]
+
+HOUR = np.timedelta64(1, "h")
+
+
+class AirCube:
+    """
+    縣市 × 行政區 × 小時 × 污染物 的彙總陣列
+
+    行政區以「縣市|行政區」為標籤，順序同 gazetteer.DISTRICTS
+    """
+
+    def __init__(self):
+        self.cities = list(gazetteer.DISTRICTS)
+        self.districts = [
+            f"{city}|{district}" for city, names in gazetteer.DISTRICTS.items() for district in names.split()
+        ]
+        self.district_ids = {label: i for i, label in enumerate(self.districts)}
+        self.district_city = np.array([self.cities.index(label.split("|")[0]) for label in self.districts])
+        self.station_count = np.zeros(len(self.districts), dtype=np.int32)
+        self.station_source = None
+
+        # 空汙部分：小時維度（start 起算）、有空汙資料的行政區（slot）、測站
+        self.start = None
+        self.hours = 0
+        self.slots = np.empty(0, dtype=np.int64)
+        self.sites = []
+        self.site_ids = {}
+        self._allocate(0, 0, 0)
+
+        # 存檔狀態：已存的分區（日期 → 檔名）、代號、檔案涵蓋到的小時（不含），
+        # 以及上次存檔後最早有變動的小時
+        self._partitions = {}
+        self._generation = 0
+        self._saved_end = None
+        self._dirty = None
+
+    def _allocate(self, capacity, slots, sites):
+        shape = (capacity, slots, len(POLLUTANTS))
+        self.cum_sum = np.zeros((capacity + 1,) + shape[1:])
+        self.cum_count = np.zeros((capacity + 1,) + shape[1:], dtype=np.int32)
+        self.min = np.full(shape, np.nan, dtype=np.float32)
+        self.max = np.full(shape, np.nan, dtype=np.float32)
+        self.seen = np.zeros((capacity, sites), dtype=bool)
+
+    # ---------- 維度擴充 ----------
+    def _reserve_hours(self, hours):
+        """小時維度至少容納 hours 個小時（容量倍增）"""
+        capacity = len(self.min)
+        if hours <= capacity:
+            return
+        old = self.cum_sum, self.cum_count, self.min, self.max, self.seen
+        self._allocate(max(hours, 2 * capacity, 24), len(self.slots), len(self.sites))
+
+        # 尚未使用的前綴和列維持等於最後一列，晚到的資料可以一律加到之後所有列
+        for new, previous in zip((self.cum_sum, self.cum_count), old[:2]):
+            new[:capacity + 1] = previous
+            new[capacity + 1:] = previous[capacity]
+        for new, previous in zip((self.min, self.max, self.seen), old[2:]):
+            new[:capacity] = previous
+
+    def _prepend_hours(self, hours):
+        """資料早於目前的起點：在小時維度前面補 hours 個空的小時"""
+        slots, pollutants = len(self.slots), len(POLLUTANTS)
+        self.cum_sum = np.concatenate([np.zeros((hours, slots, pollutants)), self.cum_sum])
+        self.cum_count = np.concatenate([np.zeros((hours, slots, pollutants), dtype=np.int32), self.cum_count])
+        empty = np.full((hours, slots, pollutants), np.nan, dtype=np.float32)
+        self.min = np.concatenate([empty, self.min])
+        self.max = np.concatenate([empty, self.max])
+        self.seen = np.concatenate([np.zeros((hours, len(self.sites)), dtype=bool), self.seen])
+        self.start -= hours * HOUR
+        self.hours += hours
+
+    def _slot_ids(self, district_ids):
+        """行政區 → slot，第一次出現的行政區加到 slot 維度"""
+        slot_of = np.full(len(self.districts), -1)
+        slot_of[self.slots] = np.arange(len(self.slots))
+        new = np.setdiff1d(np.unique(district_ids), self.slots)
+        if len(new):
+            slot_of[new] = len(self.slots) + np.arange(len(new))
+            self.slots = np.concatenate([self.slots, new])
+            rows, pollutants = len(self.min), len(POLLUTANTS)
+            self.cum_sum = np.concatenate([self.cum_sum, np.zeros((rows + 1, len(new), pollutants))], axis=1)
+            self.cum_count = np.concatenate(
+                [self.cum_count, np.zeros((rows + 1, len(new), pollutants), dtype=np.int32)], axis=1
+            )
+            empty = np.full((rows, len(new), pollutants), np.nan, dtype=np.float32)
+            self.min = np.concatenate([self.min, empty], axis=1)
+            self.max = np.concatenate([self.max, empty], axis=1)
+        return slot_of[district_ids]
+
+    def _site_ids(self, sitenames):
+        """測站 → 編號，新的測站加到 seen 的測站維度"""
+        new = [name for name in dict.fromkeys(sitenames) if name not in self.site_ids]
+        if new:
+            for name in new:
+                self.site_ids[name] = len(self.sites)
+                self.sites.append(name)
+            self.seen = np.concatenate([self.seen, np.zeros((len(self.seen), len(new)), dtype=bool)], axis=1)
+        return np.array([self.site_ids[name] for name in sitenames], dtype=np.int64)
+
+    # ---------- 增量更新 ----------
+    def add_air(self, rows):
+        """
+        併入空汙資料列（sitename / district〔縣市|行政區〕/ hour / 各污染物），
+        回傳實際併入的 (測站, 小時) 筆數
+        """
+        if rows.empty:
+            return 0
+
+        hour = rows["hour"].to_numpy().astype("datetime64[h]")
+        if self.start is None:
+            self.start = hour.min()
+        elif hour.min() < self.start:
+            self._prepend_hours(int((self.start - hour.min()) // HOUR))
+        h = ((hour - self.start) // HOUR).astype(np.int64)
+        self._reserve_hours(int(h.max()) + 1)
+
+        site = self._site_ids(rows["sitename"].tolist())
+        fresh = ~self.seen[h, site]
+        if not fresh.any():
+            return 0
+        self.seen[h[fresh], site[fresh]] = True
+
+        h = h[fresh]
+        slot = self._slot_ids(np.array([self.district_ids[label] for label in rows["district"][fresh]]))
+        values = rows[POLLUTANTS].to_numpy(dtype="float64")[fresh]
+        valid = ~np.isnan(values)
+
+        # 本批時段內各 (小時, 行政區, 污染物) 的總和 / 筆數，再累加成前綴和
+        slots, pollutants = len(self.slots), len(POLLUTANTS)
+        first, last = int(h.min()), int(h.max())
+        span = last - first + 1
+        cell = ((h - first)[:, None] * slots + slot[:, None]) * pollutants + np.arange(pollutants)
+        cell, value = cell[valid], values[valid]
+        delta_sum = np.bincount(cell, weights=value, minlength=span * slots * pollutants)
+        delta_count = np.bincount(cell, minlength=span * slots * pollutants)
+        delta_sum = delta_sum.reshape(span, slots, pollutants)
+        delta_count = delta_count.reshape(span, slots, pollutants).astype(np.int32)
+
+        self.cum_sum[first + 1:last + 2] += np.cumsum(delta_sum, axis=0)
+        self.cum_sum[last + 2:] += delta_sum.sum(axis=0)
+        self.cum_count[first + 1:last + 2] += np.cumsum(delta_count, axis=0)
+        self.cum_count[last + 2:] += delta_count.sum(axis=0)
+
+        # 每小時的最小 / 最大值（min / max 為連續陣列，reshape 不複製）
+        cell = cell + first * slots * pollutants
+        np.fmin.at(self.min.reshape(-1), cell, value.astype(np.float32))
+        np.fmax.at(self.max.reshape(-1), cell, value.astype(np.float32))
+
+        self.hours = max(self.hours, last + 1)
+        changed = self.start + first * HOUR
+        self._dirty = changed if self._dirty is None else min(self._dirty, changed)
+        return int(fresh.sum())
+
+    def set_station_counts(self, counts, source=None):
+        """
+        以各「縣市 × 行政區」的檢驗站數量（city / district / station_count）更新檢驗站維度
+
+        source: 數量來源的 SQLite 路徑（見 stations_from）
+        """
+        labels = (counts["city"].astype(str) + "|" + counts["district"].astype(str)).to_numpy()
+        ids = np.array([self.district_ids.get(label, -1) for label in labels], dtype=np.int64)
+        unknown = ids < 0
+        if unknown.any():
+            print(f"⚠️ {int(unknown.sum())} 個行政區不在 gazetteer 中，不列入彙總立方體")
+
+        self.station_count[:] = 0
+        self.station_count[ids[~unknown]] = counts["station_count"].to_numpy()[~unknown]
+        self.station_source = os.path.abspath(source) if source is not None else None
+
+    def stations_from(self, db_path):
+        """檢驗站數量是否由 db_path 這個資料庫寫入（舊版檔案沒有來源紀錄，一律視為否）"""
+        return self.station_source is not None and self.station_source == os.path.abspath(db_path)
+
+    # ---------- 查詢 ----------
+    @property
+    def latest(self):
+        """最新的小時（沒有空汙資料時為 NaT）"""
+        if not self.hours:
+            return pd.NaT
+        return pd.Timestamp(self.start + (self.hours - 1) * HOUR)
+
+    def hour_range(self, start=None, end=None, last=None):
+        """
+        時段 → 小時維度的 [i0, i1)
+
+        start / end: 起（含）/ 迄（不含）時間，None 為不限
+        last       : 最近一段時間（同 air_rolling 的視窗：最新小時 − last 之後的小時）
+        """
+        if not self.hours:
+            return 0, 0
+        if last is not None:
+            start = self.latest - pd.Timedelta(last) + pd.Timedelta(hours=1)
+
+        def index(time, default):
+            if time is None:
+                return default
+            offset = (np.datetime64(pd.Timestamp(time).ceil("h"), "h") - self.start) // HOUR
+            return int(np.clip(offset, 0, self.hours))
+
+        i0 = index(start, 0)
+        return i0, max(i0, index(end, self.hours))
+
+    def _select_cities(self, cities):
+        if cities is None:
+            return np.ones(len(self.cities), dtype=bool)
+        cities = [cities] if isinstance(cities, str) else list(cities)
+        return np.isin(self.cities, [gazetteer.normalize(city) for city in cities])
+
+    def air_stats(self, level="district", cities=None, pollutants=None, start=None, end=None, last=None):
+        """
+        時段內各行政區（level="district"）或各縣市（level="city"）的污染物統計
+
+        cities / pollutants: 只取這些縣市 / 污染物（None 為全部）
+        start / end / last : 時段（見 hour_range，預設為全期間）
+
+        回傳長格式 DataFrame：city /（district）/ pollutant / count / mean / min / max（筆數 0 的組合不列出）
+        """
+        if level not in LEVELS:
+            raise ValueError(f"level 必須是 {', '.join(LEVELS)} 其中之一")
+        pollutants = POLLUTANTS if pollutants is None else list(pollutants)
+        columns = [POLLUTANTS.index(p) for p in pollutants]
+
+        i0, i1 = self.hour_range(start, end, last)
+        total = (self.cum_sum[i1] - self.cum_sum[i0])[:, columns]
+        count = (self.cum_count[i1] - self.cum_count[i0])[:, columns]
+        if i1 > i0:
+            low = np.fmin.reduce(self.min[i0:i1, :, columns], axis=0)
+            high = np.fmax.reduce(self.max[i0:i1, :, columns], axis=0)
+        else:
+            low = high = np.full(total.shape, np.nan, dtype=np.float32)
+
+        slot_city = self.district_city[self.slots]
+        if level == "city":
+            # 行政區 → 縣市：依縣市編號累加
+            groups = np.arange(len(self.cities))
+            shape = (len(self.cities), len(columns))
+            total_by, count_by = np.zeros(shape), np.zeros(shape, dtype=np.int64)
+            low_by = np.full(shape, np.nan, dtype=np.float32)
+            high_by = np.full(shape, np.nan, dtype=np.float32)
+            np.add.at(total_by, slot_city, total)
+            np.add.at(count_by, slot_city, count)
+            np.fmin.at(low_by, slot_city, low)
+            np.fmax.at(high_by, slot_city, high)
+            total, count, low, high = total_by, count_by, low_by, high_by
+            labels = {"city": np.array(self.cities, dtype=object)}
+            group_city = groups
+        else:
+            districts = np.array(self.districts, dtype=object)[self.slots]
+            labels = {
+                "city": np.array([label.split("|")[0] for label in districts], dtype=object),
+                "district": np.array([label.split("|")[1] for label in districts], dtype=object),
+            }
+            group_city = slot_city
+
+        keep = self._select_cities(cities)[group_city]
+        group, column = np.nonzero((count > 0) & keep[:, None])
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = total[group, column] / count[group, column]
+
+        result = pd.DataFrame({name: values[group] for name, values in labels.items()})
+        result["pollutant"] = np.array(pollutants, dtype=object)[column]
+        result["count"] = count[group, column].astype(np.int64)
+        result["mean"] = mean
+        result["min"] = low[group, column].astype("float64")
+        result["max"] = high[group, column].astype("float64")
+        return result.sort_values(list(labels) + ["pollutant"], ignore_index=True)
+
+    def air_means(self, level="district", cities=None, pollutants=None, start=None, end=None, last=None):
+        """air_stats 的平均值轉成寬格式（每個縣市 / 行政區一列，每個污染物一欄）"""
+        pollutants = POLLUTANTS if pollutants is None else list(pollutants)
+        stats = self.air_stats(level, cities, pollutants, start, end, last)
+        keys = ["city"] if level == "city" else ["city", "district"]
+        means = stats.pivot(index=keys, columns="pollutant", values="mean")
+        return means.reindex(columns=pollutants).rename_axis(columns=None).reset_index()
+
+    def station_counts(self, level="district", cities=None):
+        """
+        各「縣市 × 行政區」（level="district"）或各縣市（level="city"）的檢驗站數量
+
+        回傳 DataFrame：city /（district）/ station_count，只列出有檢驗站的組合，
+        依縣市、行政區排序（同 station_summary）
+        """
+        if level not in LEVELS:
+            raise ValueError(f"level 必須是 {', '.join(LEVELS)} 其中之一")
+        keep = self._select_cities(cities)
+
+        if level == "city":
+            count = np.bincount(self.district_city, weights=self.station_count, minlength=len(self.cities))
+            rows = np.flatnonzero((count > 0) & keep)
+            result = pd.DataFrame({
+                "city": [self.cities[i] for i in rows],
+                "station_count": count[rows].astype(np.int64),
+            })
+        else:
+            rows = np.flatnonzero((self.station_count > 0) & keep[self.district_city])
+            labels = [self.districts[i].split("|") for i in rows]
+            result = pd.DataFrame({
+                "city": [city for city, _ in labels],
+                "district": [district for _, district in labels],
+                "station_count": self.station_count[rows].astype(np.int64),
+            })
+        return result.sort_values(list(result.columns[:-1]), ignore_index=True)
+
+    # ---------- 存檔 ----------
+    def version(self):
+        """維度定義（gazetteer 與污染物清單）改變時，舊的陣列檔不再適用"""
+        return f"{gazetteer.gazetteer_version()}|{','.join(POLLUTANTS)}"
+
+    def save_air(self, directory=CUBE_DIR):
+        """
+        空汙部分存檔：只重寫上次存檔後有變動（或新增）的每日分區，再換上新的索引
+
+        回傳寫入的分區數
+        """
+        written = 0
+        if self.start is not None:
+            end = self.start + self.hours * HOUR
+            begin = self.start
+            if self._saved_end is not None:
+                begin = min(self._saved_end, end if self._dirty is None else self._dirty)
+
+            generation = self._generation + 1
+            day = begin.astype("datetime64[D]")
+            while day.astype("datetime64[h]") < end:
+                lo = max(day.astype("datetime64[h]"), self.start)
+                hi = min((day + PARTITION).astype("datetime64[h]"), end)
+                i0, i1 = int((lo - self.start) // HOUR), int((hi - self.start) // HOUR)
+                name = f"air-{day}-{generation}.npz"
+                save_arrays(
+                    os.path.join(directory, name),
+                    cum_sum=self.cum_sum[i0 + 1:i1 + 1],
+                    cum_count=self.cum_count[i0 + 1:i1 + 1],
+                    min=self.min[i0:i1],
+                    max=self.max[i0:i1],
+                    seen=self.seen[i0:i1],
+                )
+                self._partitions[str(day)] = name
+                written += 1
+                day += PARTITION
+            self._generation, self._saved_end, self._dirty = generation, end, None
+
+        save_arrays(
+            os.path.join(directory, AIR_FILE),
+            version=np.array(self.version()),
+            start=np.array(self.start if self.start is not None else np.datetime64("NaT"), dtype="datetime64[h]"),
+            hours=np.array(self.hours),
+            generation=np.array(self._generation),
+            districts=np.array(self.districts, dtype=str)[self.slots],
+            sites=np.array(self.sites, dtype=str),
+            days=np.array(sorted(self._partitions), dtype=str),
+            partitions=np.array([self._partitions[day] for day in sorted(self._partitions)], dtype=str),
+        )
+
+        # 新的索引已寫入，被取代的舊分區（以及舊格式的檔案）不再需要
+        keep = set(self._partitions.values())
+        for path in glob.glob(os.path.join(directory, "air-*.npz")):
+            if os.path.basename(path) not in keep:
+                os.remove(path)
+        return written
+
+    def _load_partitions(self, directory, names):
+        """讀取各日分區，依順序接成完整的陣列（較早的分區補齊後來才加入的行政區 / 測站）"""
+        parts = []
+        for name in names:
+            part = load_arrays(os.path.join(directory, name))
+            if part is None:
+                print(f"⚠️ 找不到彙總立方體的分區 {name}，重新建立（可用 bulk_ingest 重新匯入歷史快照）")
+                return False
+            parts.append(part)
+
+        def stack(key, width, fill, dtype, head=()):
+            blocks = list(head)
+            for part in parts:
+                block = part[key]
+                pad = [(0, 0)] * block.ndim
+                pad[1] = (0, width - block.shape[1])
+                blocks.append(np.pad(block, pad, constant_values=fill).astype(dtype, copy=False))
+            return np.concatenate(blocks)
+
+        slots, sites, pollutants = len(self.slots), len(self.sites), len(POLLUTANTS)
+        self.cum_sum = stack("cum_sum", slots, 0, np.float64, [np.zeros((1, slots, pollutants))])
+        self.cum_count = stack("cum_count", slots, 0, np.int32, [np.zeros((1, slots, pollutants), dtype=np.int32)])
+        self.min = stack("min", slots, np.nan, np.float32)
+        self.max = stack("max", slots, np.nan, np.float32)
+        self.seen = stack("seen", sites, False, bool)
+        return True
+
+    def save_stations(self, directory=CUBE_DIR):
+        save_arrays(
+            os.path.join(directory, STATION_FILE),
+            version=np.array(self.version()),
+            station_count=self.station_count,
+            source=np.array(self.station_source or ""),
+        )
+
+    @classmethod
+    def load(cls, directory=CUBE_DIR):
+        """讀取彙總立方體；檔案不存在或維度定義已改變時為空的立方體"""
+        cube = cls()
+        air = load_arrays(os.path.join(directory, AIR_FILE), cube.version())
+        if air is not None and not np.isnat(air["start"]) and not cube._load_air(directory, air):
+            cube = cls()
+
+        stations = load_arrays(os.path.join(directory, STATION_FILE), cube.version())
+        if stations is not None:
+            cube.station_count = stations["station_count"]
+            cube.station_source = str(stations.get("source", "")) or None
+        return cube
+
+    def _load_air(self, directory, air):
+        """由索引讀入空汙部分；分區檔不見時回傳 False"""
+        self.start = air["start"][()]
+        self.slots = np.array([self.district_ids[label] for label in air["districts"]], dtype=np.int64)
+        self.sites = air["sites"].tolist()
+        self.site_ids = {name: i for i, name in enumerate(self.sites)}
+
+        if "partitions" not in air:
+            # 舊格式（整份陣列存在 air.npz）：照常讀取，下次存檔時全部改寫成分區
+            self.hours = len(air["min"])
+            self.cum_sum, self.cum_count = air["cum_sum"], air["cum_count"]
+            self.min, self.max, self.seen = air["min"], air["max"], air["seen"]
+            return True
+
+        if not self._load_partitions(directory, air["partitions"]):
+            return False
+        self.hours = len(self.min)
+        self._partitions = dict(zip(air["days"].tolist(), air["partitions"].tolist()))
+        self._generation = int(air["generation"])
+        self._saved_end = self.start + self.hours * HOUR
+        return True
+
+
+def save_arrays(path, **arrays):
+    # 先寫暫存檔再改名，中斷時不會留下寫一半的檔案
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(tmp, path)
+
+
+def load_arrays(path, version=None):
+    """讀取陣列檔（全部載入記憶體）；檔案不存在或版本不符時回傳 None（version=None 不檢查）"""
+    if not os.path.exists(path):
+        return None
+    with np.load(path, allow_pickle=False) as data:
+        if version is not None and str(data["version"]) != version:
+            print(f"⚠️ {path} 的維度定義已改變，重新建立（可用 bulk_ingest 重新匯入歷史快照）")
+            return None
+        return {name: data[name] for name in data.files}
+
+
+# ==================================================
+# 由空汙快照 / 檢驗站資料庫更新
+# ==================================================
+def snapshot_rows(df, site_map):
+    """空汙資料 → 每個 (測站, 小時) 一列：sitename / district（縣市|行政區）/ hour / 各污染物"""
+    rows = pd.DataFrame({
+        "sitename": df["sitename"].astype(object).to_numpy(),
+        "hour": pd.to_datetime(df["datacreationdate"], errors="coerce").dt.floor("h").to_numpy(),
+    })
+    for pollutant in POLLUTANTS:
+        values = df[pollutant] if pollutant in df.columns else pd.Series(np.nan, index=df.index)
+        rows[pollutant] = pd.to_numeric(values, errors="coerce").to_numpy(dtype="float64")
+
+    # 對應不到行政區的測站不列入（gazetteer.map_sites 已提示）
+    resolved = site_map[site_map["district"] != ""]
+    labels = dict(zip(resolved["sitename"], resolved["county"] + "|" + resolved["district"]))
+    rows["district"] = rows["sitename"].map(labels)
+    rows = rows.dropna(subset=["sitename", "hour", "district"])
+    return rows.drop_duplicates(["sitename", "hour"]).reset_index(drop=True)
+
+
+def update_air(df, directory=CUBE_DIR, db_path="inspection_stations.db"):
+    """
+    將一批空汙快照併入彙總立方體並存檔，回傳實際併入的 (測站, 小時) 筆數
+
+    測站對應行政區見 gazetteer.map_sites：名稱比對不到的測站才讀取檢驗站資料庫找最近的檢驗站
+    """
+    import station_summary
+
+    def stations():
+        if not station_summary.available(db_path):
+            return None
+        import analysis
+        try:
+            return analysis.read_stations(db_path)
+        except pd.errors.DatabaseError:
+            # 舊版資料庫（沒有 active_stations）
+            return analysis.read_stations(db_path, active_only=False)
+
+    rows = snapshot_rows(df, gazetteer.map_sites(df, stations))
+    cube = AirCube.load(directory)
+    added = cube.add_air(rows)
+    # 沒有新資料時不必重寫（檔案還不存在時仍建立，流程才有輸出檔可比對）
+    if added or not os.path.exists(os.path.join(directory, AIR_FILE)):
+        cube.save_air(directory)
+    return added
+
+
+def update_stations(directory=CUBE_DIR, db_path="inspection_stations.db"):
+    """由 SQLite 彙總表更新各行政區的檢驗站數量並存檔，回傳有檢驗站的行政區數"""
+    import station_summary
+
+    cube = AirCube.load(directory)
+    cube.set_station_counts(station_summary.district_counts(db_path=db_path), source=db_path)
+    cube.save_stations(directory)
+    return int((cube.station_count > 0).sum())
+
+
+def load_cube(directory=CUBE_DIR):
+    return AirCube.load(directory)
+
+
+# ---------- 主程式進入點 ----------
+# 用法：python air_cube.py [空汙 XML 檔案 ...]
+if __name__ == "__main__":
+    from air_quality_xml_to_csv import read_air_quality
+
+    update_stations()
+    for path in sys.argv[1:] or ["空汙.xml"]:
+        print(f"✅ {path}：併入 {update_air(read_air_quality(path))} 個測站小時")
+
+    cube = load_cube()
+    print(cube.air_means("city", pollutants=["pm2.5", "aqi"], last="7D").to_string(index=False))
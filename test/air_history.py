@@ -0,0 +1,192 @@
+import os
+import sys
+
+import pandas as pd
+
+from air_quality_xml_to_csv import TIME_FORMAT, iter_air_quality_batches
+from intermediates import compact, concat_frames
+
+
+# ==================================================
+# 空汙歷史資料庫（只增不改，依日期分檔）
+# ==================================================
+# 目錄結構：
+#   air_history/
+#       2025-12-26.csv
+#       2025-12-27.csv
+#       ...
+# 每個檔案存放當天所有測站、所有小時的快照；
+# 以 (siteid, datacreationdate) 為鍵，重複匯入同一小時不會新增資料
+HISTORY_DIR = "air_history"
+
+KEY_COLUMNS = ["siteid", "datacreationdate"]
+
+
+def partition_path(date, store_dir=HISTORY_DIR):
+    """某一天（YYYY-MM-DD）的分檔路徑"""
+    return os.path.join(store_dir, f"{date}.csv")
+
+
+def read_keys(path):
+    """只讀取分檔的鍵欄位，用來判斷哪些快照已經存在"""
+    if not os.path.exists(path):
+        return set()
+    keys = pd.read_csv(path, usecols=KEY_COLUMNS, dtype=str)
+    return set(zip(keys["siteid"], keys["datacreationdate"]))
+
+
+def append_snapshot(df, store_dir=HISTORY_DIR):
+    """
+    將一批空汙資料附加到歷史資料庫
+
+    - 依 datacreationdate 的日期分別寫入對應分檔
+    - 已存在的 (siteid, datacreationdate) 直接略過，因此可重複匯入
+    - 只會在檔案尾端附加，既有資料不會被改寫
+
+    回傳實際新增的筆數
+    """
+
+    os.makedirs(store_dir, exist_ok=True)
+
+    df = df.dropna(subset=KEY_COLUMNS).copy()
+    df["siteid"] = df["siteid"].astype(str).str.replace(r"\.0$", "", regex=True)
+
+    # 時間一律存成環境部的格式（2025-12-26 22:00），與既有分檔的鍵一致
+    df["datacreationdate"] = pd.to_datetime(
+        df["datacreationdate"].astype(str).str.strip(), errors="coerce"
+    ).dt.strftime(TIME_FORMAT)
+    df = df.dropna(subset=["datacreationdate"])
+
+    # 同一批資料內的重複鍵只保留第一筆
+    df = df.drop_duplicates(subset=KEY_COLUMNS)
+
+    added = 0
+    for date, part in df.groupby(df["datacreationdate"].str[:10], sort=True):
+        path = partition_path(date, store_dir)
+        existing = read_keys(path)
+
+        keys = pd.Series(list(zip(part["siteid"], part["datacreationdate"])), index=part.index)
+        new_rows = part[~keys.isin(existing)]
+        if new_rows.empty:
+            continue
+
+        # 新檔案寫入表頭（含 BOM）；既有檔案依原表頭的欄位順序附加
+        is_new = not os.path.exists(path)
+        if not is_new:
+            header = pd.read_csv(path, nrows=0, encoding="utf-8-sig").columns
+            new_rows = new_rows.reindex(columns=header)
+        new_rows.to_csv(
+            path,
+            mode="w" if is_new else "a",
+            header=is_new,
+            index=False,
+            encoding="utf-8-sig" if is_new else "utf-8",
+        )
+        added += len(new_rows)
+
+    return added
+
+
+def ingest_xml(xml_path="空汙.xml", store_dir=HISTORY_DIR):
+    """逐批解析空汙 XML 並附加到歷史資料庫，回傳新增筆數"""
+    added = 0
+    for batch in iter_air_quality_batches(xml_path):
+        added += append_snapshot(batch, store_dir)
+
+    print(f"✅ 空汙歷史資料新增 {added} 筆")
+    return added
+
+
+# ==================================================
+# 區間查詢：只讀取時間範圍內的分檔
+# ==================================================
+def iter_range(start, end, store_dir=HISTORY_DIR, columns=None, county=None, sitename=None):
+    """
+    逐一讀取 [start, end] 期間的分檔並篩選後回傳（generator）
+
+    參數說明：
+    start / end : 時間範圍（字串或 Timestamp，含頭尾）
+    columns     : 只讀取的欄位（None 表示全部）
+    county      : 只保留指定縣市（字串或清單）
+    sitename    : 只保留指定測站（字串或清單）
+    """
+
+    start = pd.Timestamp(start)
+    end = pd.Timestamp(end)
+
+    if not os.path.isdir(store_dir):
+        return
+
+    # 篩選條件用到的欄位也要一併讀取
+    usecols = None
+    if columns is not None:
+        usecols = list(dict.fromkeys(
+            ["datacreationdate"]
+            + (["county"] if county is not None else [])
+            + (["sitename"] if sitename is not None else [])
+            + list(columns)
+        ))
+
+    first_day = start.strftime("%Y-%m-%d")
+    last_day = end.strftime("%Y-%m-%d")
+
+    for name in sorted(os.listdir(store_dir)):
+        date = name[:-len(".csv")]
+        if not name.endswith(".csv") or not first_day <= date <= last_day:
+            continue
+
+        part = pd.read_csv(os.path.join(store_dir, name), usecols=usecols)
+        part["datacreationdate"] = pd.to_datetime(part["datacreationdate"])
+        part = part[part["datacreationdate"].between(start, end)]
+
+        if county is not None:
+            part = part[part["county"].isin([county] if isinstance(county, str) else county)]
+        if sitename is not None:
+            part = part[part["sitename"].isin([sitename] if isinstance(sitename, str) else sitename)]
+
+        if not part.empty:
+            # 代碼欄位的型態在 load_range 合併後才決定，各分檔之間才會一致
+            yield compact(part, codes=False)
+
+
+def load_range(start, end, store_dir=HISTORY_DIR, columns=None, county=None, sitename=None):
+    """iter_range 的結果合併成單一 DataFrame（依時間排序）"""
+    parts = list(iter_range(start, end, store_dir, columns, county, sitename))
+    if not parts:
+        return pd.DataFrame()
+    return compact(concat_frames(parts)).sort_values("datacreationdate", kind="stable", ignore_index=True)
+
+
+def county_series(start, end, value="pm2.5", store_dir=HISTORY_DIR, county=None):
+    """
+    各縣市每小時平均值時間序列
+
+    回傳 DataFrame：index 為 datacreationdate，每個縣市一欄
+    """
+    df = load_range(start, end, store_dir, columns=["county", value], county=county)
+    if df.empty:
+        return pd.DataFrame()
+    return df.pivot_table(
+        index="datacreationdate", columns="county", values=value, aggfunc="mean", observed=True
+    )
+
+
+def site_series(start, end, value="pm2.5", store_dir=HISTORY_DIR, sitename=None):
+    """
+    各測站每小時數值時間序列
+
+    回傳 DataFrame：index 為 datacreationdate，每個測站一欄
+    """
+    df = load_range(start, end, store_dir, columns=["sitename", value], sitename=sitename)
+    if df.empty:
+        return pd.DataFrame()
+    return df.pivot_table(
+        index="datacreationdate", columns="sitename", values=value, aggfunc="mean", observed=True
+    )
+
+
+# ---------- 主程式進入點 ----------
+# 用法：python air_history.py [空汙 XML 檔案 ...]
+if __name__ == "__main__":
+    for path in sys.argv[1:] or ["空汙.xml"]:
+        ingest_xml(path)
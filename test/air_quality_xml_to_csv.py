@@ -1,15 +1,234 @@
 import pandas as pd
+import numpy as np
 import xml.etree.ElementTree as ET
 import os
+from array import array
+from datetime import datetime
+
+from intermediates import compact, concat_frames
+
+
+# ==================================================
+# 空汙 XML 欄位與型態（順序同環境部 aqx_p_488，即 CSV 欄位順序）
+# ==================================================
+# text    : 文字（縣市、測站、狀態等之後會轉成 category）
+# number  : 浮點數
+# integer : 整數代碼（有缺值時為可為空的整數型態）
+# datetime: 時間
+AIR_SCHEMA = {
+    "sitename": "text",          # 測站名稱
+    "county": "text",            # 縣市（統一為「台」）
+    "aqi": "number",             # 空氣品質指標
+    "pollutant": "text",         # 主要污染物
+    "status": "text",            # 空氣品質狀態
+    "so2": "number",             # 二氧化硫
+    "so2_avg": "number",
+    "co": "number",              # 一氧化碳
+    "co_8hr": "number",
+    "o3": "number",              # 臭氧
+    "o3_8hr": "number",
+    "pm10": "number",            # 懸浮微粒
+    "pm10_avg": "number",
+    "pm2.5": "number",           # PM2.5 即時值
+    "pm2.5_avg": "number",       # PM2.5 移動平均
+    "no2": "number",             # 二氧化氮
+    "nox": "number",             # 氮氧化物
+    "no": "number",              # 一氧化氮
+    "windspeed": "number",       # 風速
+    "winddirec": "number",       # 風向
+    "datacreationdate": "datetime",  # 資料建立時間（每小時一個快照）
+    "longitude": "number",       # 經度
+    "latitude": "number",        # 緯度
+    "siteid": "integer",         # 測站代碼
+    "unit": "text",
+}
+
+# 預設輸出全部欄位
+AIR_COLUMNS = list(AIR_SCHEMA)
+
+# 環境部以這些符號表示「無資料」，解析時直接視為缺值
+SENTINELS = frozenset({"", "-", "--", "NA", "N/A", "ND", "x"})
+
+# XML 與 CSV 的時間格式
+TIME_FORMAT = "%Y-%m-%d %H:%M"
+
+
+def select_columns(columns=None):
+    """檢查呼叫端指定的欄位（None 表示全部），回傳依 AIR_SCHEMA 順序排列的欄位"""
+    if columns is None:
+        return AIR_COLUMNS
+
+    unknown = [col for col in columns if col not in AIR_SCHEMA]
+    if unknown:
+        raise ValueError(f"未知的空汙欄位：{', '.join(unknown)}")
+    return [col for col in AIR_COLUMNS if col in columns]
+
+
+def parse_time(text):
+    """解析時間字串，回傳 datetime64[ns] 的整數值（無法解析時為 NaT）"""
+    if text in SENTINELS:
+        return np.iinfo(np.int64).min
+    try:
+        return pd.Timestamp(datetime.strptime(text, TIME_FORMAT)).value
+    except ValueError:
+        try:
+            return pd.Timestamp(text).value
+        except ValueError:
+            return np.iinfo(np.int64).min
+
+
+def iter_air_quality_batches(xml_path, batch_size=50000, columns=None):
+    """
+    只處理 <data> 測站紀錄節點，每累積 batch_size 筆輸出一個 DataFrame 批次
+
+    依 AIR_SCHEMA 在走訪時直接轉換型態（只需一次走訪）：
+    - 數值欄位直接轉成 float 放進欄式緩衝區，「-」等缺值符號即為 NaN
+    - 時間欄位同一小時的快照時間相同，每種時間字串只解析一次
+
+    columns: 只載入的欄位（None 表示全部），未選的欄位不做任何轉換
+    """
+
+    columns = select_columns(columns)
+    text_cols = [c for c in columns if AIR_SCHEMA[c] == "text"]
+    number_cols = [c for c in columns if AIR_SCHEMA[c] in ("number", "integer")]
+    time_cols = [c for c in columns if AIR_SCHEMA[c] == "datetime"]
+
+    def new_buffers():
+        buffers = {col: [] for col in text_cols}
+        buffers.update({col: array("d") for col in number_cols})
+        buffers.update({col: array("q") for col in time_cols})
+        return buffers
 
+    buffers = new_buffers()
+    times = {}        # 時間字串 → 解析結果
+    nan = float("nan")
+    count = 0
 
-def xml_to_csv(xml_path="空汙.xml", output_csv="air_quality.csv"):
+    root = None
+
+    # start 事件只用來記下根節點：已清空的 <data> 仍掛在根節點下，
+    # 每批輸出後 root.clear() 才會真正釋放（同 moenv_crawler.iter_station_batches）
+    for event, elem in ET.iterparse(xml_path, events=("start", "end")):
+
+        if event == "start":
+            if root is None:
+                root = elem
+            continue
+
+        if elem.tag != "data":
+            continue
+
+        # 單次走訪子節點取出所有欄位
+        fields = {child.tag: child.text or "" for child in elem}
+
+        # 釋放已處理紀錄的子節點
+        elem.clear()
+
+        # 若非測站資料，直接跳過
+        sitename = fields.get("sitename")
+        county = fields.get("county")
+        if sitename is None or county is None:
+            continue
+
+        fields["sitename"] = sitename.strip()
+        fields["county"] = county.replace("臺", "台").strip()
+
+        for col in text_cols:
+            buffers[col].append(fields.get(col, ""))
+
+        for col in number_cols:
+            text = fields.get(col, "")
+            if text in SENTINELS:
+                buffers[col].append(nan)
+                continue
+            try:
+                buffers[col].append(float(text))
+            except ValueError:
+                buffers[col].append(nan)
+
+        for col in time_cols:
+            text = fields.get(col, "").strip()
+            value = times.get(text)
+            if value is None:
+                value = times[text] = parse_time(text)
+            buffers[col].append(value)
+
+        count += 1
+        if count == batch_size:
+            root.clear()
+            yield _buffers_to_frame(buffers, columns)
+            buffers = new_buffers()
+            count = 0
+
+    if count:
+        yield _buffers_to_frame(buffers, columns)
+
+
+def _buffers_to_frame(buffers, columns):
+    """
+    將欄式緩衝區轉成 DataFrame
+
+    輸出為精簡型態：縣市 / 測站 / 狀態為 category、座標為 float32；
+    integer 欄位（siteid）固定為 Int32，不依各批內容縮小型態，每一批的型態都相同
+    """
+    data = {}
+    for col in columns:
+        buffer = buffers[col]
+        if AIR_SCHEMA[col] == "datetime":
+            data[col] = np.frombuffer(buffer, dtype=np.int64).view("datetime64[ns]")
+        elif AIR_SCHEMA[col] == "integer":
+            values = np.frombuffer(buffer, dtype=np.float64)
+            # 非整數（不應出現）與缺值一樣視為缺值
+            missing = np.isnan(values) | (values % 1 != 0)
+            data[col] = pd.arrays.IntegerArray(np.where(missing, 0, values).astype(np.int32), missing)
+        elif AIR_SCHEMA[col] == "number":
+            data[col] = np.frombuffer(buffer, dtype=np.float64)
+        else:
+            data[col] = buffer
+    return compact(pd.DataFrame(data, columns=columns), codes=False)
+
+
+def read_air_quality(xml_path="空汙.xml", columns=None, batch_size=50000):
+    """
+    解析空汙 XML 成單一 DataFrame（型態見 AIR_SCHEMA；siteid 為 Int32，
+    與其他檔案的結果合併時型態一致，寫入中介檔時才依整份資料縮小）
+
+    columns: 只載入的欄位（None 表示全部）
+    """
+    batches = list(iter_air_quality_batches(xml_path, batch_size, columns))
+    if not batches:
+        return pd.DataFrame(columns=select_columns(columns))
+    return concat_frames(batches)
+
+
+def write_csv(batches, output_csv, columns=None):
+    """
+    將 DataFrame 批次依序寫入同一個 CSV，回傳總筆數
+
+    檔案只開啟一次（BOM 只寫一次），每批資料直接接續寫入
+    """
+    total = 0
+    with open(output_csv, "w", encoding="utf-8-sig", newline="") as f:
+        for df in batches:
+            df.to_csv(f, header=(total == 0), index=False, date_format=TIME_FORMAT)
+            total += len(df)
+
+        # 沒有任何測站資料時仍輸出只有表頭的 CSV
+        if total == 0:
+            pd.DataFrame(columns=select_columns(columns)).to_csv(f, index=False)
+
+    return total
+
+
+def xml_to_csv(xml_path="空汙.xml", output_csv="air_quality.csv", batch_size=50000, columns=None):
     """
     將空氣品質 XML 檔案轉換為 CSV 檔案
 
     參數說明：
     xml_path   : 空氣品質 XML 檔案路徑
     output_csv: 輸出的 CSV 檔案名稱
+    batch_size: 每累積幾筆寫出一次 CSV
+    columns   : 輸出的欄位（None 表示 AIR_SCHEMA 的全部欄位）
     """
 
     # ---------- 檢查 XML 檔案是否存在 ----------
@@ -17,54 +236,9 @@ def xml_to_csv(xml_path="空汙.xml", output_csv="air_quality.csv"):
         print(f"❌ 找不到檔案：{xml_path}")
         return
 
-    # ---------- 讀取並解析 XML ----------
-    tree = ET.parse(xml_path)
-    root = tree.getroot()
-
-    # 用來存放每一筆測站資料
-    data = []
-
-    # ---------- 逐一走訪 XML 節點 ----------
-    # 使用 iter() 是為了避免 XML 結構層級不固定
-    for item in root.iter():
-
-        # 讀取測站名稱與縣市
-        sitename = item.findtext("sitename")
-        county = item.findtext("county")
-
-        # 若非測站資料，直接跳過
-        if sitename is None or county is None:
-            continue
-
-        # 將每個測站需要的欄位整理成 dict
-        record = {
-            "sitename": sitename.strip(),                         # 測站名稱
-            "county": county.replace("臺", "台").strip(),        # 縣市（統一為「台」）
-            "aqi": item.findtext("aqi"),                          # 空氣品質指標
-            "pollutant": item.findtext("pollutant"),              # 主要污染物
-            "status": item.findtext("status"),                    # 空氣品質狀態
-            "co": item.findtext("co"),                            # 一氧化碳
-            "pm2.5": item.findtext("pm2.5"),                      # PM2.5 即時值
-            "pm2.5_avg": item.findtext("pm2.5_avg"),              # PM2.5 移動平均
-            "nox": item.findtext("nox"),                          # 氮氧化物
-        }
-
-        # 將整理好的資料加入清單
-        data.append(record)
-
-    # ---------- 建立 DataFrame ----------
-    df = pd.DataFrame(data)
-
-    # ---------- 將數值欄位轉為數值型態 ----------
-    # 若轉換失敗（例如空值或文字），會自動轉為 NaN
-    numeric_cols = ["aqi", "co", "pm2.5", "pm2.5_avg", "nox"]
-    for col in numeric_cols:
-        df[col] = pd.to_numeric(df[col], errors="coerce")
-
-    # ---------- 輸出為 CSV ----------
-    df.to_csv(output_csv, index=False, encoding="utf-8-sig")
-
-    print(f"✅ 已產生 {output_csv}，共 {len(df)} 筆資料")
+    # ---------- 逐筆串流解析並分批寫出 CSV ----------
+    total = write_csv(iter_air_quality_batches(xml_path, batch_size, columns), output_csv, columns)
+    print(f"✅ 已產生 {output_csv}，共 {total} 筆資料")
 
 
 # ---------- 主程式進入點 ----------
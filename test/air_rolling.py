@@ -0,0 +1,351 @@
+import os
+import sqlite3
+import sys
+
+import numpy as np
+import pandas as pd
+
+from air_quality_xml_to_csv import TIME_FORMAT
+
+
+# ==================================================
+# 空汙累計統計（增量更新，每個縣市 / 測站一份）
+# ==================================================
+# 每次只處理新進的快照列，不重新掃描歷史資料：
+#   air_totals  : 全期間的筆數、平均、M2（變異數用）、最小、最大
+#   air_buckets : 每小時一個彙總桶，視窗統計（24h / 7d）由桶合併而成，
+#                 只保留最近 RETENTION 內的桶
+#   air_seen    : 已處理的 (測站, 小時)，重複匯入同一快照不會重複計算
+#   air_marks   : 各測站處理過的最新小時；早於保留期間又不晚於此時間的列
+#                 無法判斷是否已處理過，一律略過
+# 平均與變異數以 Welford / Chan 的合併公式累加（數值穩定，不需保留原始值）
+#
+# 視窗以資料中最新的小時為準（不是現在時間），歷史資料也能得到一致的結果
+STATE_DB = "air_rolling.db"
+
+METRICS = ["pm2.5", "aqi"]
+
+# 統計層級 → 空汙資料的欄位
+LEVELS = {"county": "county", "site": "sitename"}
+
+WINDOWS = {"24h": pd.Timedelta(hours=24), "7d": pd.Timedelta(days=7)}
+RETENTION = max(WINDOWS.values())
+
+STAT_COLUMNS = ["count", "mean", "m2", "min", "max"]
+TOTAL_KEYS = ["level", "name", "metric"]
+BUCKET_KEYS = TOTAL_KEYS + ["hour"]
+
+SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS air_totals (
+        level  TEXT NOT NULL,
+        name   TEXT NOT NULL,
+        metric TEXT NOT NULL,
+        count  INTEGER NOT NULL,
+        mean   REAL,
+        m2     REAL,
+        min    REAL,
+        max    REAL,
+        PRIMARY KEY (level, name, metric)
+    )
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS air_buckets (
+        level  TEXT NOT NULL,
+        name   TEXT NOT NULL,
+        metric TEXT NOT NULL,
+        hour   TEXT NOT NULL,
+        count  INTEGER NOT NULL,
+        mean   REAL,
+        m2     REAL,
+        min    REAL,
+        max    REAL,
+        PRIMARY KEY (level, name, metric, hour)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_air_buckets_hour ON air_buckets (hour)",
+    """
+    CREATE TABLE IF NOT EXISTS air_seen (
+        sitename TEXT NOT NULL,
+        hour     TEXT NOT NULL,
+        PRIMARY KEY (sitename, hour)
+    )
+    """,
+    "CREATE INDEX IF NOT EXISTS idx_air_seen_hour ON air_seen (hour)",
+    """
+    CREATE TABLE IF NOT EXISTS air_marks (
+        sitename  TEXT PRIMARY KEY,
+        last_hour TEXT NOT NULL
+    )
+    """,
+]
+
+
+def connect(db_path=STATE_DB):
+    conn = sqlite3.connect(db_path)
+    conn.execute("PRAGMA journal_mode = WAL")
+    with conn:
+        for sql in SCHEMA:
+            conn.execute(sql)
+    return conn
+
+
+def latest_hour(conn):
+    """狀態中最新的小時（沒有資料時為 NaT）"""
+    value = conn.execute("SELECT MAX(last_hour) FROM air_marks").fetchone()[0]
+    return pd.Timestamp(value) if value else pd.NaT
+
+
+# ==================================================
+# 統計量的計算與合併
+# ==================================================
+def aggregate(long, keys):
+    """長格式數值（value 欄）依 keys 分組，計算 count / mean / m2 / min / max"""
+    grouped = long.groupby(keys, sort=False)["value"]
+    stats = grouped.agg(["count", "mean", "min", "max"])
+    stats["m2"] = grouped.var(ddof=0) * stats["count"]
+    return stats[STAT_COLUMNS].reset_index()
+
+
+def combine(new, old, keys):
+    """
+    將新批次的統計量併入既有統計量（Chan 合併公式），只回傳有變動的列
+
+    new / old: 含 keys 與 STAT_COLUMNS 的 DataFrame，old 中沒有的鍵視為空
+    """
+    # 空表讀回的欄位為 object，先統一成浮點數
+    old = old.astype({col: "float64" for col in STAT_COLUMNS})
+    both = new.merge(old, on=keys, how="left", suffixes=("", "_old"))
+    n_old = both["count_old"].fillna(0).to_numpy()
+    n_new = both["count"].to_numpy()
+    n = n_old + n_new
+
+    mean_old = both["mean_old"].fillna(0).to_numpy()
+    delta = both["mean"].to_numpy() - mean_old
+    both["mean"] = mean_old + delta * n_new / n
+    both["m2"] = both["m2_old"].fillna(0).to_numpy() + both["m2"].to_numpy() + delta**2 * n_old * n_new / n
+    both["min"] = np.fmin(both["min"].to_numpy(), both["min_old"].to_numpy())
+    both["max"] = np.fmax(both["max"].to_numpy(), both["max_old"].to_numpy())
+    both["count"] = n.astype(np.int64)
+    return both[keys + STAT_COLUMNS]
+
+
+def merge_groups(stats, keys):
+    """多個統計量（例如視窗內各小時的桶）依 keys 合併成一列"""
+    total = stats.groupby(keys, sort=False)["count"].transform("sum")
+    weighted = stats["count"] * stats["mean"]
+    mean = weighted.groupby([stats[k] for k in keys], sort=False).transform("sum") / total
+    spread = stats["m2"] + stats["count"] * (stats["mean"] - mean) ** 2
+
+    merged = stats.assign(weighted=weighted, spread=spread).groupby(keys, sort=False).agg(
+        count=("count", "sum"),
+        weighted=("weighted", "sum"),
+        m2=("spread", "sum"),
+        min=("min", "min"),
+        max=("max", "max"),
+    )
+    merged["mean"] = merged["weighted"] / merged["count"]
+    return merged[STAT_COLUMNS].reset_index()
+
+
+def with_variance(stats):
+    """m2 → 樣本變異數（與 pandas 的 var() 相同，筆數少於 2 時為 NaN）"""
+    count = stats["count"].to_numpy()
+    variance = np.full(len(stats), np.nan)
+    enough = count > 1
+    variance[enough] = stats["m2"].to_numpy()[enough] / (count[enough] - 1)
+    return stats.drop(columns="m2").assign(var=variance)
+
+
+# ==================================================
+# 增量更新
+# ==================================================
+def snapshot_rows(df):
+    """空汙資料 → 每個 (測站, 小時) 一列：sitename / county / hour / 各指標"""
+    rows = pd.DataFrame({
+        "sitename": df["sitename"].astype(object).to_numpy(),
+        "county": df["county"].astype(object).to_numpy(),
+        "hour": pd.to_datetime(df["datacreationdate"], errors="coerce").dt.floor("h").to_numpy(),
+    })
+    for metric in METRICS:
+        rows[metric] = pd.to_numeric(df[metric], errors="coerce").to_numpy(dtype="float64")
+    rows = rows.dropna(subset=["sitename", "county", "hour"])
+    return rows.drop_duplicates(["sitename", "hour"]).reset_index(drop=True)
+
+
+def unseen_rows(conn, rows):
+    """
+    去掉已處理過的 (測站, 小時)
+
+    回傳 (新資料列, 因太舊而無法判斷、被略過的筆數)
+    """
+    hours = rows["hour"].dt.strftime(TIME_FORMAT)
+    seen = pd.read_sql_query(
+        "SELECT sitename, hour FROM air_seen WHERE hour BETWEEN ? AND ?",
+        conn, params=(hours.min(), hours.max()),
+    )
+    keys = pd.MultiIndex.from_arrays([rows["sitename"], hours])
+    fresh = ~keys.isin(pd.MultiIndex.from_frame(seen))
+
+    # 早於保留期間的列：air_seen 已清掉，只能以各測站處理過的最新小時判斷
+    latest = latest_hour(conn)
+    skipped = 0
+    if pd.notna(latest):
+        marks = dict(conn.execute("SELECT sitename, last_hour FROM air_marks").fetchall())
+        mark = rows["sitename"].map(marks).fillna("").to_numpy(dtype=object)
+        too_old = (rows["hour"] <= latest - RETENTION).to_numpy() & (hours.to_numpy(dtype=object) <= mark)
+        skipped = int((fresh & too_old).sum())
+        fresh &= ~too_old
+
+    return rows[fresh].reset_index(drop=True), skipped
+
+
+def long_values(rows):
+    """各層級、各指標的長格式數值：level / name / metric / hour / value（缺值不列入）"""
+    long = rows.melt(
+        id_vars=["sitename", "county", "hour"], value_vars=METRICS, var_name="metric", value_name="value"
+    ).dropna(subset=["value"])
+    return pd.concat(
+        [long.assign(level=level, name=long[column]) for level, column in LEVELS.items()],
+        ignore_index=True,
+    )[BUCKET_KEYS + ["value"]]
+
+
+def upsert(conn, table, stats, keys):
+    columns = keys + STAT_COLUMNS
+    records = stats[columns].astype(object).where(stats[columns].notna(), None)
+    conn.executemany(
+        f"INSERT OR REPLACE INTO {table} ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+        records.itertuples(index=False, name=None),
+    )
+
+
+def update(df, db_path=STATE_DB):
+    """
+    將一批空汙快照併入累計統計，回傳實際併入的 (測站, 小時) 筆數
+
+    只讀寫與這批資料相關的狀態（同時段的桶、各縣市 / 測站的累計值），
+    成本與新資料筆數成正比，與已累積的歷史長度無關
+    """
+    rows = snapshot_rows(df)
+    if rows.empty:
+        return 0
+
+    conn = connect(db_path)
+    try:
+        with conn:
+            rows, skipped = unseen_rows(conn, rows)
+            if skipped:
+                print(f"⚠️ {skipped} 筆快照早於保留期間（{RETENTION.days} 天）且可能已處理過，略過")
+            if rows.empty:
+                return 0
+
+            hours = rows["hour"].dt.strftime(TIME_FORMAT)
+            long = long_values(rows)
+            long["hour"] = long["hour"].dt.strftime(TIME_FORMAT)
+
+            # 全期間累計：縣市與測站數量有限，整表讀入
+            totals = pd.read_sql_query("SELECT * FROM air_totals", conn)
+            upsert(conn, "air_totals", combine(aggregate(long, TOTAL_KEYS), totals, TOTAL_KEYS), TOTAL_KEYS)
+
+            # 每小時的桶：只讀入這批資料時段內的桶
+            buckets = pd.read_sql_query(
+                "SELECT * FROM air_buckets WHERE hour BETWEEN ? AND ?",
+                conn, params=(hours.min(), hours.max()),
+            )
+            upsert(conn, "air_buckets", combine(aggregate(long, BUCKET_KEYS), buckets, BUCKET_KEYS), BUCKET_KEYS)
+
+            conn.executemany(
+                "INSERT OR IGNORE INTO air_seen VALUES (?, ?)",
+                zip(rows["sitename"], hours),
+            )
+            marks = pd.DataFrame({"sitename": rows["sitename"], "hour": hours}).groupby("sitename")["hour"].max()
+            conn.executemany(
+                "INSERT INTO air_marks VALUES (?, ?) "
+                "ON CONFLICT (sitename) DO UPDATE SET last_hour = MAX(last_hour, excluded.last_hour)",
+                marks.items(),
+            )
+
+            # 清掉超出保留期間的桶與處理紀錄
+            cutoff = (latest_hour(conn) - RETENTION).strftime(TIME_FORMAT)
+            conn.execute("DELETE FROM air_buckets WHERE hour <= ?", (cutoff,))
+            conn.execute("DELETE FROM air_seen WHERE hour <= ?", (cutoff,))
+    finally:
+        conn.close()
+
+    return len(rows)
+
+
+# ==================================================
+# 查詢
+# ==================================================
+def has_state(db_path=STATE_DB):
+    """是否已有累計統計"""
+    if not os.path.exists(db_path):
+        return False
+    conn = connect(db_path)
+    try:
+        return conn.execute("SELECT 1 FROM air_totals LIMIT 1").fetchone() is not None
+    finally:
+        conn.close()
+
+
+def summary(level="county", db_path=STATE_DB, conn=None):
+    """
+    各縣市（level="county"）或各測站（level="site"）的統計
+
+    conn: 直接使用已開啟的連線（例如 query_service 的唯讀連線池）
+
+    回傳長格式 DataFrame：name / metric / window（all、24h、7d）/ count / mean / var / min / max
+    """
+    if level not in LEVELS:
+        raise ValueError(f"未知的統計層級：{level}")
+
+    own = conn is None
+    conn = connect(db_path) if own else conn
+    try:
+        totals = pd.read_sql_query(
+            "SELECT name, metric, count, mean, m2, min, max FROM air_totals WHERE level = ?",
+            conn, params=(level,),
+        )
+        parts = [totals.assign(window="all")]
+
+        latest = latest_hour(conn)
+        for window, span in WINDOWS.items():
+            if pd.isna(latest):
+                break
+            buckets = pd.read_sql_query(
+                "SELECT name, metric, count, mean, m2, min, max FROM air_buckets "
+                "WHERE level = ? AND hour > ?",
+                conn, params=(level, (latest - span).strftime(TIME_FORMAT)),
+            )
+            if not buckets.empty:
+                parts.append(merge_groups(buckets, ["name", "metric"]).assign(window=window))
+    finally:
+        if own:
+            conn.close()
+
+    result = with_variance(pd.concat(parts, ignore_index=True))
+    return result[["name", "metric", "window", "count", "mean", "var", "min", "max"]].sort_values(
+        ["name", "metric", "window"], ignore_index=True
+    )
+
+
+def county_means(db_path=STATE_DB):
+    """各縣市全期間的平均 PM2.5 / AQI（取代 air_df.groupby("county").mean()）"""
+    table = summary("county", db_path)
+    table = table[table["window"] == "all"]
+    means = table.pivot(index="name", columns="metric", values="mean")
+    means = means.reindex(columns=METRICS).rename_axis(index="county", columns=None)
+    return means.reset_index()
+
+
+# ---------- 主程式進入點 ----------
+# 用法：python air_rolling.py [空汙 XML 檔案 ...]
+if __name__ == "__main__":
+    from air_quality_xml_to_csv import read_air_quality
+
+    for path in sys.argv[1:] or ["空汙.xml"]:
+        added = update(read_air_quality(path, columns=["sitename", "county", "datacreationdate"] + METRICS))
+        print(f"✅ {path}：併入 {added} 個測站小時")
+    print(summary("county").to_string(index=False))
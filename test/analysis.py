@@ -1,22 +1,33 @@
 import pandas as pd
 import sqlite3
-import matplotlib.pyplot as plt
-from matplotlib import font_manager
-from matplotlib.ticker import MaxNLocator, StrMethodFormatter
-import seaborn as sns
+from functools import lru_cache
+
+import gazetteer
+import station_summary
+from intermediates import FLOAT32_COLUMNS, compact, replace_text, write_table
 
 # ==================================================
 # 一、圖表與中文字型設定
 # ==================================================
-# 指定 Windows 內建的微軟正黑體，避免中文亂碼
-font_path = "C:/Windows/Fonts/msjh.ttc"
-font_prop = font_manager.FontProperties(fname=font_path)
+# matplotlib / seaborn 載入很慢，只在第一次繪圖時才載入並設定，
+# 只做資料清理與儲存時不需要付出這個成本
+@lru_cache(maxsize=None)
+def plot_setup():
+    """載入繪圖套件並完成設定，回傳 (plt, font_prop)"""
+    import matplotlib.pyplot as plt
+    import seaborn as sns
+    from chart_utils import cjk_font
+
+    # 自動尋找系統中的中文字型（Windows 為微軟正黑體），避免中文亂碼
+    font_prop = cjk_font()
+
+    # 避免負號顯示成方塊
+    plt.rcParams["axes.unicode_minus"] = False
 
-# 避免負號顯示成方塊
-plt.rcParams["axes.unicode_minus"] = False
+    # 使用 seaborn 美化圖表風格
+    sns.set(style="whitegrid")
 
-# 使用 seaborn 美化圖表風格
-sns.set(style="whitegrid")
+    return plt, font_prop
 
 
 # ==================================================
@@ -41,12 +52,13 @@ def clean_data(df):
     2. 移除 city / district 為空的資料
     3. 只保留合法縣市
     4. 移除行政區為空字串的資料
-    5. 移除重複資料
+    5. 只保留屬於該縣市的行政區（gazetteer 行政區索引）
+    6. 移除重複資料
     """
 
-    # 統一用字
-    df["city"] = df["city"].str.replace("臺", "台")
-    df["district"] = df["district"].str.replace("臺", "台")
+    # 統一用字（類別欄位只需處理類別值）
+    df["city"] = replace_text(df["city"], "臺", "台")
+    df["district"] = replace_text(df["district"], "臺", "台")
 
     # 移除空值
     df = df.dropna(subset=["city", "district"])
@@ -57,41 +69,258 @@ def clean_data(df):
     # 移除行政區為空字串
     df = df[df["district"].str.strip() != ""]
 
+    # 只保留合法行政區（相同「縣市 × 行政區」組合只查詢一次）
+    df = df[gazetteer.valid_mask(df["city"], df["district"])]
+
     # 移除重複資料
     df = df.drop_duplicates()
 
+    # 篩選後已不存在的縣市 / 行政區不保留在類別中
+    for col in ["city", "district"]:
+        if isinstance(df[col].dtype, pd.CategoricalDtype):
+            df[col] = df[col].cat.remove_unused_categories()
+
     return df
 
 
 # ==================================================
 # 四、儲存清洗後資料（CSV + SQLite）
 # ==================================================
-def save_files(df):
+# 檢驗站資料欄位（station_no 為主鍵）
+STATION_COLUMNS = [
+    "station_no", "station_name", "tel", "address",
+    "latitude", "longitude", "note", "city", "district",
+]
+
+STATIONS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS stations (
+    station_no   TEXT PRIMARY KEY,
+    station_name TEXT,
+    tel          TEXT,
+    address      TEXT,
+    latitude     REAL,
+    longitude    REAL,
+    note         TEXT,
+    city         TEXT,
+    district     TEXT,
+    is_active    INTEGER NOT NULL DEFAULT 1,
+    updated_at   TEXT
+)
+"""
+
+# 儀表板常用的查詢條件建立索引；另提供只含營運中檢驗站的 view
+STATIONS_INDEXES = [
+    "CREATE INDEX IF NOT EXISTS idx_stations_city ON stations (city)",
+    "CREATE INDEX IF NOT EXISTS idx_stations_city_district ON stations (city, district)",
+    "CREATE VIEW IF NOT EXISTS active_stations AS "
+    "SELECT * FROM stations WHERE is_active = 1",
+]
+
+
+def ensure_stations_table(conn):
+    """
+    建立 stations 資料表與索引
+
+    以下舊版資料表第一次執行時會搬移成新結構（資料保留）：
+    - 以 to_sql 整表覆寫建立、沒有主鍵與 is_active 欄位
+    - 座標欄位為 TEXT（改為 REAL）
+
+    同時建立各縣市 / 行政區的彙總表（station_summary）
+    """
+
+    columns = {row[1]: row[2] for row in conn.execute("PRAGMA table_info(stations)")}
+    migrate = bool(columns) and (
+        "is_active" not in columns
+        or any(columns.get(col) != "REAL" for col in FLOAT32_COLUMNS)
+    )
+
+    if migrate:
+        keep = STATION_COLUMNS + [c for c in ["is_active", "updated_at"] if c in columns]
+        select = ", ".join(
+            f"CAST({c} AS REAL)" if c in FLOAT32_COLUMNS else c for c in keep
+        )
+        conn.execute("ALTER TABLE stations RENAME TO stations_legacy")
+        conn.execute(STATIONS_SCHEMA)
+        conn.execute(
+            f"INSERT OR REPLACE INTO stations ({', '.join(keep)}) "
+            f"SELECT {select} FROM stations_legacy"
+        )
+        conn.execute("DROP TABLE stations_legacy")
+    else:
+        conn.execute(STATIONS_SCHEMA)
+
+    for sql in STATIONS_INDEXES:
+        conn.execute(sql)
+
+    # 搬移後的資料表沒有 trigger 維護過的計數，彙總表需整表重算
+    station_summary.ensure_summary_tables(conn, rebuild=migrate)
+
+
+def upsert_stations(df, db_path="inspection_stations.db", batch_size=5000, changes=None):
+    """
+    以 station_no 為鍵，增量更新 SQLite 的 stations 資料表：
+    1. 新的檢驗站 → 新增
+    2. 內容有變動的檢驗站 → 更新（未變動者不寫入）
+    3. 本次資料中已不存在的檢驗站 → 標記 is_active = 0（軟刪除）
+
+    全部在同一個交易內以 executemany 分批寫入，並使用 WAL 模式，
+    寫入期間其他連線仍可讀取
+
+    彙總表（station_summary）由 trigger 隨實際變動的列增量更新；
+    新增超過一半（例如第一次匯入）時改為寫入後整表重算，比逐列 trigger 快
+
+    changes: snapshot_diff.diff_against_db(record=False) 的比對結果，
+             變更紀錄與檢驗站在同一個交易內寫入（寫入失敗時不會留下沒發生的變更）
+
+    回傳 dict：inserted / updated / deactivated 筆數
+    """
+
+    now = pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S")
+
+    # float32 座標以最短表示法轉成 float（121.54101，而非 121.54100799560547），
+    # 與 CSV 輸出的數值相同；NaN 轉為 None，寫入 SQLite 時才會成為 NULL
+    values = df[STATION_COLUMNS].copy()
+    for col in FLOAT32_COLUMNS:
+        coords = pd.to_numeric(values[col], errors="coerce").astype("float32")
+        values[col] = pd.to_numeric(coords.astype(str), errors="coerce")
+    records = (
+        values
+        .astype(object)
+        .where(values.notna(), None)
+        .itertuples(index=False, name=None)
+    )
+
+    cols = ", ".join(STATION_COLUMNS)
+    placeholders = ", ".join("?" * (len(STATION_COLUMNS) + 1))
+    assignments = ", ".join(f"{c} = excluded.{c}" for c in STATION_COLUMNS[1:])
+    changed = " OR ".join(f"{c} IS NOT excluded.{c}" for c in STATION_COLUMNS[1:])
+
+    upsert_sql = f"""
+        INSERT INTO stations ({cols}, updated_at) VALUES ({placeholders})
+        ON CONFLICT (station_no) DO UPDATE SET
+            {assignments}, is_active = 1, updated_at = excluded.updated_at
+        WHERE stations.is_active = 0 OR {changed}
+    """
+
+    conn = sqlite3.connect(db_path)
+    try:
+        conn.execute("PRAGMA journal_mode = WAL")
+
+        with conn:
+            ensure_stations_table(conn)
+
+            # 本次資料的 station_no 先放進暫存表，用來判斷新增與軟刪除
+            conn.execute("DROP TABLE IF EXISTS temp.feed_ids")
+            conn.execute("CREATE TEMP TABLE feed_ids (station_no TEXT PRIMARY KEY)")
+            conn.executemany(
+                "INSERT OR IGNORE INTO temp.feed_ids VALUES (?)",
+                ((no,) for no in df["station_no"]),
+            )
+
+            inserted = conn.execute(
+                "SELECT COUNT(*) FROM temp.feed_ids "
+                "WHERE station_no NOT IN (SELECT station_no FROM stations)"
+            ).fetchone()[0]
+
+            bulk = inserted * 2 > conn.execute("SELECT COUNT(*) FROM temp.feed_ids").fetchone()[0]
+            if bulk:
+                station_summary.drop_triggers(conn)
+
+            # 分批 executemany，寫入筆數 = 新增 + 更新
+            # （rowcount 不含 trigger 對彙總表的寫入，total_changes 則會包含）
+            written = 0
+            batch = []
+            for record in records:
+                batch.append(record + (now,))
+                if len(batch) == batch_size:
+                    written += conn.executemany(upsert_sql, batch).rowcount
+                    batch = []
+            if batch:
+                written += conn.executemany(upsert_sql, batch).rowcount
+
+            deactivated = conn.execute(
+                "UPDATE stations SET is_active = 0, updated_at = ? "
+                "WHERE is_active = 1 "
+                "AND station_no NOT IN (SELECT station_no FROM temp.feed_ids)",
+                (now,),
+            ).rowcount
+
+            conn.execute("DROP TABLE temp.feed_ids")
+
+            if bulk:
+                station_summary.rebuild_summaries(conn)
+                station_summary.create_triggers(conn)
+            else:
+                station_summary.refresh_top_districts(conn)
+
+            if changes is not None:
+                import snapshot_diff
+                snapshot_diff.write_changes(conn, changes)
+    finally:
+        conn.close()
+
+    return {
+        "inserted": inserted,
+        "updated": written - inserted,
+        "deactivated": deactivated,
+    }
+
+
+def read_stations(db_path="inspection_stations.db", active_only=True):
+    """
+    從 SQLite 讀回檢驗站資料，並轉回精簡型態（category / float32）
+
+    active_only: 只讀取營運中（is_active = 1）的檢驗站
+    """
+
+    source = "active_stations" if active_only else "stations"
+    conn = sqlite3.connect(db_path)
+    try:
+        df = pd.read_sql_query(f"SELECT {', '.join(STATION_COLUMNS)} FROM {source}", conn)
+    finally:
+        conn.close()
+
+    return compact(df)
+
+
+def save_files(df, export_csv=True, changes=None):
     """
     將清洗後的資料：
-    1. 存成 CSV（方便報告與 Excel 檢視）
-    2. 存入 SQLite（展示資料庫應用）
+    1. 存成 Parquet 中介檔（export_csv 時另存 CSV，方便報告與 Excel 檢視）
+    2. 增量寫入 SQLite（展示資料庫應用；changes 見 upsert_stations）
     """
 
-    # 存成 CSV
-    df.to_csv("inspection_stations_clean.csv", index=False, encoding="utf-8-sig")
+    # 存成中介檔（與 CSV）
+    write_table(df, "inspection_stations_clean", export_csv=export_csv)
 
-    # 存入 SQLite 資料庫
-    conn = sqlite3.connect("inspection_stations.db")
-    df.to_sql("stations", conn, if_exists="replace", index=False)
-    conn.close()
+    # 增量寫入 SQLite 資料庫
+    result = upsert_stations(df, changes=changes)
 
-    print("✅ 已儲存 CSV 與 SQLite")
+    print(
+        f"✅ 已儲存中介檔與 SQLite"
+        f"（新增 {result['inserted']}、更新 {result['updated']}、"
+        f"停用 {result['deactivated']}）"
+    )
 
 
 # ==================================================
 # 五、各縣市檢驗站數量統計（文字分析用）
 # ==================================================
-def analyze_city_count(df):
+def analyze_city_count(df=None, db_path="inspection_stations.db"):
     """
     計算每個縣市的檢驗站數量
     回傳依數量由多到少排序的 Series
+
+    沒有傳入 df 時直接讀 SQLite 的 city_summary（不載入檢驗站明細）
     """
+    if df is None:
+        return (
+            station_summary.city_counts(db_path)
+            .set_index("city")["station_count"]
+            .astype(int)
+            .sort_values(ascending=False)
+        )
+
     return (
         df.groupby("city")
         .size()
@@ -103,12 +332,19 @@ def analyze_city_count(df):
 # ==================================================
 # 六、單一縣市 → 行政區檢驗站數量長條圖
 # ==================================================
-def plot_district_bar_by_city(df, city):
+def plot_district_bar_by_city(df, city, output_dir=None, fmt="png"):
     """
     功能說明：
     繪製「指定縣市」各行政區的檢驗站數量長條圖
+    output_dir 有指定時輸出成圖檔（png / svg），否則以視窗顯示
+
+    df 可為檢驗站明細，或已彙總的 district / station_count（station_summary.district_counts）
     """
 
+    plt, font_prop = plot_setup()
+    from matplotlib.ticker import MaxNLocator, StrMethodFormatter
+    from chart_utils import save_or_show
+
     # 統一縣市用字
     city = city.replace("臺", "台")
 
@@ -120,13 +356,12 @@ def plot_district_bar_by_city(df, city):
         print(f"⚠️ {city} 無資料")
         return
 
-    # 計算各行政區的檢驗站數量
-    summary = (
-        data.groupby("district")
-        .size()
-        .astype(int)
-        .sort_values(ascending=False)
-    )
+    # 計算各行政區的檢驗站數量（已彙總時直接使用）
+    if "station_count" in data.columns:
+        summary = data.set_index("district")["station_count"].sort_index()
+    else:
+        summary = data.groupby("district").size()
+    summary = summary.astype(int).sort_values(ascending=False)
 
     # 建立圖表
     fig, ax = plt.subplots(figsize=(10, 6))
@@ -168,50 +403,87 @@ def plot_district_bar_by_city(df, city):
         )
 
     plt.tight_layout()
-    plt.show()
+    return save_or_show(fig, output_dir, f"district_bar_{city}", fmt)
 
 
 # ==================================================
 # 七、分析每個縣市「檢驗站最多的行政區（Top 1）」
 # ==================================================
-def analyze_top_district_by_city(df):
+# 取前 k 名時名次相同的處理方式（對應 groupby rank 的 method）
+#   first: 剛好取 k 筆，同分時依原資料順序（計數結果即依名稱排序）
+#   all  : 與第 k 名同分的全部保留（1, 2, 2, 4 → 前 2 名取 3 筆）
+#   dense: 取前 k 種數值（1, 2, 2, 3 → 前 2 名取 3 筆）
+TIE_METHODS = {"first": "first", "all": "min", "dense": "dense"}
+
+
+def top_k_per_group(df, by, value, k=1, ties="first", ascending=False):
     """
-    計算每個縣市中：
-    檢驗站數量最多的行政區（Top 1）
+    每個群組取 value 最大（ascending=True 時最小）的前 k 筆
+
+    參數說明：
+    by   : 分組欄位，可為多個欄位（例如 ["city", "district"]）
+    value: 排名依據的數值欄位，缺值不列入排名
+    ties : 同分處理方式（first / all / dense，見 TIE_METHODS）
+
+    以一次分組排名完成，不需要逐群組篩選；
+    回傳多一個 rank 欄位，依分組欄位與名次排序
     """
 
-    result = []
+    if ties not in TIE_METHODS:
+        raise ValueError(f"ties 必須是 {', '.join(TIE_METHODS)} 其中之一")
 
-    for city in sorted(df["city"].unique()):
-        city_df = df[df["city"] == city]
+    by = [by] if isinstance(by, str) else list(by)
 
-        summary = (
-            city_df.groupby("district")
-            .size()
-            .astype(int)
-            .sort_values(ascending=False)
-        )
+    rank = df.groupby(by, observed=True, sort=False)[value].rank(
+        method=TIE_METHODS[ties], ascending=ascending
+    )
+    keep = rank <= k
+
+    top = df[keep].assign(rank=rank[keep].astype(int))
+    return top.sort_values(by + ["rank"], kind="stable").reset_index(drop=True)
 
-        # 若該縣市有資料，取第一名行政區
-        if not summary.empty:
-            result.append({
-                "city": city,
-                "top_district": summary.index[0],
-                "station_count": summary.iloc[0]
-            })
 
-    return pd.DataFrame(result)
+def top_k_counts(df, by, item, k=1, ties="first", count_name="station_count"):
+    """
+    計算每個群組中各項目的筆數，取筆數最多的前 k 個項目
+
+    例如 by="city", item="district"：每個縣市檢驗站最多的行政區；
+        by="county", item="sitename"：每個縣市資料筆數最多的空品測站
+    """
+
+    by = [by] if isinstance(by, str) else list(by)
+    counts = df.groupby(by + [item], observed=True).size().reset_index(name=count_name)
+    return top_k_per_group(counts, by, count_name, k=k, ties=ties)
+
+
+def analyze_top_district_by_city(df=None, k=1, ties="first", db_path="inspection_stations.db"):
+    """
+    計算每個縣市中：
+    檢驗站數量最多的行政區（預設 Top 1，k > 1 時每個縣市取前 k 名）
+
+    沒有傳入 df 時直接讀 SQLite 的彙總表（top_district / district_summary）
+    """
+
+    if df is None:
+        top = station_summary.top_districts(k=k, ties=ties, db_path=db_path)
+    else:
+        top = top_k_counts(df, "city", "district", k=k, ties=ties)
+    return top.rename(columns={"district": "top_district"})
 
 
 # ==================================================
 # 八、繪製「各縣市檢驗站最多行政區」總覽圖
 # ==================================================
-def plot_top_district_summary(top_df):
+def plot_top_district_summary(top_df, output_dir=None, fmt="png"):
     """
     將每個縣市檢驗站最多的行政區
     用一張長條圖進行整體比較
     """
 
+    plt, font_prop = plot_setup()
+    from matplotlib.ticker import MaxNLocator
+    from chart_utils import save_or_show
+
     fig, ax = plt.subplots(figsize=(14, 6))
 
     bars = ax.bar(
@@ -255,4 +527,4 @@ def plot_top_district_summary(top_df):
         )
 
     plt.tight_layout()
-    plt.show()
+    return save_or_show(fig, output_dir, "top_district_summary", fmt)
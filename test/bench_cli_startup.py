@@ -0,0 +1,71 @@
+import glob
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+# ==================================================
+# 量測 cli.py 各子指令的冷啟動時間
+# ==================================================
+# 在暫存目錄複製一份程式與資料後依序執行各子指令（不會覆寫目前目錄的輸出），
+# 以 python -X importtime 統計「匯入模組」所花的時間，即每次排程執行的固定成本
+COMMANDS = [
+    ["ingest-stations"],
+    ["ingest-air"],
+    ["analyze"],
+    ["plot", "--output-dir", "charts"],
+]
+
+# -X importtime 輸出格式：import time: self | cumulative | 模組名稱（縮排表示層級）
+IMPORT_LINE = re.compile(r"import time:\s+\d+ \|\s+(\d+) \| ( *)(\S+)")
+
+
+def import_cost(stderr):
+    """加總最外層模組的累計匯入時間（秒），並回傳是否載入了 matplotlib"""
+    total = 0
+    loaded_matplotlib = False
+    for match in IMPORT_LINE.finditer(stderr):
+        cumulative, indent, module = match.groups()
+        if not indent:
+            total += int(cumulative)
+        if module == "matplotlib":
+            loaded_matplotlib = True
+    return total / 1e6, loaded_matplotlib
+
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+
+    with tempfile.TemporaryDirectory() as tmp:
+        for pattern in ["*.py", "*.xml", "air_quality.csv"]:
+            for path in glob.glob(os.path.join(here, pattern)):
+                shutil.copy(path, tmp)
+
+        env = dict(os.environ, MPLBACKEND="Agg")
+        print(f"{'子指令':<18}{'匯入時間':>10}{'總執行時間':>12}  matplotlib")
+
+        for command in COMMANDS:
+            start = time.perf_counter()
+            result = subprocess.run(
+                [sys.executable, "-X", "importtime", "cli.py", *command],
+                cwd=tmp, env=env, capture_output=True, text=True,
+            )
+            elapsed = time.perf_counter() - start
+
+            if result.returncode != 0:
+                print(f"❌ {' '.join(command)} 執行失敗\n{result.stderr[-2000:]}")
+                continue
+
+            imports, loaded_matplotlib = import_cost(result.stderr)
+            print(
+                f"{command[0]:<18}{imports:>9.2f}s{elapsed:>11.2f}s  "
+                f"{'是' if loaded_matplotlib else '否'}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,156 @@
+import argparse
+import datetime
+import json
+import os
+import platform
+import tempfile
+import time
+
+import synthetic_data
+from instrumentation import StageRecorder
+
+
+# ==================================================
+# 全流程效能基準：以合成資料量測每個階段的時間與峰值記憶體
+# ==================================================
+# 所有階段都在暫存目錄中執行（不會覆寫目前目錄的中介檔 / SQLite / CSV），
+# 結果以 JSON Lines 附加到結果檔，每次執行一行，可比較不同版本的數據
+#
+# 用法：
+#   python bench_pipeline.py --stations 1000000 --air-records 1000000
+#   python bench_pipeline.py --stations 10000 --skip-charts --results bench.jsonl
+RESULTS_FILE = "bench_results.jsonl"
+
+
+# ==================================================
+# 各階段
+# ==================================================
+def run_stages(station_xml, air_xml, skip_charts=False, workers=1):
+    """依 main.main 的順序執行各階段，回傳每個階段的量測紀錄"""
+
+    import analysis
+    import main
+    from air_quality_xml_to_csv import xml_to_csv
+    from moenv_crawler import crawl_moenv_xml
+
+    recorder = StageRecorder()
+
+    station_df = recorder.run("crawl_moenv_xml", crawl_moenv_xml, station_xml)
+    station_df = recorder.run("clean_data", analysis.clean_data, station_df)
+    recorder.run("save_files", analysis.save_files, station_df)
+    recorder.run("xml_to_csv", xml_to_csv, air_xml, "air_quality.csv")
+    air_df = recorder.run("load_air", main.load_air, "air_quality.csv")
+    recorder.run(
+        "analyze", main.analyze, station_df, air_df,
+        db_path="inspection_stations.db", air_state="air_rolling.db",
+    )
+
+    if not skip_charts:
+        import render_charts
+        recorder.run("charts", render_charts.render_all, "charts", "png", workers)
+
+    recorder.report()
+    return recorder.records
+
+
+# ==================================================
+# 結果檔：附加一行，並與上一次相同參數的結果比較
+# ==================================================
+def previous_run(results_path, params):
+    """找出結果檔中最後一筆相同參數的紀錄"""
+    if not os.path.exists(results_path):
+        return None
+
+    last = None
+    with open(results_path, encoding="utf-8") as f:
+        for line in f:
+            run = json.loads(line)
+            if run.get("params") == params:
+                last = run
+    return last
+
+
+def compare(current, previous):
+    """列出各階段時間與峰值記憶體相對上次的變化"""
+    before = {r["stage"]: r for r in previous["stages"]}
+
+    print(f"\n與 {previous['timestamp']} 的結果比較：")
+    for record in current["stages"]:
+        old = before.get(record["stage"])
+        if not old or not old["wall_s"]:
+            continue
+        wall = (record["wall_s"] / old["wall_s"] - 1) * 100
+        mem = (record["peak_rss_mb"] / old["peak_rss_mb"] - 1) * 100 if old["peak_rss_mb"] else 0
+        flag = "⚠️" if wall > 10 or mem > 10 else "  "
+        print(f"{flag} {record['stage']:<18} 時間 {wall:+7.1f}%   峰值記憶體 {mem:+7.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="以合成資料量測各處理階段的效能")
+    parser.add_argument("--stations", type=int, default=100_000, help="檢測站筆數")
+    parser.add_argument("--air-records", type=int, default=100_000, help="空汙資料筆數")
+    parser.add_argument("--sites", type=int, default=None, help="空品測站數（預設同樣本）")
+    parser.add_argument("--seed", type=int, default=0, help="亂數種子")
+    parser.add_argument("--skip-charts", action="store_true", help="不量測繪圖階段")
+    parser.add_argument("--workers", type=int, default=1, help="繪圖子行程數（1 為不開子行程）")
+    parser.add_argument("--results", default=RESULTS_FILE, help="結果檔（JSON Lines）")
+    args = parser.parse_args()
+
+    params = {
+        "stations": args.stations,
+        "air_records": args.air_records,
+        "sites": args.sites,
+        "seed": args.seed,
+        "charts": not args.skip_charts,
+        "workers": args.workers,
+    }
+    here = os.path.dirname(os.path.abspath(__file__))
+    results_path = os.path.abspath(args.results)
+
+    with tempfile.TemporaryDirectory() as tmp:
+        station_xml = os.path.join(tmp, "stations.xml")
+        air_xml = os.path.join(tmp, "air.xml")
+
+        start = time.perf_counter()
+        synthetic_data.write_station_xml(
+            station_xml, args.stations, seed=args.seed,
+            sample_xml=os.path.join(here, synthetic_data.STATION_SAMPLE),
+        )
+        synthetic_data.write_air_xml(
+            air_xml, args.air_records, sites=args.sites, seed=args.seed,
+            sample_xml=os.path.join(here, synthetic_data.AIR_SAMPLE),
+        )
+        print(
+            f"📦 合成資料：檢測站 {args.stations} 筆（{os.path.getsize(station_xml) / 2**20:.0f} MB）、"
+            f"空汙 {args.air_records} 筆（{os.path.getsize(air_xml) / 2**20:.0f} MB），"
+            f"{time.perf_counter() - start:.1f} 秒\n"
+        )
+
+        # 各階段的輸出都寫在暫存目錄
+        cwd = os.getcwd()
+        os.chdir(tmp)
+        try:
+            stages = run_stages(station_xml, air_xml, args.skip_charts, args.workers)
+        finally:
+            os.chdir(cwd)
+
+    run = {
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "params": params,
+        "stages": stages,
+    }
+
+    previous = previous_run(results_path, params)
+    with open(results_path, "a", encoding="utf-8") as f:
+        f.write(json.dumps(run, ensure_ascii=False) + "\n")
+    print(f"\n✅ 結果已附加到 {results_path}")
+
+    if previous:
+        compare(run, previous)
+
+
+if __name__ == "__main__":
+    main()
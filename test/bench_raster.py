@@ -0,0 +1,81 @@
+import argparse
+import resource
+import time
+
+import numpy as np
+
+import raster
+
+
+# ==================================================
+# 網格分箱（raster.py）吞吐量
+# ==================================================
+# 以目前的檢驗站座標為中心產生大量隨機點（分段產生，不會一次放進記憶體），
+# 量測 bin_points 的每秒點數與行程的最大記憶體用量，並與 np.histogram2d 比對前一段的結果
+#
+# 用法：
+#   python bench_raster.py
+#   python bench_raster.py --points 50000000 --chunk-points 1000000 --cell-deg 0.005
+def synthetic_chunks(centers, points, chunk_points, seed=0):
+    """在各中心附近（約 ±3 公里）產生隨機點，每次 chunk_points 筆"""
+    rng = np.random.default_rng(seed)
+    lat, lon = centers
+    for start in range(0, points, chunk_points):
+        n = min(chunk_points, points - start)
+        pick = rng.integers(0, len(lat), n)
+        yield (
+            lat[pick] + rng.normal(0, 0.03, n),
+            lon[pick] + rng.normal(0, 0.03, n),
+        )
+
+
+def check(grid, centers, chunk_points):
+    """第一段的分箱結果應與 np.histogram2d 相同"""
+    chunk = next(synthetic_chunks(centers, chunk_points, chunk_points))
+    counts, _, _, _ = raster.bin_points([chunk], grid)
+    edges = [
+        grid.lat_min + np.arange(grid.rows + 1) * grid.cell_deg,
+        grid.lon_min + np.arange(grid.cols + 1) * grid.cell_deg,
+    ]
+    expected, _, _ = np.histogram2d(chunk[0], chunk[1], bins=edges)
+    # 恰好落在格線上的點可能因浮點誤差分到相鄰的格，只要求總數相同、差異極少
+    differ = int(np.abs(counts - expected).sum())
+    print(f"{'✅' if differ <= len(chunk[0]) // 100_000 else '❌'} 與 np.histogram2d 比對：{differ} 個點分格不同")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="網格分箱吞吐量")
+    parser.add_argument("--points", type=int, default=20_000_000, help="點數")
+    parser.add_argument("--chunk-points", type=int, default=raster.CHUNK_POINTS, help="每段點數")
+    parser.add_argument("--cell-deg", type=float, default=raster.CELL_DEG, help="每格的經緯度大小")
+    args = parser.parse_args()
+
+    from intermediates import read_table
+
+    stations = read_table("inspection_stations_clean", columns=["latitude", "longitude"]).dropna()
+    centers = (
+        stations["latitude"].to_numpy(dtype="float64"),
+        stations["longitude"].to_numpy(dtype="float64"),
+    )
+    grid = raster.RasterGrid(raster.BOUNDS, args.cell_deg)
+    print(f"📂 {args.points:,} 點，每段 {args.chunk_points:,}，網格 {grid.rows} × {grid.cols}")
+
+    check(grid, centers, min(args.chunk_points, args.points))
+
+    # 產生隨機點本身也要時間，分開計時
+    start = time.perf_counter()
+    for _ in synthetic_chunks(centers, args.points, args.chunk_points):
+        pass
+    generate = time.perf_counter() - start
+
+    start = time.perf_counter()
+    rasters = raster.build_rasters(synthetic_chunks(centers, args.points, args.chunk_points), grid)
+    elapsed = time.perf_counter() - start - generate
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"⏱️ 分箱與平滑 {elapsed:.2f} 秒（產生隨機點另需 {generate:.2f} 秒），{args.points / elapsed / 1e6:.1f} M 點/秒")
+    print(f"📊 網格內 {rasters['points_inside']:,} 點，行程最大記憶體 {peak:.0f} MB")
+
+
+if __name__ == "__main__":
+    main()
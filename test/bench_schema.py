@@ -0,0 +1,73 @@
+import argparse
+import os
+import tempfile
+import timeit
+
+import synthetic_data
+from moenv_crawler import crawl_moenv_xml
+
+
+# ==================================================
+# 精簡欄位型態的效果：記憶體用量與 groupby 速度
+# ==================================================
+# 以合成的檢測站 XML 解析出精簡型態的 DataFrame，
+# 再轉回「全部為字串」的舊型態（座標也是 XML 中的字串）比較：
+#   - 每 100 萬筆檢測站佔用的記憶體
+#   - main.py 中 groupby("city") 等分組統計的時間
+def as_text(df, dtype):
+    """轉回舊版的全字串型態（dtype 為 object 或 pandas 預設字串型態 str）"""
+    text = df.copy()
+    for col in text.columns:
+        if col in ("latitude", "longitude"):
+            text[col] = text[col].map("{:.6f}".format)
+        text[col] = text[col].astype(str).astype(dtype)
+    return text
+
+
+def memory_mb(df):
+    return df.memory_usage(deep=True).sum() / 2**20
+
+
+def groupby_seconds(df, repeat=5):
+    """main.py 中的兩種分組統計，取最快一次的時間"""
+    def run():
+        df.groupby("city", observed=True).size()
+        df.groupby(["city", "district"], observed=True).size()
+    return min(timeit.repeat(run, number=1, repeat=repeat))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="精簡欄位型態的記憶體與 groupby 比較")
+    parser.add_argument("--stations", type=int, default=1_000_000, help="檢測站筆數")
+    args = parser.parse_args()
+
+    here = os.path.dirname(os.path.abspath(__file__))
+    with tempfile.TemporaryDirectory() as tmp:
+        xml_path = os.path.join(tmp, "stations.xml")
+        synthetic_data.write_station_xml(
+            xml_path, args.stations,
+            sample_xml=os.path.join(here, synthetic_data.STATION_SAMPLE),
+        )
+        compact_df = crawl_moenv_xml(xml_path)
+
+    frames = {
+        "object（舊版）": as_text(compact_df, object),
+        "str（pandas 預設）": as_text(compact_df, str),
+        "精簡型態": compact_df,
+    }
+
+    per_million = 1_000_000 / len(compact_df)
+    baseline = None
+    print(f"{'型態':<18}{'記憶體 / 百萬筆':>14}{'groupby 時間':>14}")
+    for name, df in frames.items():
+        mem = memory_mb(df) * per_million
+        seconds = groupby_seconds(df)
+        baseline = baseline or (mem, seconds)
+        print(
+            f"{name:<18}{mem:>11.0f} MB{seconds * 1000:>11.1f} ms"
+            f"   （記憶體 {mem / baseline[0]:.0%}，速度 {baseline[1] / seconds:.1f}x）"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+import argparse
+import http.client
+import os
+import random
+import socket
+import subprocess
+import sys
+import threading
+import time
+import urllib.request
+from urllib.parse import quote, urlsplit
+
+import numpy as np
+
+
+# ==================================================
+# 查詢服務（query_service.py）負載測試
+# ==================================================
+# 多個執行緒各以一條 keep-alive 連線持續送出請求，統計每秒請求數（RPS）、
+# 延遲的 p50 / p99 與快取命中率（回應標頭 X-Cache），各端點分開列出
+#
+# 預設以子行程啟動服務（使用目前目錄的資料），量測時用戶端與服務不共用同一個 GIL
+#
+# 用法：
+#   python bench_service.py
+#   python bench_service.py --threads 16 --duration 30
+#   python bench_service.py --cache-size 0              # 不快取，量測實際查詢成本
+#   python bench_service.py --url http://127.0.0.1:8765 # 對已啟動的服務量測
+CITIES = ["台北市", "新北市", "桃園市", "台中市", "台南市", "高雄市"]
+DISTRICTS = [("台北市", "大安區"), ("新北市", "板橋區"), ("台中市", "西屯區"), ("高雄市", "三民區")]
+
+# 台灣本島範圍（最近檢驗站查詢的隨機座標）
+LAT_RANGE = (22.0, 25.3)
+LON_RANGE = (120.1, 121.9)
+
+
+def request_mix(rng):
+    """一個請求的路徑；最近檢驗站以隨機座標查詢（大多不會命中快取）"""
+    kind = rng.random()
+    if kind < 0.3:
+        city, district = rng.choice(DISTRICTS)
+        return "/stations", f"/stations?city={city}&district={district}"
+    if kind < 0.5:
+        lat = round(rng.uniform(*LAT_RANGE), 3)
+        lon = round(rng.uniform(*LON_RANGE), 3)
+        return "/stations/nearest", f"/stations/nearest?lat={lat}&lon={lon}&k={rng.choice([1, 5])}"
+    if kind < 0.7:
+        return "/districts/top", f"/districts/top?k={rng.choice([1, 3])}&ties={rng.choice(['first', 'all'])}"
+    if kind < 0.9:
+        return "/counties/air", f"/counties/air?county={rng.choice(CITIES)}"
+    return "/counties/air-vs-station", "/counties/air-vs-station"
+
+
+def worker(host, port, deadline, seed, results):
+    """在 deadline 之前持續送出請求，結果 (端點, 秒數, 狀態碼, 是否命中快取) 附加到 results"""
+    rng = random.Random(seed)
+    conn = http.client.HTTPConnection(host, port, timeout=30)
+    local = []
+    try:
+        while time.perf_counter() < deadline:
+            endpoint, path = request_mix(rng)
+            start = time.perf_counter()
+            conn.request("GET", quote(path, safe="/?=&"))
+            response = conn.getresponse()
+            response.read()
+            local.append((endpoint, time.perf_counter() - start, response.status, response.getheader("X-Cache") == "hit"))
+    finally:
+        conn.close()
+        results.extend(local)
+
+
+def run_load(url, threads=8, duration=10.0, warmup=1.0):
+    """對 url 的服務施加負載，回傳 (請求紀錄, 實際秒數)"""
+    parts = urlsplit(url)
+    host, port = parts.hostname, parts.port or 80
+
+    # 暖機：建立最近鄰索引、讀入分析輸出、連線池開啟連線
+    warm = []
+    worker(host, port, time.perf_counter() + warmup, -1, warm)
+
+    results = []
+    start = time.perf_counter()
+    deadline = start + duration
+    pool = [
+        threading.Thread(target=worker, args=(host, port, deadline, seed, results))
+        for seed in range(threads)
+    ]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    return results, time.perf_counter() - start
+
+
+def report(results, elapsed):
+    """各端點與全體的 RPS、p50 / p99 延遲、命中率、錯誤數"""
+    print(f"\n{'端點':<26}{'請求數':>8}{'RPS':>10}{'p50 ms':>9}{'p99 ms':>9}{'命中率':>8}{'錯誤':>6}")
+
+    def line(name, rows):
+        latency = np.array([r[1] for r in rows]) * 1000
+        hits = sum(r[3] for r in rows)
+        errors = sum(r[2] != 200 for r in rows)
+        print(
+            f"{name:<26}{len(rows):>8}{len(rows) / elapsed:>10.0f}"
+            f"{np.percentile(latency, 50):>9.2f}{np.percentile(latency, 99):>9.2f}"
+            f"{hits / len(rows):>8.0%}{errors:>6}"
+        )
+
+    for endpoint in sorted({r[0] for r in results}):
+        line(endpoint, [r for r in results if r[0] == endpoint])
+    line("全部", results)
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def start_subprocess(cache_size, pool_size):
+    """以子行程啟動服務，等到 /health 回應後回傳 (行程, 網址)"""
+    here = os.path.dirname(os.path.abspath(__file__))
+    port = free_port()
+    process = subprocess.Popen([
+        sys.executable, os.path.join(here, "query_service.py"), "--port", str(port), "--quiet",
+        "--cache-size", str(cache_size), "--pool-size", str(pool_size),
+    ], stdout=subprocess.DEVNULL)
+
+    url = f"http://127.0.0.1:{port}"
+    for _ in range(100):
+        try:
+            urllib.request.urlopen(f"{url}/health", timeout=1).read()
+            return process, url
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError("查詢服務啟動失敗") from None
+            time.sleep(0.1)
+    process.terminate()
+    raise RuntimeError("查詢服務沒有回應")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="查詢服務負載測試（RPS 與 p99 延遲）")
+    parser.add_argument("--url", help="已啟動的服務網址（未指定時以子行程啟動）")
+    parser.add_argument("--threads", type=int, default=8, help="同時送出請求的執行緒（連線）數")
+    parser.add_argument("--duration", type=float, default=10.0, help="量測秒數")
+    parser.add_argument("--cache-size", type=int, default=1024, help="子行程服務的 LRU 快取大小（0 為不快取）")
+    parser.add_argument("--pool-size", type=int, default=4, help="子行程服務的連線池大小")
+    args = parser.parse_args()
+
+    process = None
+    url = args.url
+    if url is None:
+        process, url = start_subprocess(args.cache_size, args.pool_size)
+    try:
+        print(f"📂 {url}：{args.threads} 條連線，{args.duration:.0f} 秒")
+        results, elapsed = run_load(url, args.threads, args.duration)
+    finally:
+        if process is not None:
+            process.terminate()
+            process.wait()
+
+    if not results:
+        print("❌ 沒有完成任何請求")
+        return
+    report(results, elapsed)
+
+
+if __name__ == "__main__":
+    main()
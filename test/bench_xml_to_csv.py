@@ -0,0 +1,112 @@
+import argparse
+import multiprocessing as mp
+import os
+import tempfile
+import time
+import xml.etree.ElementTree as ET
+
+import pandas as pd
+
+from air_quality_xml_to_csv import xml_to_csv
+
+try:
+    import resource
+except ImportError:      # Windows 沒有 resource 模組，只量測時間
+    resource = None
+
+
+# ==================================================
+# 原本的實作（走訪所有節點），保留作為比較基準
+# ==================================================
+def xml_to_csv_full_scan(xml_path, output_csv):
+    tree = ET.parse(xml_path)
+    root = tree.getroot()
+
+    data = []
+    for item in root.iter():
+        sitename = item.findtext("sitename")
+        county = item.findtext("county")
+        if sitename is None or county is None:
+            continue
+
+        data.append({
+            "sitename": sitename.strip(),
+            "county": county.replace("臺", "台").strip(),
+            "aqi": item.findtext("aqi"),
+            "pollutant": item.findtext("pollutant"),
+            "status": item.findtext("status"),
+            "co": item.findtext("co"),
+            "pm2.5": item.findtext("pm2.5"),
+            "pm2.5_avg": item.findtext("pm2.5_avg"),
+            "nox": item.findtext("nox"),
+        })
+
+    df = pd.DataFrame(data)
+    for col in ["aqi", "co", "pm2.5", "pm2.5_avg", "nox"]:
+        df[col] = pd.to_numeric(df[col], errors="coerce")
+    df.to_csv(output_csv, index=False, encoding="utf-8-sig")
+
+
+# ==================================================
+# 產生合成的空汙 XML（重複使用樣本檔中的真實紀錄）
+# ==================================================
+def make_synthetic_feed(sample_xml, out_path, rows):
+    records = [
+        ET.tostring(elem, encoding="unicode")
+        for elem in ET.parse(sample_xml).getroot().iter("data")
+    ]
+
+    with open(out_path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<aqx_p_488>')
+        for i in range(rows):
+            f.write(records[i % len(records)])
+        f.write("</aqx_p_488>")
+
+
+# ==================================================
+# 在獨立的子行程中執行，才能分別量測峰值記憶體
+# ==================================================
+def run_one(func, xml_path, output_csv, queue):
+    start = time.perf_counter()
+    func(xml_path, output_csv)
+    elapsed = time.perf_counter() - start
+
+    peak_mb = None
+    if resource is not None:
+        # Linux 的 ru_maxrss 單位為 KB
+        peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    queue.put((elapsed, peak_mb))
+
+
+def measure(func, xml_path, output_csv):
+    queue = mp.Queue()
+    proc = mp.Process(target=run_one, args=(func, xml_path, output_csv, queue))
+    proc.start()
+    result = queue.get()
+    proc.join()
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description="xml_to_csv 效能比較")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="合成資料筆數")
+    parser.add_argument("--sample", default="空汙.xml", help="樣本 XML 檔案")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        xml_path = os.path.join(tmp, "synthetic.xml")
+        make_synthetic_feed(args.sample, xml_path, args.rows)
+        size_mb = os.path.getsize(xml_path) / 1024 / 1024
+        print(f"📦 合成資料：{args.rows} 筆，{size_mb:.1f} MB")
+
+        for name, func in [
+            ("full_scan（原實作）", xml_to_csv_full_scan),
+            ("xml_to_csv（<data> 串流）", xml_to_csv),
+        ]:
+            elapsed, peak_mb = measure(func, xml_path, os.path.join(tmp, "out.csv"))
+            peak = f"{peak_mb:.0f} MB" if peak_mb is not None else "N/A"
+            print(f"{name:<28} 時間 {elapsed:8.2f} s    峰值記憶體 {peak}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,313 @@
+import argparse
+import glob
+import os
+import re
+import time
+import xml.etree.ElementTree as ET
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from intermediates import from_columns, to_columns
+
+
+# ==================================================
+# 大量匯入歷史快照：一個目錄（或萬用字元）內的所有 XML
+# ==================================================
+# 先依檔名時間排好各檔案的併入順序（種類由檔案的第一筆紀錄判斷），
+# 每個檔案由子行程解析，解析結果以欄式批次（intermediates.to_columns）傳回主行程，
+# 主行程按排好的順序邊收邊併入，同時在途的解析結果最多 workers × IN_FLIGHT_PER_WORKER 份：
+#   - 空汙 XML   → 空汙歷史資料庫（air_history，依日期分檔、重複匯入不會新增）
+#   - 檢測站 XML → SQLite stations 資料表（依時間逐份 upsert，最後狀態即最新快照），
+#                  各快照之間的變更記錄到 station_changes
+# 每個檔案併入前即時顯示進度；解析失敗的檔案列出錯誤後略過，不影響其他檔案
+#
+# 用法：
+#   python bulk_ingest.py archive/
+#   python bulk_ingest.py "archive/空汙_2025-*.xml" --workers 4
+#   python cli.py bulk-ingest archive/ --kind air
+
+# 空汙快照累積到這個筆數就併入歷史資料庫一次（每次併入的批次大小）
+MERGE_ROWS = 200_000
+
+# 每個子行程最多同時有幾份解析結果在途（已送出但尚未併入），
+# 主行程的記憶體用量約為 workers × IN_FLIGHT_PER_WORKER 份快照加上 MERGE_ROWS 筆待併入資料
+IN_FLIGHT_PER_WORKER = 2
+
+# 檔名中的時間，例如 空汙_2025-12-26_2200.xml、stations-20251226.xml
+FILENAME_TIME = re.compile(r"(\d{4})-?(\d{2})-?(\d{2})(?:[T_ -]?(\d{2}):?(\d{2}))?")
+
+
+def expand_sources(sources):
+    """目錄、萬用字元或檔案路徑 → 排序後的 XML 檔案清單（重複者只列一次）"""
+    if isinstance(sources, str):
+        sources = [sources]
+
+    paths = []
+    for source in sources:
+        if os.path.isdir(source):
+            paths += glob.glob(os.path.join(source, "*.xml"))
+        elif glob.has_magic(source):
+            paths += glob.glob(source)
+        else:
+            paths.append(source)
+    return sorted(set(paths))
+
+
+def sniff_kind(path):
+    """由 XML 的第一筆紀錄判斷資料種類：<data> 為空汙，<item-N> 為檢測站"""
+    depth = 0
+    for event, elem in ET.iterparse(path, events=("start", "end")):
+        depth += 1 if event == "start" else -1
+        if event == "start" and depth == 2:
+            if elem.tag == "data":
+                return "air"
+            if elem.tag.startswith("item"):
+                return "stations"
+            break
+    raise ValueError("無法判斷資料種類（不是空汙或檢測站 XML）")
+
+
+def filename_time(path):
+    """檔名中的時間；沒有時以檔案修改時間代替"""
+    match = FILENAME_TIME.search(os.path.basename(path))
+    if match:
+        year, month, day, hour, minute = match.groups()
+        try:
+            return pd.Timestamp(int(year), int(month), int(day), int(hour or 0), int(minute or 0))
+        except ValueError:
+            pass
+    return pd.Timestamp(os.path.getmtime(path), unit="s")
+
+
+# ==================================================
+# 子行程：解析單一檔案
+# ==================================================
+def parse_file(path, kind):
+    """
+    解析一個 XML 快照（在子行程執行）
+
+    回傳 dict：path / kind / rows / seconds / columns（欄式批次，空檔案為 None）
+    """
+    from air_quality_xml_to_csv import read_air_quality
+    from intermediates import concat_frames
+    from moenv_crawler import STATION_COLUMNS, iter_station_batches
+
+    start = time.perf_counter()
+    if kind == "air":
+        df = read_air_quality(path)
+    else:
+        batches = list(iter_station_batches(path))
+        df = concat_frames(batches) if batches else pd.DataFrame(columns=STATION_COLUMNS)
+
+    return {
+        "path": path,
+        "kind": kind,
+        "rows": len(df),
+        "seconds": time.perf_counter() - start,
+        "columns": to_columns(df) if len(df) else None,
+    }
+
+
+# ==================================================
+# 主行程：排定順序、平行解析、依序併入
+# ==================================================
+def plan(paths, kind="auto"):
+    """
+    決定併入順序：依種類分組，各組內依檔名時間（同時間依路徑）排序
+
+    回傳 ({種類: [路徑, ...]}, 失敗清單 [(路徑, 錯誤訊息)])
+    """
+    groups, failures = {"air": [], "stations": []}, []
+    for path in paths:
+        try:
+            file_kind = sniff_kind(path) if kind == "auto" else kind
+            groups[file_kind].append((filename_time(path), path))
+        except Exception as e:
+            failures.append((path, f"{type(e).__name__}: {e}"))
+    return {k: [path for _, path in sorted(v)] for k, v in groups.items()}, failures
+
+
+def parse_ordered(paths, kind, workers=None, failures=None, progress=None):
+    """
+    平行解析 paths，依 paths 的順序逐一產生解析結果（空檔案不產生）
+
+    已送出但尚未取走的檔案最多 workers × IN_FLIGHT_PER_WORKER 個，
+    所以主行程不會同時持有所有檔案的解析結果；
+    失敗的檔案附加到 failures，progress 為 [已完成數, 總數]（多組共用同一個計數）
+    """
+    failures = [] if failures is None else failures
+    progress = progress or [0, len(paths)]
+
+    def report(path, result=None, error=None):
+        progress[0] += 1
+        prefix = f"[{progress[0]}/{progress[1]}]"
+        if error is not None:
+            failures.append((path, error))
+            print(f"{prefix} ❌ {path}：{error}")
+        else:
+            print(f"{prefix} ✅ {path}：{result['rows']} 筆（{result['kind']}，{result['seconds']:.2f} 秒）")
+
+    if workers == 1:
+        for path in paths:
+            try:
+                result = parse_file(path, kind)
+            except Exception as e:
+                report(path, error=f"{type(e).__name__}: {e}")
+                continue
+            report(path, result)
+            if result["columns"] is not None:
+                yield result
+        return
+
+    workers = workers or os.cpu_count() or 1
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        pending = iter(paths)
+        in_flight = deque()
+
+        def submit():
+            path = next(pending, None)
+            if path is not None:
+                in_flight.append((path, pool.submit(parse_file, path, kind)))
+
+        for _ in range(workers * IN_FLIGHT_PER_WORKER):
+            submit()
+
+        # 依順序等最前面的檔案；取走一個就補送一個
+        while in_flight:
+            path, future = in_flight.popleft()
+            submit()
+            try:
+                result = future.result()
+            except Exception as e:
+                report(path, error=f"{type(e).__name__}: {e}")
+                continue
+            report(path, result)
+            if result["columns"] is not None:
+                yield result
+
+
+def merge_air(results, store_dir):
+    """
+    空汙快照依序併入歷史資料庫，每累積 MERGE_ROWS 筆寫入一次，回傳 (快照數, 新增筆數)
+
+    同一批資料也併入各縣市 / 測站的累計統計（air_rolling）與彙總立方體（air_cube）
+    """
+    import air_cube
+    import air_history
+    import air_rolling
+
+    def merge(pending):
+        batch = from_columns(pending)
+        air_rolling.update(batch)
+        air_cube.update_air(batch)
+        return air_history.append_snapshot(batch, store_dir)
+
+    snapshots, added = 0, 0
+    pending, rows = [], 0
+    for result in results:
+        snapshots += 1
+        pending.append(result["columns"])
+        rows += result["rows"]
+        if rows >= MERGE_ROWS:
+            added += merge(pending)
+            pending, rows = [], 0
+    if pending:
+        added += merge(pending)
+    return snapshots, added
+
+
+def merge_stations(results, db_path):
+    """
+    檢測站快照依序逐份清理並 upsert，回傳 (快照數, 累計的新增 / 更新 / 停用筆數)
+
+    每份快照寫入前先與資料庫比對，變更與該份快照在同一個交易內記錄到 station_changes
+    """
+    import analysis
+    import snapshot_diff
+
+    snapshots = 0
+    total = {"inserted": 0, "updated": 0, "deactivated": 0}
+    for result in results:
+        snapshots += 1
+        df = analysis.clean_data(from_columns(result["columns"]))
+        diff = snapshot_diff.diff_against_db(df, db_path, record=False)
+        for key, value in analysis.upsert_stations(df, db_path, changes=diff).items():
+            total[key] += value
+
+    if snapshots:
+        # 最後狀態的各行政區檢驗站數量寫入彙總立方體
+        import air_cube
+        air_cube.update_stations(db_path=db_path)
+    return snapshots, total
+
+
+def bulk_ingest(sources, kind="auto", workers=None, store_dir=None, db_path="inspection_stations.db"):
+    """
+    大量匯入歷史 XML 快照
+
+    參數說明：
+    sources  : 目錄、萬用字元或檔案路徑（可為清單）
+    kind     : "air"、"stations" 或 "auto"（依檔案內容判斷）
+    workers  : 解析的子行程數（None 為 CPU 核心數，1 為不開子行程）
+    store_dir: 空汙歷史資料庫目錄（預設 air_history.HISTORY_DIR）
+    db_path  : 檢測站 SQLite 資料庫
+
+    回傳 dict：files / failures / air_added / stations（upsert 累計筆數）
+    """
+
+    paths = expand_sources(sources)
+    if not paths:
+        print(f"❌ 找不到任何 XML 檔案：{sources}")
+        return {"files": 0, "failures": [], "air_added": 0, "stations": None}
+
+    start = time.perf_counter()
+    print(f"📂 共 {len(paths)} 個檔案，開始解析...")
+    groups, failures = plan(paths, kind)
+    for path, error in failures:
+        print(f"❌ {path}：{error}")
+    progress = [len(failures), len(paths)]
+
+    air_added = 0
+    if groups["air"]:
+        import air_history
+        snapshots, air_added = merge_air(
+            parse_ordered(groups["air"], "air", workers, failures, progress),
+            store_dir or air_history.HISTORY_DIR,
+        )
+        print(f"✅ 空汙歷史資料：{snapshots} 個快照，新增 {air_added} 筆")
+
+    station_total = None
+    if groups["stations"]:
+        snapshots, station_total = merge_stations(
+            parse_ordered(groups["stations"], "stations", workers, failures, progress),
+            db_path,
+        )
+        print(
+            f"✅ 檢測站：{snapshots} 個快照（新增 {station_total['inserted']}、"
+            f"更新 {station_total['updated']}、停用 {station_total['deactivated']}）"
+        )
+
+    if failures:
+        print(f"⚠️ {len(failures)} 個檔案失敗：")
+        for path, error in failures:
+            print(f"   - {path}：{error}")
+    print(f"⏱️ 全部完成，{time.perf_counter() - start:.1f} 秒")
+
+    return {
+        "files": len(paths),
+        "failures": failures,
+        "air_added": air_added,
+        "stations": station_total,
+    }
+
+
+# ---------- 主程式進入點 ----------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="平行匯入目錄中的歷史空汙 / 檢測站 XML")
+    parser.add_argument("sources", nargs="+", help="目錄、萬用字元或 XML 檔案")
+    parser.add_argument("--kind", choices=["auto", "air", "stations"], default="auto", help="資料種類")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="解析的子行程數")
+    args = parser.parse_args()
+    bulk_ingest(args.sources, args.kind, args.workers)
@@ -0,0 +1,75 @@
+import os
+import re
+from functools import lru_cache
+
+import matplotlib.pyplot as plt
+from matplotlib import font_manager
+
+
+# ==================================================
+# 中文字型：依序尋找常見的 CJK 字型（只找一次）
+# ==================================================
+# 可用環境變數 CJK_FONT_PATH 直接指定字型檔
+CJK_FONT_FILES = [
+    "C:/Windows/Fonts/msjh.ttc",                                   # Windows 微軟正黑體
+    "/System/Library/Fonts/PingFang.ttc",                          # macOS
+    "/usr/share/fonts/opentype/noto/NotoSansCJK-Regular.ttc",      # Debian / Ubuntu
+    "/usr/share/fonts/google-noto-cjk/NotoSansCJK-Regular.ttc",    # Fedora
+    "/usr/share/fonts/noto-cjk/NotoSansCJK-Regular.ttc",           # Arch
+    "/usr/share/fonts/truetype/wqy/wqy-zenhei.ttc",
+]
+
+# 找不到上述檔案時，改從 matplotlib 已知字型中以名稱比對
+CJK_FONT_NAMES = [
+    "Microsoft JhengHei", "Noto Sans CJK TC", "Noto Sans TC",
+    "Source Han Sans TC", "PingFang TC", "Heiti TC",
+    "Noto Sans CJK JP", "WenQuanYi Zen Hei", "AR PL UMing TW", "SimHei",
+]
+
+
+@lru_cache(maxsize=None)
+def cjk_font():
+    """回傳可顯示中文的 FontProperties；同一個行程內只搜尋一次"""
+
+    path = os.environ.get("CJK_FONT_PATH")
+    if path and os.path.exists(path):
+        return font_manager.FontProperties(fname=path)
+
+    for path in CJK_FONT_FILES:
+        if os.path.exists(path):
+            return font_manager.FontProperties(fname=path)
+
+    known = {font.name: font.fname for font in font_manager.fontManager.ttflist}
+    for name in CJK_FONT_NAMES:
+        if name in known:
+            return font_manager.FontProperties(fname=known[name])
+
+    print("⚠️ 找不到中文字型，圖表中的中文可能無法正常顯示")
+    return font_manager.FontProperties()
+
+
+# ==================================================
+# 顯示或輸出圖檔
+# ==================================================
+def safe_filename(name):
+    """移除檔名中不合法的字元（保留中文）"""
+    return re.sub(r'[\\/:*?"<>|\s]+', "_", name)
+
+
+def save_or_show(fig, output_dir=None, name="chart", fmt="png"):
+    """
+    output_dir 為 None 時以視窗顯示圖表；
+    否則存成 {output_dir}/{name}.{fmt}（png / svg）並關閉圖表釋放記憶體
+
+    回傳輸出的檔案路徑（顯示模式回傳 None）
+    """
+
+    if output_dir is None:
+        plt.show()
+        return None
+
+    os.makedirs(output_dir, exist_ok=True)
+    path = os.path.join(output_dir, f"{safe_filename(name)}.{fmt}")
+    fig.savefig(path, format=fmt, dpi=150)
+    plt.close(fig)
+    return path
@@ -0,0 +1,243 @@
+import argparse
+import os
+import sys
+
+from instrumentation import METRICS_FILE, StageRecorder
+
+
+# ==================================================
+# 命令列工具：依階段分成子指令
+# ==================================================
+# 每個子指令只在執行時才匯入自己需要的模組：
+# 匯入資料的子指令不會載入 matplotlib / seaborn，排程執行時啟動較快
+#
+# 用法：
+#   python cli.py fetch                 下載檢測站與空汙 XML（只下載有變更的內容）
+#   python cli.py ingest-stations       解析檢測站 XML → 清理 → 中介檔 / SQLite
+#   python cli.py ingest-air            空汙 XML → air_quality.csv → 中介檔
+#   python cli.py bulk-ingest DIR       平行匯入歷史快照（空汙 → 歷史資料庫，檢測站 → SQLite）
+#   python cli.py analyze               讀取中介檔，產生縣市 / 行政區分析結果
+#   python cli.py plot [--output-dir]   繪製圖表（指定目錄時輸出成圖檔）
+#   python cli.py all                   依序執行全部階段（同 python main.py），
+#                                       只重跑輸入有變更的階段（--force 全部重跑）
+#   python cli.py serve                 啟動唯讀查詢服務（HTTP / JSON，見 query_service.py）
+#
+# 各階段的時間 / CPU / 峰值記憶體 / 筆數預設附加到 pipeline_metrics.jsonl，
+# 加上 --profile 目錄時另外以 cProfile 分析各階段
+
+
+def cmd_fetch(args, recorder):
+    import moenv_fetcher
+
+    try:
+        recorder.run(
+            "fetch", moenv_fetcher.fetch,
+            station_url=args.station_url,
+            air_url=args.air_url,
+            api_key=args.api_key,
+            limit=args.limit,
+            concurrency=args.concurrency,
+            cache_dir=args.cache_dir,
+        )
+    except moenv_fetcher.FetchError as e:
+        print(f"❌ {e}")
+        return False
+    return True
+
+
+def cmd_ingest_stations(args, recorder):
+    import main
+
+    return main.ingest_stations(args.xml, export_csv=not args.no_csv, recorder=recorder) is not None
+
+
+def cmd_ingest_air(args, recorder):
+    import main
+    from air_quality_xml_to_csv import xml_to_csv
+
+    recorder.run("xml_to_csv", xml_to_csv, args.xml, args.csv)
+    if args.history:
+        import air_history
+        recorder.run("air_history", air_history.ingest_xml, args.xml)
+
+    return main.load_air(args.csv, recorder=recorder) is not None
+
+
+def cmd_bulk_ingest(args, recorder):
+    import bulk_ingest
+
+    with recorder.stage("bulk_ingest") as record:
+        result = bulk_ingest.bulk_ingest(args.sources, args.kind, args.workers)
+        record["rows"] = result["air_added"]
+    return result["files"] > 0 and not result["failures"]
+
+
+def cmd_analyze(args, recorder):
+    import main
+    from intermediates import read_table
+
+    try:
+        with recorder.stage("read_intermediates"):
+            station_df = read_table("inspection_stations_clean")
+            air_df = read_table("air_quality")
+    except FileNotFoundError:
+        print("❌ 找不到中介檔，請先執行 ingest-stations 與 ingest-air")
+        return False
+
+    # 中介檔與資料庫可能不是同一份資料（例如 bulk-ingest 只更新資料庫），
+    # 只在指定 --db / --air-state 時讀彙總表 / 累計統計
+    main.analyze(
+        station_df, air_df, export_csv=not args.no_csv, recorder=recorder,
+        db_path=args.db, air_state=args.air_state,
+    )
+    return True
+
+
+def cmd_plot(args, recorder):
+    if args.all:
+        import render_charts
+        recorder.run(
+            "render_all", render_charts.render_all,
+            args.output_dir or "charts", args.format, args.workers,
+        )
+        return True
+
+    if args.output_dir:
+        # 指定輸出目錄時使用非互動式後端
+        import matplotlib
+        matplotlib.use("Agg")
+
+    import main
+    main.plot(args.output_dir, args.format, recorder=recorder)
+    return True
+
+
+def cmd_raster(args, recorder):
+    import raster
+
+    try:
+        with recorder.stage("raster") as record:
+            record["rows"] = raster.run_raster(
+                args.output_dir, args.bounds, args.cell_deg, args.sigma_km, args.pm25_sigma_km,
+                pm25=not args.no_pm25, fmt=args.format,
+            )["points_inside"]
+    except FileNotFoundError:
+        print("❌ 找不到中介檔，請先執行 ingest-stations 與 ingest-air")
+        return False
+    return True
+
+
+def cmd_all(args, recorder):
+    import pipeline
+
+    # 不經過 main.py：沒有階段需要執行時不必載入 pandas，幾毫秒即可結束
+    stages = pipeline.build_stages(export_csv=not args.no_csv, chart_dir=args.output_dir)
+    return pipeline.run_pipeline(stages, force=args.force, recorder=recorder)
+
+
+def cmd_serve(args, recorder):
+    import query_service
+
+    query_service.serve(
+        args.host, args.port, verbose=not args.quiet,
+        db_path=args.db, pool_size=args.pool_size, cache_size=args.cache_size,
+    )
+    return True
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="空汙 × 機車排氣檢測站 分析工具")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    p = sub.add_parser("fetch", help="下載檢測站與空汙資料（有變更才更新 XML）")
+    p.add_argument("--station-url", default=os.environ.get("MOENV_STATION_URL"),
+                   help="檢測站 XML 網址（預設取環境變數 MOENV_STATION_URL，未設定則不下載）")
+    # 同 moenv_fetcher.AIR_URL（這裡不匯入，以免其他子指令載入 asyncio）
+    p.add_argument("--air-url", default="https://data.moenv.gov.tw/api/v2/aqx_p_488",
+                   help="空汙 API 網址")
+    p.add_argument("--api-key", default=os.environ.get("MOENV_API_KEY"),
+                   help="環境部開放資料 API key（預設取環境變數 MOENV_API_KEY）")
+    p.add_argument("--limit", type=int, default=1000, help="空汙 API 每頁筆數")
+    p.add_argument("--concurrency", type=int, default=4, help="同時下載的頁數")
+    p.add_argument("--cache-dir", default="fetch_cache", help="ETag 與已下載內容的快取目錄")
+    p.set_defaults(func=cmd_fetch)
+
+    p = sub.add_parser("ingest-stations", help="解析並儲存機車排氣檢測站資料")
+    p.add_argument("--xml", default="機車排氣定檢站資料.xml", help="檢測站 XML 檔案")
+    p.add_argument("--no-csv", action="store_true", help="只輸出中介檔，不輸出 CSV")
+    p.set_defaults(func=cmd_ingest_stations)
+
+    p = sub.add_parser("ingest-air", help="轉換並載入空氣品質資料")
+    p.add_argument("--xml", default="空汙.xml", help="空汙 XML 檔案")
+    p.add_argument("--csv", default="air_quality.csv", help="輸出的空汙 CSV")
+    p.add_argument("--history", action="store_true", help="同時附加到空汙歷史資料庫")
+    p.set_defaults(func=cmd_ingest_air)
+
+    p = sub.add_parser("bulk-ingest", help="平行匯入目錄 / 萬用字元中的歷史 XML 快照")
+    p.add_argument("sources", nargs="+", help="目錄、萬用字元或 XML 檔案")
+    p.add_argument("--kind", choices=["auto", "air", "stations"], default="auto",
+                   help="資料種類（預設依檔案內容判斷）")
+    p.add_argument("--workers", type=int, default=None, help="解析的子行程數（預設為 CPU 核心數）")
+    p.set_defaults(func=cmd_bulk_ingest)
+
+    p = sub.add_parser("analyze", help="縣市 / 行政區 / 最近測站分析")
+    p.add_argument("--no-csv", action="store_true", help="只輸出中介檔，不輸出 CSV")
+    p.add_argument("--db", help="檢測站數量改讀此 SQLite 的彙總表（未指定時由中介檔計算）")
+    p.add_argument("--air-state", help="縣市平均改取自此空汙累計統計資料庫（例如 air_rolling.db；未指定時由中介檔計算）")
+    p.set_defaults(func=cmd_analyze)
+
+    p = sub.add_parser("plot", help="繪製分析圖表")
+    p.add_argument("--output-dir", help="輸出圖檔的目錄（未指定時以視窗顯示）")
+    p.add_argument("--format", choices=["png", "svg"], default="png", help="圖檔格式")
+    p.add_argument("--all", action="store_true", help="輸出全部圖表（含各縣市圖）")
+    p.add_argument("--workers", type=int, default=None, help="平行繪圖的子行程數")
+    p.set_defaults(func=cmd_plot)
+
+    p = sub.add_parser("raster", help="檢驗站密度 / PM2.5 網格與熱度圖")
+    # 預設值同 raster.py 的常數（這裡不匯入，以免其他子指令載入 NumPy）
+    p.add_argument("--output-dir", default="raster", help="輸出目錄")
+    p.add_argument("--bounds", type=float, nargs=4, default=(21.8, 26.4, 118.1, 122.1),
+                   metavar=("LAT_MIN", "LAT_MAX", "LON_MIN", "LON_MAX"), help="網格範圍")
+    p.add_argument("--cell-deg", type=float, default=0.01, help="每格的經緯度大小")
+    p.add_argument("--sigma-km", type=float, default=2.0, help="密度的平滑半徑（公里，0 為不平滑）")
+    p.add_argument("--pm25-sigma-km", type=float, default=15.0, help="PM2.5 面的平滑半徑（公里）")
+    p.add_argument("--no-pm25", action="store_true", help="不計算 PM2.5 網格")
+    p.add_argument("--format", choices=["png", "svg"], default="png", help="圖檔格式")
+    p.set_defaults(func=cmd_raster)
+
+    p = sub.add_parser("all", help="依序執行全部階段")
+    p.add_argument("--no-csv", action="store_true", help="只輸出中介檔，不輸出 CSV")
+    p.add_argument("--output-dir", help="輸出圖檔的目錄（未指定時以視窗顯示）")
+    p.add_argument("--force", action="store_true", help="忽略上次的紀錄，全部重新執行")
+    p.set_defaults(func=cmd_all)
+
+    p = sub.add_parser("serve", help="啟動唯讀查詢服務（HTTP / JSON）")
+    p.add_argument("--host", default="127.0.0.1", help="監聽位址")
+    # 同 query_service.DEFAULT_PORT（這裡不匯入，以免其他子指令載入 http.server）
+    p.add_argument("--port", type=int, default=8765, help="監聽埠號")
+    p.add_argument("--db", default="inspection_stations.db", help="檢測站 SQLite")
+    p.add_argument("--pool-size", type=int, default=4, help="每個資料庫的連線池大小")
+    p.add_argument("--cache-size", type=int, default=1024, help="LRU 快取的回應數（0 為不快取）")
+    p.add_argument("--quiet", action="store_true", help="不顯示每個請求的紀錄")
+    p.set_defaults(func=cmd_serve)
+
+    for p in sub.choices.values():
+        p.add_argument("--metrics", default=METRICS_FILE, help="各階段效能紀錄附加到此 JSON Lines 檔")
+        p.add_argument("--profile", metavar="DIR", help="以 cProfile 分析各階段，輸出到此目錄")
+
+    return parser
+
+
+def run(argv=None):
+    args = build_parser().parse_args(argv)
+    recorder = StageRecorder(args.profile)
+
+    ok = args.func(args, recorder)
+    if args.metrics and recorder.records:
+        recorder.write(args.metrics)
+    return 0 if ok else 1
+
+
+# ---------- 主程式進入點 ----------
+if __name__ == "__main__":
+    sys.exit(run())
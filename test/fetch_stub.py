@@ -0,0 +1,320 @@
+import asyncio
+import contextlib
+import gzip
+import io
+import json
+import os
+import re
+import socketserver
+import sys
+import tempfile
+import threading
+from urllib.parse import parse_qsl, urlsplit
+
+import moenv_fetcher
+from moenv_fetcher import FetchError, HttpCache
+
+
+# ==================================================
+# moenv_fetcher 對本機假伺服器的檢查
+# ==================================================
+# 以 socketserver 直接寫出原始的 HTTP/1.1 回應（可控制 chunked、gzip、提早關閉連線），
+# 內容使用目前目錄的兩份 XML，依序檢查：
+#   - 條件式請求：第一次 200（gzip + chunked）並記下 ETag，第二次帶 If-None-Match 得到 304
+#   - 429 / 503 依 Retry-After 重試
+#   - chunked 內容在區塊邊界被截斷、gzip 內容在連線關閉時截斷：視為失敗，不寫入快取
+#   - 空汙分頁下載：API key 不出現在訊息、例外與 fetch_cache/index.json
+#
+# 用法：python fetch_stub.py（全部通過時結束代碼為 0）
+STATION_XML = "機車排氣定檢站資料.xml"
+AIR_XML = "空汙.xml"
+SECRET = "stub-secret-key"
+
+
+# ==================================================
+# 假伺服器
+# ==================================================
+def write_response(wfile, status, headers, body=b"", chunked=False, chunk_size=4096, cut=None):
+    """
+    寫出一個回應；chunked=True 時以 chunk_size 分塊
+
+    cut: 只送出前 cut 個位元組的內容（chunked 時為區塊數）後就停止，由呼叫端關閉連線
+    """
+    reason = {200: "OK", 304: "Not Modified", 401: "Unauthorized", 403: "Forbidden", 503: "Service Unavailable"}
+    lines = [f"HTTP/1.1 {status} {reason.get(status, 'Status')}"]
+    lines += [f"{name}: {value}" for name, value in headers.items()]
+    if chunked:
+        lines.append("Transfer-Encoding: chunked")
+    elif cut is None and status != 304:
+        lines.append(f"Content-Length: {len(body)}")
+    wfile.write(("\r\n".join(lines) + "\r\n\r\n").encode("latin-1"))
+
+    if chunked:
+        blocks = [body[i:i + chunk_size] for i in range(0, len(body), chunk_size)]
+        for block in blocks[:cut]:
+            wfile.write(f"{len(block):x}\r\n".encode() + block + b"\r\n")
+        if cut is None:
+            wfile.write(b"0\r\n\r\n")
+    elif status != 304:
+        wfile.write(body if cut is None else body[:cut])
+    wfile.flush()
+
+
+class StubHandler(socketserver.StreamRequestHandler):
+    """同一條連線持續處理請求（keep-alive），路由函式回傳 False 時關閉連線"""
+
+    def handle(self):
+        while True:
+            request_line = self.rfile.readline()
+            if not request_line.strip():
+                return
+            headers = {}
+            while (line := self.rfile.readline().decode("latin-1").strip()):
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+
+            target = urlsplit(request_line.decode("latin-1").split()[1])
+            query = dict(parse_qsl(target.query))
+            server = self.server
+            with server.lock:
+                server.requests.append((target.path, query, headers))
+                count = sum(1 for path, _, _ in server.requests if path == target.path)
+
+            route = server.routes.get(target.path)
+            if route is None:
+                write_response(self.wfile, 404, {}, b"")
+                continue
+            if route(self.wfile, query, headers, count) is False:
+                return
+
+
+class StubServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, routes):
+        super().__init__(("127.0.0.1", 0), StubHandler)
+        self.routes = routes
+        self.requests = []
+        self.lock = threading.Lock()
+        self.thread = threading.Thread(target=self.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def __enter__(self):
+        self.thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self.shutdown()
+        self.server_close()
+
+    def seen(self, path):
+        return [(query, headers) for p, query, headers in self.requests if p == path]
+
+
+# ==================================================
+# 各項檢查
+# ==================================================
+def read_bytes(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def air_pages(body):
+    """空汙 XML 依 offset / limit 切頁（根節點相同）"""
+    records = re.findall(rb"<data>.*?</data>", body, re.S)
+
+    def page(offset, limit):
+        return b'<?xml version="1.0" encoding="UTF-8"?>\n<aqx_p_488>' + b"".join(
+            records[offset:offset + limit]
+        ) + b"</aqx_p_488>"
+
+    return page, len(records)
+
+
+def fetch_once(url, cache_dir, parse=None, retries=0):
+    async def run():
+        cache = HttpCache(cache_dir)
+        async with moenv_fetcher.ConnectionPool(limit=2, timeout=5) as pool:
+            try:
+                return await moenv_fetcher.fetch_url(pool, cache, url, parse, retries, backoff=0.01)
+            finally:
+                cache.save()
+
+    return asyncio.run(run())
+
+
+def check_conditional(stations):
+    """gzip + chunked 的 200 → 帶 If-None-Match 的 304"""
+    compressed = gzip.compress(stations)
+
+    def route(wfile, query, headers, count):
+        if headers.get("if-none-match") == '"v1"':
+            write_response(wfile, 304, {"ETag": '"v1"'})
+        else:
+            write_response(wfile, 200, {"ETag": '"v1"', "Content-Encoding": "gzip"}, compressed, chunked=True)
+
+    with StubServer({"/stations": route}) as server, tempfile.TemporaryDirectory() as cache_dir:
+        first = fetch_once(f"{server.url}/stations", cache_dir, moenv_fetcher.parse_stations)
+        second = fetch_once(f"{server.url}/stations", cache_dir, moenv_fetcher.parse_stations)
+        sent = server.seen("/stations")
+        return [
+            ("200 gzip + chunked 內容完整", first["changed"] and read_bytes(first["file"]) == stations),
+            ("解析出全部檢驗站", first["records"] == stations.count(b"<sno>")),
+            ("第二次帶 If-None-Match", sent[-1][1].get("if-none-match") == '"v1"'),
+            ("304 沿用快取", not second["changed"] and second["records"] == first["records"]),
+            ("keep-alive 重用連線", len(sent) == 2),
+        ]
+
+
+def check_retry():
+    """503（Retry-After: 0）兩次後成功"""
+    body = b"<root><a>1</a></root>"
+
+    def route(wfile, query, headers, count):
+        if count <= 2:
+            write_response(wfile, 503, {"Retry-After": "0"}, b"busy")
+        else:
+            write_response(wfile, 200, {"ETag": '"r1"'}, body)
+
+    with StubServer({"/flaky": route}) as server, tempfile.TemporaryDirectory() as cache_dir:
+        with contextlib.redirect_stdout(io.StringIO()):
+            result = fetch_once(f"{server.url}/flaky", cache_dir, retries=3)
+        return [
+            ("503 重試後成功", result["changed"] and read_bytes(result["file"]) == body),
+            ("共送出 3 次請求", len(server.seen("/flaky")) == 3),
+        ]
+
+
+def check_truncated():
+    """chunked 在區塊邊界截斷、gzip 在連線關閉時截斷：不得寫入快取"""
+    full = b"<root>" + b"".join(b"<a>%d</a>" % i for i in range(2000)) + b"</root>"
+    compressed = gzip.compress(full)
+
+    def chunked(wfile, query, headers, count):
+        if count == 1:
+            # 只送出第一個完整區塊（<root><a>0</a>...）就關閉連線
+            write_response(wfile, 200, {"ETag": '"t1"'}, full, chunked=True, chunk_size=64, cut=1)
+            return False
+        write_response(wfile, 200, {"ETag": '"t1"'}, full, chunked=True, chunk_size=64)
+
+    def gzip_close(wfile, query, headers, count):
+        # 沒有長度資訊的 gzip 內容，送出一半就關閉連線
+        write_response(wfile, 200, {"ETag": '"g1"', "Content-Encoding": "gzip"}, compressed,
+                       cut=len(compressed) // 2)
+        return False
+
+    routes = {"/truncated": chunked, "/truncated-gzip": gzip_close}
+    with StubServer(routes) as server, tempfile.TemporaryDirectory() as cache_dir:
+        url = f"{server.url}/truncated"
+        try:
+            fetch_once(url, cache_dir)
+            failed = False
+        except FetchError:
+            failed = True
+        not_cached = HttpCache(cache_dir).get(url) is None
+
+        # 第二次請求伺服器送出完整內容，這時才寫入快取（含 ETag）
+        result = fetch_once(url, cache_dir)
+        cached = HttpCache(cache_dir).get(url)
+
+        try:
+            fetch_once(f"{server.url}/truncated-gzip", cache_dir)
+            gzip_failed = False
+        except FetchError:
+            gzip_failed = True
+
+        return [
+            ("chunked 截斷視為失敗", failed),
+            ("截斷的內容不寫入快取", not_cached),
+            ("截斷後第一次請求沒有帶 If-None-Match", "if-none-match" not in server.seen("/truncated")[1][1]),
+            ("完整內容才寫入快取", read_bytes(result["file"]) == full and cached["etag"] == '"t1"'),
+            ("gzip 截斷視為失敗", gzip_failed),
+            ("gzip 截斷不寫入快取", HttpCache(cache_dir).get(f"{server.url}/truncated-gzip") is None),
+        ]
+
+
+def check_api_key(air):
+    """空汙分頁下載：API key 只出現在送出的請求中"""
+    page, total = air_pages(air)
+    limit = 400
+
+    def air_route(wfile, query, headers, count):
+        if query.get("api_key") != SECRET:
+            write_response(wfile, 401, {}, b"missing key")
+            return
+        if count == 1:
+            write_response(wfile, 503, {"Retry-After": "0"}, b"busy")
+            return
+        offset, size = int(query["offset"]), int(query["limit"])
+        write_response(wfile, 200, {"ETag": f'"p{offset}"'}, page(offset, size), chunked=True)
+
+    def denied(wfile, query, headers, count):
+        write_response(wfile, 403, {}, b"forbidden")
+
+    def down(wfile, query, headers, count):
+        write_response(wfile, 503, {"Retry-After": "0"}, b"down")
+
+    routes = {"/air": air_route, "/denied": denied, "/down": down}
+    with StubServer(routes) as server, tempfile.TemporaryDirectory() as work:
+        dest = os.path.join(work, "air.xml")
+        cache_dir = os.path.join(work, "cache")
+        output = io.StringIO()
+        with contextlib.redirect_stdout(output):
+            fetched = moenv_fetcher.fetch(
+                station_url=None, air_url=f"{server.url}/air", api_key=SECRET, air_xml=dest,
+                limit=limit, concurrency=2, cache_dir=cache_dir, backoff=0.01,
+            )
+
+        messages = []
+        for path, retries in [("/denied", 0), ("/down", 1)]:
+            try:
+                with contextlib.redirect_stdout(output):
+                    fetch_once(f"{server.url}{path}?api_key={SECRET}", cache_dir, retries=retries)
+            except FetchError as e:
+                messages.append(str(e))
+
+        # 舊版索引（以含 key 的網址為鍵）讀入時改為不含 key
+        legacy = os.path.join(work, "legacy")
+        os.makedirs(legacy)
+        with open(os.path.join(legacy, "index.json"), "w", encoding="utf-8") as f:
+            json.dump({f"{server.url}/air?limit=1&api_key={SECRET}": {"file": "x"},
+                       "pages": {f"{server.url}/air?api_key={SECRET}": []}}, f)
+
+        index = read_bytes(os.path.join(cache_dir, "index.json")).decode()
+        return [
+            ("分頁下載完整", fetched["air"] is not None and read_bytes(dest).count(b"<data>") == total),
+            ("每頁請求都帶 API key", all(q.get("api_key") == SECRET for q, _ in server.seen("/air"))),
+            ("重試訊息不含 API key", "重試" in output.getvalue() and SECRET not in output.getvalue()),
+            ("例外訊息不含 API key", len(messages) == 2 and not any(SECRET in m for m in messages)),
+            ("快取索引不含 API key", SECRET not in index and "/air" in index),
+            ("舊版索引改為不含 API key", SECRET not in json.dumps(HttpCache(legacy).index)),
+        ]
+
+
+def main():
+    here = os.path.dirname(os.path.abspath(__file__))
+    stations = read_bytes(os.path.join(here, STATION_XML))
+    air = read_bytes(os.path.join(here, AIR_XML))
+
+    failed = 0
+    for title, run in [
+        ("條件式請求", lambda: check_conditional(stations)),
+        ("重試", check_retry),
+        ("截斷的內容", check_truncated),
+        ("API key", lambda: check_api_key(air)),
+    ]:
+        print(f"📂 {title}")
+        for name, ok in run():
+            print(f"  {'✅' if ok else '❌'} {name}")
+            failed += not ok
+
+    print("✅ 全部通過" if not failed else f"❌ {failed} 項未通過")
+    return 1 if failed else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
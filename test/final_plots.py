@@ -1,26 +1,28 @@
 import pandas as pd
 import matplotlib.pyplot as plt
-from matplotlib import font_manager
 from matplotlib.ticker import MaxNLocator, StrMethodFormatter
 
+import station_summary
+from chart_utils import cjk_font, save_or_show
+from intermediates import read_table
+
 # ==================================================
 # 中文字型設定（避免圖表中文字變成亂碼）
 # ==================================================
-font_path = "C:/Windows/Fonts/msjh.ttc"   # Windows 常用微軟正黑體
-font_prop = font_manager.FontProperties(fname=font_path)
+font_prop = cjk_font()                      # 自動尋找系統中的中文字型
 plt.rcParams["axes.unicode_minus"] = False  # 修正負號顯示問題
 
 
-def run_final_plots():
+def run_final_plots(output_dir=None, fmt="png"):
+    """
+    繪製報告用的兩張總覽圖
+    output_dir 有指定時輸出成圖檔（png / svg）並回傳檔案路徑，否則以視窗顯示
+    """
     # ==================================================
-    # 讀取資料
+    # 讀取資料（中介檔已統一「台」，只載入需要的欄位）
+    # 檢測站只需要數量，直接讀 SQLite 的彙總表，不載入檢測站明細
     # ==================================================
-    stations = pd.read_csv("inspection_stations_clean.csv")
-    air = pd.read_csv("air_quality.csv")
-
-    # 統一縣市名稱用字（臺 → 台）
-    stations["city"] = stations["city"].str.replace("臺", "台")
-    air["county"] = air["county"].str.replace("臺", "台")
+    air = read_table("air_quality", columns=["county", "pm2.5", "aqi"])
 
     # ==================================================
     # 圖一：各縣市「檢測站最多的行政區（Top 1）」
@@ -28,25 +30,14 @@ def run_final_plots():
     # 長條顯示：行政區名稱 + 檢測站數量
     # ==================================================
 
-    # 計算每個「縣市 × 行政區」的檢測站數量
-    district_summary = (
-        stations.groupby(["city", "district"])
-        .size()
-        .reset_index(name="station_count")
-    )
-
-    # 每個縣市取檢測站數量最多的行政區（Top 1）
+    # 每個縣市取檢測站數量最多的行政區（Top 1），依數量排序
     top_district_by_city = (
-        district_summary
-        .sort_values(["city", "station_count"], ascending=[True, False])
-        .groupby("city")
-        .head(1)
-        .reset_index(drop=True)
-        .sort_values("station_count", ascending=False)
+        station_summary.top_districts(k=1)
+        .sort_values("station_count", ascending=False, kind="stable")
     )
 
     # 繪製長條圖
-    plt.figure(figsize=(12, 6))
+    fig = plt.figure(figsize=(12, 6))
     bars = plt.bar(
         top_district_by_city["city"],
         top_district_by_city["station_count"]
@@ -86,22 +77,18 @@ def run_final_plots():
     plt.gca().yaxis.set_major_locator(MaxNLocator(integer=True))
 
     plt.tight_layout()
-    plt.show()
+    paths = [save_or_show(fig, output_dir, "final_top_district_by_city", fmt)]
 
     # ==================================================
     # 圖二：空氣污染程度 × 檢測站數量（散佈圖）
     # ==================================================
 
     # 計算每個縣市的檢測站總數
-    station_city = (
-        stations.groupby("city")
-        .size()
-        .reset_index(name="station_count")
-    )
+    station_city = station_summary.city_counts()
 
     # 計算每個縣市的平均 PM2.5 與 AQI
     air_city = (
-        air.groupby("county")[["pm2.5", "aqi"]]
+        air.groupby("county", observed=True)[["pm2.5", "aqi"]]
         .mean()
         .reset_index()
     )
@@ -145,4 +132,6 @@ def run_final_plots():
     ax.yaxis.set_major_formatter(StrMethodFormatter("{x:.1f}"))
 
     plt.tight_layout()
-    plt.show()
+    paths.append(save_or_show(fig, output_dir, "final_air_vs_station", fmt))
+
+    return paths
@@ -0,0 +1,360 @@
+import hashlib
+import json
+import os
+
+
+# ==================================================
+# 行政區索引：縣市 → 鄉鎮市區（統一使用「台」）
+# ==================================================
+# 內政部 22 縣市、368 個鄉鎮市區。地址擷取出的行政區必須在所屬縣市之內，
+# 以集合查詢驗證（O(1)），取代「任何以 區 / 鄉 / 鎮 / 市 結尾的字串」：
+#   臺南市新市區 → 新市區（正規表達式會截成「新市」）
+#   桃園市平鎮區 → 平鎮區（正規表達式會截成「平鎮」）
+#
+# 空品測站也對應到行政區（見 map_sites），結果快取在 SITE_CACHE，
+# 之後可在行政區層級合併檢驗站與空汙資料，不必只用縣市平均
+DISTRICTS = {
+    "台北市": "中正區 大同區 中山區 松山區 大安區 萬華區 信義區 士林區 北投區 內湖區 南港區 文山區",
+    "新北市": "板橋區 三重區 中和區 永和區 新莊區 新店區 樹林區 鶯歌區 三峽區 淡水區 汐止區 瑞芳區 "
+              "土城區 蘆洲區 五股區 泰山區 林口區 深坑區 石碇區 坪林區 三芝區 石門區 八里區 平溪區 "
+              "雙溪區 貢寮區 金山區 萬里區 烏來區",
+    "桃園市": "桃園區 中壢區 大溪區 楊梅區 蘆竹區 大園區 龜山區 八德區 龍潭區 平鎮區 新屋區 觀音區 復興區",
+    "台中市": "中區 東區 南區 西區 北區 西屯區 南屯區 北屯區 豐原區 東勢區 大甲區 清水區 沙鹿區 梧棲區 "
+              "后里區 神岡區 潭子區 大雅區 新社區 石岡區 外埔區 大安區 烏日區 大肚區 龍井區 霧峰區 "
+              "太平區 大里區 和平區",
+    "台南市": "新營區 鹽水區 白河區 柳營區 後壁區 東山區 麻豆區 下營區 六甲區 官田區 大內區 佳里區 "
+              "學甲區 西港區 七股區 將軍區 北門區 新化區 善化區 新市區 安定區 山上區 玉井區 楠西區 "
+              "南化區 左鎮區 仁德區 歸仁區 關廟區 龍崎區 永康區 東區 南區 北區 安南區 安平區 中西區",
+    "高雄市": "鹽埕區 鼓山區 左營區 楠梓區 三民區 新興區 前金區 苓雅區 前鎮區 旗津區 小港區 鳳山區 "
+              "林園區 大寮區 大樹區 大社區 仁武區 鳥松區 岡山區 橋頭區 燕巢區 田寮區 阿蓮區 路竹區 "
+              "湖內區 茄萣區 永安區 彌陀區 梓官區 旗山區 美濃區 六龜區 甲仙區 杉林區 內門區 茂林區 "
+              "桃源區 那瑪夏區",
+    "基隆市": "仁愛區 信義區 中正區 中山區 安樂區 暖暖區 七堵區",
+    "新竹市": "東區 北區 香山區",
+    "嘉義市": "東區 西區",
+    "新竹縣": "竹北市 竹東鎮 新埔鎮 關西鎮 湖口鄉 新豐鄉 芎林鄉 橫山鄉 北埔鄉 寶山鄉 峨眉鄉 尖石鄉 五峰鄉",
+    "苗栗縣": "苗栗市 頭份市 苑裡鎮 通霄鎮 竹南鎮 後龍鎮 卓蘭鎮 大湖鄉 公館鄉 銅鑼鄉 南庄鄉 頭屋鄉 "
+              "三義鄉 西湖鄉 造橋鄉 三灣鄉 獅潭鄉 泰安鄉",
+    "彰化縣": "彰化市 員林市 鹿港鎮 和美鎮 北斗鎮 溪湖鎮 田中鎮 二林鎮 線西鄉 伸港鄉 福興鄉 秀水鄉 "
+              "花壇鄉 芬園鄉 大村鄉 埔鹽鄉 埔心鄉 永靖鄉 社頭鄉 二水鄉 田尾鄉 埤頭鄉 芳苑鄉 大城鄉 "
+              "竹塘鄉 溪州鄉",
+    "南投縣": "南投市 埔里鎮 草屯鎮 竹山鎮 集集鎮 名間鄉 鹿谷鄉 中寮鄉 魚池鄉 國姓鄉 水里鄉 信義鄉 仁愛鄉",
+    "雲林縣": "斗六市 斗南鎮 虎尾鎮 西螺鎮 土庫鎮 北港鎮 古坑鄉 大埤鄉 莿桐鄉 林內鄉 二崙鄉 崙背鄉 "
+              "麥寮鄉 東勢鄉 褒忠鄉 台西鄉 元長鄉 四湖鄉 口湖鄉 水林鄉",
+    "嘉義縣": "太保市 朴子市 布袋鎮 大林鎮 民雄鄉 溪口鄉 新港鄉 六腳鄉 東石鄉 義竹鄉 鹿草鄉 水上鄉 "
+              "中埔鄉 竹崎鄉 梅山鄉 番路鄉 大埔鄉 阿里山鄉",
+    "屏東縣": "屏東市 潮州鎮 東港鎮 恆春鎮 萬丹鄉 長治鄉 麟洛鄉 九如鄉 里港鄉 鹽埔鄉 高樹鄉 萬巒鄉 "
+              "內埔鄉 竹田鄉 新埤鄉 枋寮鄉 新園鄉 崁頂鄉 林邊鄉 南州鄉 佳冬鄉 琉球鄉 車城鄉 滿州鄉 "
+              "枋山鄉 三地門鄉 霧台鄉 瑪家鄉 泰武鄉 來義鄉 春日鄉 獅子鄉 牡丹鄉",
+    "宜蘭縣": "宜蘭市 羅東鎮 蘇澳鎮 頭城鎮 礁溪鄉 壯圍鄉 員山鄉 冬山鄉 五結鄉 三星鄉 大同鄉 南澳鄉",
+    "花蓮縣": "花蓮市 鳳林鎮 玉里鎮 新城鄉 吉安鄉 壽豐鄉 光復鄉 豐濱鄉 瑞穗鄉 富里鄉 秀林鄉 萬榮鄉 卓溪鄉",
+    "台東縣": "台東市 成功鎮 關山鎮 卑南鄉 鹿野鄉 池上鄉 東河鄉 長濱鄉 太麻里鄉 大武鄉 綠島鄉 海端鄉 "
+              "延平鄉 金峰鄉 達仁鄉 蘭嶼鄉",
+    "澎湖縣": "馬公市 湖西鄉 白沙鄉 西嶼鄉 望安鄉 七美鄉",
+    "金門縣": "金城鎮 金湖鎮 金沙鎮 金寧鄉 烈嶼鄉 烏坵鄉",
+    "連江縣": "南竿鄉 北竿鄉 莒光鄉 東引鄉",
+}
+
+# 預先建好的索引（匯入時建立一次）
+DISTRICT_INDEX = {city: frozenset(names.split()) for city, names in DISTRICTS.items()}
+CITY_DISTRICTS = frozenset(city + district for city, names in DISTRICT_INDEX.items() for district in names)
+
+# 行政區名稱的長度（由長到短），從地址擷取時只需比對這幾種長度的前綴
+NAME_LENGTHS = sorted({len(d) for names in DISTRICT_INDEX.values() for d in names}, reverse=True)
+
+# 行政區名稱的結尾，空品測站名稱通常省略（屏東(枋山) → 枋山鄉）
+SUFFIXES = ("區", "鄉", "鎮", "市")
+
+# 空品測站 → 行政區對應的快取檔
+SITE_CACHE = "gazetteer_sites.json"
+
+
+def normalize(text):
+    """統一用字（臺 → 台）與全形括號"""
+    return text.replace("臺", "台").replace("（", "(").replace("）", ")").strip()
+
+
+def is_valid_district(city, district):
+    """行政區是否屬於該縣市（集合查詢）"""
+    return district in DISTRICT_INDEX.get(city, ())
+
+
+def match_district(city, rest):
+    """
+    從「縣市之後的地址」開頭比對該縣市的行政區，沒有符合者回傳空字串
+
+    只比對 NAME_LENGTHS 幾種長度的前綴，每種一次集合查詢
+    """
+    districts = DISTRICT_INDEX.get(city)
+    if not districts:
+        return ""
+    for length in NAME_LENGTHS:
+        if rest[:length] in districts:
+            return rest[:length]
+    return ""
+
+
+def valid_mask(city, district):
+    """
+    整欄驗證「縣市 × 行政區」組合，回傳布林陣列
+
+    相同組合只查詢一次（先 factorize 去重，再對應回每一列）
+    """
+    import numpy as np
+    import pandas as pd
+
+    pairs = pd.MultiIndex.from_arrays([
+        pd.Series(city).astype(object).fillna(""),
+        pd.Series(district).astype(object).fillna(""),
+    ])
+    codes, uniques = pd.factorize(pairs)
+    valid = np.fromiter((c + d in CITY_DISTRICTS for c, d in uniques), dtype=bool, count=len(uniques))
+    return valid[codes]
+
+
+# ==================================================
+# 空品測站 → 行政區
+# ==================================================
+def site_name_district(county, sitename):
+    """
+    由測站名稱判斷行政區：括號內的地名優先，再來是括號外的名稱
+
+    嘉義（東區）→ 東區、屏東(枋山) → 枋山鄉、林園 → 林園區；
+    名稱不是行政區（例如 陽明、富貴角）時回傳空字串
+    """
+    districts = DISTRICT_INDEX.get(county)
+    if not districts:
+        return ""
+
+    outer, _, inner = normalize(sitename).partition("(")
+    for name in (inner.rstrip(")").strip(), outer.strip()):
+        if not name:
+            continue
+        if name in districts:
+            return name
+        for suffix in SUFFIXES:
+            if name + suffix in districts:
+                return name + suffix
+    return ""
+
+
+def unique_sites(air_df):
+    """空汙資料中的測站（每站一列：sitename / county / latitude / longitude）"""
+    import pandas as pd
+
+    sites = pd.DataFrame({
+        "sitename": air_df["sitename"].astype(object).to_numpy(),
+        "county": air_df["county"].astype(object).fillna("").map(normalize).to_numpy(),
+    })
+    for col in ("latitude", "longitude"):
+        values = air_df[col] if col in air_df.columns else pd.Series(float("nan"), index=air_df.index)
+        sites[col] = pd.to_numeric(values, errors="coerce").to_numpy(dtype="float64")
+    return sites.dropna(subset=["sitename"]).drop_duplicates("sitename").reset_index(drop=True)
+
+
+def nearest_station_district(sites, station_df):
+    """
+    名稱比對不到的測站：取同縣市最近檢驗站的行政區
+
+    回傳 (行政區, 距離公里)，同縣市沒有檢驗站或座標缺漏時為 ("", NaN)
+    """
+    import numpy as np
+    from spatial import GridIndex, coordinates
+
+    district = np.full(len(sites), "", dtype=object)
+    distance = np.full(len(sites), np.nan)
+    if station_df is None or not {"latitude", "longitude"}.issubset(station_df.columns):
+        return district, distance
+
+    # 只採用行政區合法的檢驗站
+    station_df = station_df[valid_mask(station_df["city"], station_df["district"])]
+    cities = station_df["city"].astype(object).to_numpy()
+    for county in sites["county"].unique():
+        rows = np.flatnonzero(sites["county"].to_numpy() == county)
+        stations = station_df[cities == county]
+        if stations.empty:
+            continue
+        index = GridIndex(*coordinates(stations))
+        position, km = index.nearest(sites["latitude"].to_numpy()[rows], sites["longitude"].to_numpy()[rows])
+        found = position >= 0
+        district[rows[found]] = stations["district"].astype(object).to_numpy()[position[found]]
+        distance[rows[found]] = km[found]
+    return district, distance
+
+
+def gazetteer_version():
+    """行政區清單的雜湊：清單有改動時舊的快取失效"""
+    return hashlib.sha256(json.dumps(DISTRICTS, sort_keys=True).encode()).hexdigest()[:16]
+
+
+def load_site_cache(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            cache = json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {}
+    return cache["sites"] if cache.get("version") == gazetteer_version() else {}
+
+
+def save_site_cache(entries, path):
+    # 先寫暫存檔再改名，中斷時不會留下寫一半的快取
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump({"version": gazetteer_version(), "sites": entries}, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+
+def map_sites(air_df, station_df=None, cache_path=SITE_CACHE):
+    """
+    將每個空品測站對應到所在行政區
+
+    1. 測站名稱即行政區（見 site_name_district）
+    2. 否則取同縣市最近檢驗站的行政區（需要 station_df 的座標）
+
+    station_df 也可以是回傳檢驗站資料的函式，只在有測站需要第 2 步時才呼叫
+
+    快取以「縣市|測站」為鍵，座標沒變的測站直接沿用；
+    cache_path 為 None 時不讀寫快取
+
+    回傳 DataFrame：sitename / county / district / source（name、nearest_station 或空字串）/ distance_km
+    """
+    import numpy as np
+    import pandas as pd
+
+    sites = unique_sites(air_df)
+    cached = load_site_cache(cache_path) if cache_path else {}
+
+    keys = (sites["county"] + "|" + sites["sitename"]).tolist()
+    lat = sites["latitude"].round(6).to_numpy()
+    lon = sites["longitude"].round(6).to_numpy()
+
+    district = np.full(len(sites), "", dtype=object)
+    source = np.full(len(sites), "", dtype=object)
+    distance = np.full(len(sites), np.nan)
+    todo = []
+    for i, key in enumerate(keys):
+        entry = cached.get(key)
+        if (
+            entry
+            and entry["source"]
+            and entry["latitude"] == (None if np.isnan(lat[i]) else lat[i])
+            and entry["longitude"] == (None if np.isnan(lon[i]) else lon[i])
+        ):
+            district[i], source[i] = entry["district"], entry["source"]
+            distance[i] = np.nan if entry["distance_km"] is None else entry["distance_km"]
+        else:
+            todo.append(i)
+
+    if todo:
+        todo = np.array(todo)
+        by_name = np.array([site_name_district(sites.at[i, "county"], sites.at[i, "sitename"]) for i in todo], dtype=object)
+        named = by_name != ""
+        district[todo[named]] = by_name[named]
+        source[todo[named]] = "name"
+
+        rest = todo[~named]
+        if len(rest):
+            if callable(station_df):
+                station_df = station_df()
+            nearest, km = nearest_station_district(sites.iloc[rest], station_df)
+            found = nearest != ""
+            district[rest[found]] = nearest[found]
+            source[rest[found]] = "nearest_station"
+            distance[rest[found]] = km[found]
+
+        if cache_path:
+            for i in range(len(sites)):
+                cached[keys[i]] = {
+                    "district": district[i],
+                    "source": source[i],
+                    "latitude": None if np.isnan(lat[i]) else float(lat[i]),
+                    "longitude": None if np.isnan(lon[i]) else float(lon[i]),
+                    "distance_km": None if np.isnan(distance[i]) else round(float(distance[i]), 3),
+                }
+            save_site_cache(cached, cache_path)
+
+    unresolved = int((source == "").sum())
+    if unresolved:
+        print(f"⚠️ {unresolved} 個空品測站無法對應到行政區")
+
+    return pd.DataFrame({
+        "sitename": sites["sitename"],
+        "county": sites["county"],
+        "district": district,
+        "source": source,
+        "distance_km": distance,
+    })
+
+
+def sites_by_district(site_map):
+    """{(縣市, 行政區): [測站, ...]}，未對應的測站不列入"""
+    index = {}
+    for county, district, sitename in site_map[["county", "district", "sitename"]].itertuples(index=False):
+        if district:
+            index.setdefault((county, district), []).append(sitename)
+    return index
+
+
+# ==================================================
+# 行政區層級合併：檢驗站數量 × 空汙
+# ==================================================
+def district_air_vs_station(station_count, air_df, site_map):
+    """
+    依「縣市 × 行政區」合併檢驗站數量與轄區內測站的平均 PM2.5 / AQI
+
+    station_count: 各行政區的檢驗站數量（city / district / station_count）
+
+    空汙平均以資料列加權（與 city_air_vs_station 的縣市平均算法一致）；
+    只保留有空品測站的行政區
+
+    回傳欄位：city / district / station_count / site_count / sites / pm2.5 / aqi
+    """
+    import pandas as pd
+
+    station_count = station_count.astype({"city": object, "district": object})
+
+    # 先彙總到每個測站（總和與筆數），再依行政區加總，平均即為資料列加權
+    per_site = (
+        air_df.groupby("sitename", observed=True)[["pm2.5", "aqi"]]
+        .agg(["sum", "count"])
+    )
+    per_site.columns = [f"{col}_{stat}" for col, stat in per_site.columns]
+    per_site = per_site.reset_index().astype({"sitename": object})
+
+    located = site_map[site_map["district"] != ""].merge(per_site, on="sitename", how="inner")
+    grouped = located.groupby(["county", "district"], sort=False)
+    air_summary = grouped[["pm2.5_sum", "pm2.5_count", "aqi_sum", "aqi_count"]].sum()
+    air_summary["pm2.5"] = air_summary["pm2.5_sum"] / air_summary["pm2.5_count"]
+    air_summary["aqi"] = air_summary["aqi_sum"] / air_summary["aqi_count"]
+    air_summary["site_count"] = grouped.size()
+    air_summary["sites"] = grouped["sitename"].agg("、".join)
+    air_summary = air_summary.reset_index().rename(columns={"county": "city"})
+
+    merged = station_count.merge(
+        air_summary[["city", "district", "site_count", "sites", "pm2.5", "aqi"]],
+        on=["city", "district"],
+        how="inner",
+    )
+    return merged.sort_values(["city", "district"], ignore_index=True)
+
+
+# ---------- 主程式進入點 ----------
+# 用法：python gazetteer.py [空汙.xml] [機車排氣定檢站資料.xml]
+# 重建空品測站 → 行政區的快取並列出對應結果
+if __name__ == "__main__":
+    import argparse
+
+    from air_quality_xml_to_csv import read_air_quality
+    from moenv_crawler import crawl_moenv_xml
+
+    parser = argparse.ArgumentParser(description="空品測站 → 行政區對應")
+    parser.add_argument("air_xml", nargs="?", default="空汙.xml")
+    parser.add_argument("station_xml", nargs="?", default="機車排氣定檢站資料.xml")
+    args = parser.parse_args()
+
+    if os.path.exists(SITE_CACHE):
+        os.remove(SITE_CACHE)
+    stations = crawl_moenv_xml(args.station_xml)
+    site_map = map_sites(read_air_quality(args.air_xml, columns=["sitename", "county", "latitude", "longitude"]), stations)
+    print(site_map.to_string(index=False))
+    print(f"✅ {int((site_map['source'] != '').sum())}/{len(site_map)} 個測站已對應到行政區，快取於 {SITE_CACHE}")
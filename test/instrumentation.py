@@ -0,0 +1,163 @@
+import datetime
+import json
+import os
+import platform
+import time
+from contextlib import contextmanager
+
+try:
+    import resource
+except ImportError:      # Windows 沒有 resource 模組，峰值記憶體記為 None
+    resource = None
+
+
+# ==================================================
+# 各階段的執行紀錄：時間、CPU 時間、峰值記憶體、筆數
+# ==================================================
+# 用法：
+#   recorder = StageRecorder(profile_dir="profiles")
+#   df = recorder.run("crawl_moenv_xml", crawl_moenv_xml, xml_path)
+#   with recorder.stage("merge") as record:
+#       ...
+#       record["rows"] = len(merged)
+#   recorder.write("pipeline_metrics.jsonl")
+METRICS_FILE = "pipeline_metrics.jsonl"
+
+# 目前進行中的階段（可巢狀）各自已知的峰值：
+# 內層階段會把峰值歸零，結束時要把自己的峰值回報給外層
+_open_peaks = []
+
+
+def reset_peak_rss():
+    """
+    將行程的峰值 RSS 歸零（Linux：寫入 /proc/self/clear_refs）
+
+    回傳 False 表示不支援，此時只能取得整個行程至今的峰值
+    """
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+        return True
+    except OSError:
+        return False
+
+
+def peak_rss_mb():
+    """目前行程的峰值 RSS（MB）"""
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith("VmHWM:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+
+    if resource is not None:
+        # 非 Linux 的 ru_maxrss 單位各平台不同（macOS 為 bytes）
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss / 1024 / 1024 if platform.system() == "Darwin" else maxrss / 1024
+    return None
+
+
+class StageRecorder:
+    """
+    記錄每個階段的效能數據
+
+    profile_dir: 有指定時最外層的每個階段另外以 cProfile 分析（巢狀的內層階段包含在外層之中），
+                 每次執行在 profile_dir/<執行時間>/ 下輸出 <階段>.prof
+                 （可用 python -m pstats 或 snakeviz 開啟）
+    """
+
+    def __init__(self, profile_dir=None):
+        self.started = datetime.datetime.now()
+        self.run_id = self.started.strftime("%Y%m%d-%H%M%S")
+        self.records = []
+        self.profile_dir = None
+
+        if profile_dir:
+            self.profile_dir = os.path.join(profile_dir, self.run_id)
+            os.makedirs(self.profile_dir, exist_ok=True)
+
+    @contextmanager
+    def stage(self, name):
+        """量測 with 區塊；區塊內可在 record["rows"] 填入處理筆數"""
+
+        record = {"stage": name}
+        profiler = None
+        # 只分析最外層的階段：cProfile 同時只能有一個啟用（3.12 起會丟出 ValueError），
+        # 內層階段的呼叫已包含在外層的 .prof 中
+        if self.profile_dir and not _open_peaks:
+            import cProfile
+            profiler = cProfile.Profile()
+
+        # 歸零前先把外層階段到目前為止的峰值記下，否則外層會漏掉進入內層之前的峰值
+        if _open_peaks:
+            _open_peaks[-1] = max(_open_peaks[-1], peak_rss_mb() or 0)
+        per_stage = reset_peak_rss()
+        _open_peaks.append(0.0)
+        start_wall = time.perf_counter()
+        start_cpu = time.process_time()
+        if profiler:
+            profiler.enable()
+
+        try:
+            yield record
+        finally:
+            if profiler:
+                profiler.disable()
+
+            peak = peak_rss_mb()
+            inner_peak = _open_peaks.pop()
+            if peak is not None:
+                peak = max(peak, inner_peak)
+                if _open_peaks:
+                    _open_peaks[-1] = max(_open_peaks[-1], peak)
+
+            record.update({
+                "wall_s": round(time.perf_counter() - start_wall, 4),
+                "cpu_s": round(time.process_time() - start_cpu, 4),
+                "peak_rss_mb": round(peak, 1) if peak is not None else None,
+                "peak_is_per_stage": per_stage,
+            })
+
+            if profiler:
+                path = os.path.join(self.profile_dir, f"{name}.prof")
+                profiler.dump_stats(path)
+                record["profile"] = path
+
+            self.records.append(record)
+
+    def run(self, name, func, *args, **kwargs):
+        """執行 func 並記錄；回傳值有長度（DataFrame / list）時記為筆數"""
+
+        with self.stage(name) as record:
+            result = func(*args, **kwargs)
+            if result is not None and hasattr(result, "__len__"):
+                record["rows"] = len(result)
+        return result
+
+    def summary(self):
+        """整次執行的紀錄（可直接轉成 JSON）"""
+        return {
+            "run_id": self.run_id,
+            "started": self.started.isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "stages": self.records,
+        }
+
+    def write(self, path=METRICS_FILE):
+        """將本次執行附加到 JSON Lines 檔（每次執行一行）"""
+        with open(path, "a", encoding="utf-8") as f:
+            f.write(json.dumps(self.summary(), ensure_ascii=False) + "\n")
+        return path
+
+    def report(self):
+        """在終端機列出各階段的數據"""
+        print(f"\n{'階段':<20}{'時間':>8}{'CPU':>9}{'峰值記憶體':>9}{'筆數':>10}")
+        for r in self.records:
+            peak = f"{r['peak_rss_mb']:.0f} MB" if r["peak_rss_mb"] is not None else "N/A"
+            print(
+                f"{r['stage']:<22}{r['wall_s']:>8.2f}s{r['cpu_s']:>8.2f}s"
+                f"{peak:>12}{r.get('rows', ''):>12}"
+            )
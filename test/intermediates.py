@@ -0,0 +1,291 @@
+import os
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import union_categoricals
+
+
+# ==================================================
+# 分析中介檔（Parquet 欄式格式）
+# ==================================================
+# main.py 產生、final_plots / plot_analysis 讀取的中介資料統一放在這裡。
+# Parquet 會保留欄位型態與類別欄位，讀取時可只載入需要的欄位；
+# 原本的 CSV 仍可另外輸出，方便以 Excel 檢視。
+INTERMEDIATE_DIR = "intermediate"
+
+# ==================================================
+# 精簡欄位型態（檢測站 / 空汙資料共用）
+# ==================================================
+# 重複值多的文字欄位，存成類別型態（category）
+CATEGORY_COLUMNS = [
+    "city", "district", "county", "note",
+    "pollutant", "status", "sitename", "nearest_site",
+]
+
+# 座標用 float32 即可（精度約 1 公尺）
+FLOAT32_COLUMNS = ["latitude", "longitude"]
+
+# 代碼欄位：全部是不含前導零的整數時轉成整數（例如空品測站 siteid），
+# 含英文字母的代碼（例如檢驗站 A12）維持字串。
+# 這是依整份資料內容決定的型態，不能逐批判斷（某一批剛好全是數字就會與其他批不同），
+# 逐批解析時以 compact(df, codes=False) 保留解析時的型態，合併後再決定一次
+CODE_COLUMNS = ["station_no", "siteid"]
+
+INTEGER_CODE = r"^(?:0|[1-9]\d*)$"
+
+# 時間欄位（CSV 讀入時為字串）
+DATETIME_COLUMNS = ["datacreationdate"]
+
+
+def table_path(name, directory=INTERMEDIATE_DIR):
+    return os.path.join(directory, f"{name}.parquet")
+
+
+def is_text(series):
+    """是否為尚未轉成類別的文字欄位（object 或 pandas 字串型態）"""
+    return (
+        not isinstance(series.dtype, pd.CategoricalDtype)
+        and pd.api.types.is_string_dtype(series)
+    )
+
+
+def integer_codes(series):
+    """代碼欄位可無損轉成整數時轉為最小的整數型態，否則原樣回傳"""
+
+    if pd.api.types.is_integer_dtype(series):
+        return pd.to_numeric(series, downcast="integer")
+
+    if pd.api.types.is_float_dtype(series):
+        values = series.dropna()
+        if not (values % 1 == 0).all():
+            return series
+    elif is_text(series):
+        text = series.dropna().astype(str).str.strip()
+        if not text.str.fullmatch(INTEGER_CODE).all():
+            return series
+    else:
+        return series
+
+    if series.isna().any():
+        return pd.to_numeric(series).astype("Int32")
+    return pd.to_numeric(series, downcast="integer")
+
+
+def compact(df, codes=True):
+    """
+    將 DataFrame 轉成精簡型態（直接修改並回傳同一個 DataFrame）：
+    低重複度文字 → category、座標 → float32、整數代碼 → 整數、時間字串 → datetime
+
+    codes: False 時不轉換代碼欄位（逐批解析時使用，見 CODE_COLUMNS）
+    """
+
+    for col in CATEGORY_COLUMNS:
+        if col in df.columns and is_text(df[col]):
+            df[col] = df[col].astype("category")
+
+    for col in FLOAT32_COLUMNS:
+        if col in df.columns and df[col].dtype != "float32":
+            df[col] = pd.to_numeric(df[col], errors="coerce").astype("float32")
+
+    for col in CODE_COLUMNS if codes else []:
+        if col in df.columns:
+            df[col] = integer_codes(df[col])
+
+    for col in DATETIME_COLUMNS:
+        if col in df.columns and is_text(df[col]):
+            df[col] = pd.to_datetime(df[col], errors="coerce")
+
+    return df
+
+
+def replace_text(series, old, new):
+    """
+    字串取代；類別欄位只處理類別值本身，不展開成每列一個字串
+
+    取代後若有類別值重複（例如「臺北市」與「台北市」），會合併為同一個類別
+    """
+
+    if not isinstance(series.dtype, pd.CategoricalDtype):
+        return series.str.replace(old, new, regex=False)
+
+    categories = series.cat.categories.str.replace(old, new, regex=False)
+    if categories.is_unique:
+        return series.cat.rename_categories(categories)
+
+    mapping, uniques = pd.factorize(categories)
+    codes = series.cat.codes.to_numpy()
+    codes = np.where(codes >= 0, mapping[codes], -1)
+    return pd.Series(
+        pd.Categorical.from_codes(codes, categories=uniques),
+        index=series.index,
+        name=series.name,
+    )
+
+
+def concat_frames(frames):
+    """合併多個 DataFrame 批次，各批類別值不同的類別欄位仍維持 category"""
+
+    df = pd.concat(frames, ignore_index=True)
+    for col in frames[0].columns:
+        if isinstance(frames[0][col].dtype, pd.CategoricalDtype) and not isinstance(
+            df[col].dtype, pd.CategoricalDtype
+        ):
+            df[col] = pd.Categorical(union_categoricals([f[col] for f in frames]))
+    return df
+
+
+# ==================================================
+# 欄式批次：子行程回傳 DataFrame 時使用
+# ==================================================
+# 直接 pickle DataFrame 會連同 index / BlockManager 等內部結構一起序列化；
+# 改成「欄位 → (型態, NumPy 陣列...)」的 dict，類別欄位只傳代碼與類別值，
+# 主行程再以 from_columns 組回相同型態的 DataFrame
+def to_columns(df):
+    """DataFrame → 欄式批次（dict，可直接在行程間傳遞）"""
+    columns = {}
+    for col in df.columns:
+        series = df[col]
+        dtype = series.dtype
+        if isinstance(dtype, pd.CategoricalDtype):
+            columns[col] = ("category", series.cat.codes.to_numpy(), series.cat.categories)
+        elif isinstance(dtype, pd.api.extensions.ExtensionDtype) and dtype.kind in "iu":
+            # 可為空的整數（Int32 等）：數值與缺值遮罩分開傳
+            columns[col] = (
+                str(dtype),
+                series.array.to_numpy(dtype=dtype.numpy_dtype, na_value=0),
+                pd.isna(series).to_numpy(),
+            )
+        elif isinstance(dtype, pd.StringDtype):
+            columns[col] = ("str", *arrow_buffers(series), None)
+        else:
+            columns[col] = ("array", series.to_numpy(), None)
+    return columns
+
+
+def arrow_buffers(series):
+    """
+    字串欄位 → (長度資訊, Arrow 緩衝區)
+
+    pandas 的字串型態底層即為 Arrow 陣列：直接傳送其緩衝區（位移 + UTF-8 內容），
+    主行程不必逐一建立 Python 字串
+    """
+    import pyarrow as pa
+
+    array = pa.array(series.array, type=pa.large_string(), from_pandas=True)
+    if isinstance(array, pa.ChunkedArray):
+        array = array.combine_chunks()
+
+    # 切片後的陣列仍指向原本整份緩衝區：先複製成只含這一段的緩衝區再傳送
+    array = pa.concat_arrays([array])
+    buffers = [None if b is None else np.frombuffer(b, dtype=np.uint8) for b in array.buffers()]
+    return (len(array), array.null_count, array.offset), buffers
+
+
+def from_arrow_buffers(layout, buffers):
+    import pyarrow as pa
+
+    length, null_count, offset = layout
+    return pa.Array.from_buffers(
+        pa.large_string(), length,
+        [None if b is None else pa.py_buffer(b) for b in buffers],
+        null_count=null_count, offset=offset,
+    )
+
+
+def column_part(part):
+    """欄式批次中的一欄 → pandas Series"""
+    kind, first, second = part[:3]
+    if kind == "category":
+        return pd.Series(pd.Categorical.from_codes(first, categories=second))
+    if kind == "str":
+        return pd.Series(pd.array(from_arrow_buffers(first, second), dtype="str"))
+    if kind == "array":
+        return pd.Series(first)
+    return pd.Series(pd.arrays.IntegerArray(first, second))
+
+
+def concat_mixed(parts):
+    """
+    各批型態不同的同一欄（例如一批為 int8、另一批為可為空的 Int32 或字串）先組回 Series 再合併，
+    由 pandas 決定共同型態（整數 → 可容納缺值的整數 / 浮點數）；其中有字串時全部轉成字串
+    """
+    series = [column_part(part) for part in parts]
+    if any(kind == "str" for kind, *_ in parts):
+        series = [s.astype("str") for s in series]
+    return pd.concat(series, ignore_index=True).array
+
+
+def from_columns(batches):
+    """
+    一個或多個欄式批次（欄位相同）→ 單一 DataFrame（型態與 to_columns 之前相同）
+
+    多個批次時直接串接各欄的底層陣列，只建立一次 DataFrame，
+    比逐批組回 DataFrame 再 concat 少了大量的區塊合併。
+    同一欄在各批的型態不同時（各檔案分別精簡型態的結果）改以 concat_mixed 合併
+    """
+    if isinstance(batches, dict):
+        batches = [batches]
+
+    data = {}
+    for col, (kind, *_) in batches[0].items():
+        parts = [batch[col] for batch in batches]
+        kinds = {part[0] for part in parts}
+        # 只有可為空整數的寬度不同（Int8 / Int32）時仍可直接串接
+        nullable = kinds.isdisjoint({"category", "str", "array"})
+        if len(kinds) > 1 and not nullable:
+            data[col] = concat_mixed(parts)
+        elif kind == "category":
+            # 各批的類別值對應到共同的類別清單（依出現順序），再一次轉換代碼
+            index = {}
+            codes = []
+            for _, batch_codes, cats in parts:
+                lookup = np.array([index.setdefault(c, len(index)) for c in cats] + [-1])
+                codes.append(lookup[batch_codes])
+            data[col] = pd.Categorical.from_codes(
+                np.concatenate(codes), categories=pd.Index(list(index), dtype=parts[0][2].dtype)
+            )
+        elif kind == "str":
+            import pyarrow as pa
+
+            data[col] = pd.array(
+                pa.concat_arrays([from_arrow_buffers(layout, buffers) for _, layout, buffers, _ in parts]),
+                dtype="str",
+            )
+        elif kind == "array":
+            data[col] = np.concatenate([values for _, values, _ in parts])
+        else:
+            data[col] = pd.arrays.IntegerArray(
+                np.concatenate([values for _, values, _ in parts]),
+                np.concatenate([mask for _, _, mask in parts]),
+            )
+    return pd.DataFrame(data, columns=list(batches[0]))
+
+
+def write_table(df, name, export_csv=True, directory=INTERMEDIATE_DIR):
+    """
+    將 DataFrame 寫成 Parquet 中介檔
+
+    參數說明：
+    name      : 中介檔名稱（不含副檔名），同時也是 CSV 檔名
+    export_csv: 是否另外輸出 {name}.csv 到目前目錄
+    """
+
+    os.makedirs(directory, exist_ok=True)
+
+    # Parquet 會保留精簡後的型態（category / float32 / 整數代碼）
+    df = compact(df.reset_index(drop=True))
+
+    df.to_parquet(table_path(name, directory), index=False)
+
+    if export_csv:
+        df.to_csv(f"{name}.csv", index=False, encoding="utf-8-sig")
+
+
+def read_table(name, columns=None, directory=INTERMEDIATE_DIR):
+    """
+    讀取 Parquet 中介檔
+
+    參數說明：
+    columns: 只載入的欄位（None 表示全部）
+    """
+    return pd.read_parquet(table_path(name, directory), columns=columns)
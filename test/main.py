@@ -1,117 +1,278 @@
 from moenv_crawler import crawl_moenv_xml
 import analysis
 import pandas as pd
-import final_plots
+import spatial
+import station_summary
+from intermediates import compact, replace_text, write_table
+from instrumentation import METRICS_FILE, StageRecorder
 
+# 注意：繪圖模組（final_plots / matplotlib）只在繪圖階段才載入，
+# 只需要匯入資料時可省下載入繪圖套件的時間
 
-def main():
-    print("=== 空汙 × 機車排氣檢測站 大數據分析專案 ===")
 
-    # ==================================================
-    # 1️⃣ 讀取機車排氣檢測站 XML 資料
-    #    資料來源：環境部（原環保署）公開資料
-    # ==================================================
-    station_df = crawl_moenv_xml("機車排氣定檢站資料.xml")
+# ==================================================
+# 1️⃣ 讀取機車排氣檢測站 XML 資料
+#    資料來源：環境部（原環保署）公開資料
+# ==================================================
+def ingest_stations(xml_path="機車排氣定檢站資料.xml", export_csv=True, recorder=None):
+    """解析、清理並儲存檢測站資料；資料為空時回傳 None"""
+    recorder = recorder or StageRecorder()
+
+    station_df = recorder.run("crawl_moenv_xml", crawl_moenv_xml, xml_path)
 
     # 若資料為空，代表 XML 讀取失敗或檔案有問題
     if station_df.empty:
         print("❌ 機車檢測站資料為空，專案結束")
-        return
+        return None
 
     # 清理資料（縣市名稱統一、去除空值與重複值）
-    station_df = analysis.clean_data(station_df)
+    station_df = recorder.run("clean_data", analysis.clean_data, station_df)
 
-    # 將整理後資料儲存為 CSV 與 SQLite
-    analysis.save_files(station_df)
+    # 與資料庫中的上一份資料比對新增 / 移除 / 變更的檢測站（寫入前比對；
+    # 變更紀錄在 save_files 寫入 SQLite 的同一個交易內記錄）
+    with recorder.stage("station_diff") as record:
+        import snapshot_diff
+        diff = snapshot_diff.diff_against_db(station_df, record=False)
+        if diff is not None:
+            record["rows"] = len(diff["added"]) + len(diff["removed"]) + len(diff["modified"])
 
-    # ==================================================
-    # 2️⃣ 讀取空氣品質資料（PM2.5、AQI）
-    # ==================================================
-    try:
-        air_df = pd.read_csv("air_quality.csv")
-    except FileNotFoundError:
-        print("❌ 找不到 air_quality.csv")
-        return
+    # 將整理後資料儲存為中介檔與 SQLite
+    with recorder.stage("save_files") as record:
+        analysis.save_files(station_df, export_csv=export_csv, changes=diff)
+        record["rows"] = len(station_df)
+
+    # 各行政區的檢驗站數量寫入彙總立方體（air_cube）
+    with recorder.stage("air_cube_stations") as record:
+        import air_cube
+        record["rows"] = air_cube.update_stations()
+    return station_df
+
+
+# ==================================================
+# 2️⃣ 讀取空氣品質資料（PM2.5、AQI）
+# ==================================================
+def load_air(csv_path="air_quality.csv", recorder=None):
+    """讀取空汙 CSV 並存成中介檔；找不到檔案時回傳 None"""
+    recorder = recorder or StageRecorder()
+
+    with recorder.stage("load_air") as record:
+        try:
+            # CSV 不保存型態，讀入後轉回精簡型態（category / float32 / 整數代碼）
+            air_df = compact(pd.read_csv(csv_path))
+        except FileNotFoundError:
+            print(f"❌ 找不到 {csv_path}")
+            return None
+
+        # 統一縣市名稱用字（臺 → 台），方便後續資料合併
+        air_df["county"] = replace_text(air_df["county"], "臺", "台")
+
+        # 存成中介檔供繪圖使用（air_quality.csv 本身即為輸入檔，不重新輸出）
+        write_table(air_df, "air_quality", export_csv=False)
+        record["rows"] = len(air_df)
+
+    # 累計統計與彙總立方體都以資料建立時間分桶，沒有 datacreationdate 的 CSV 無法併入
+    if "datacreationdate" not in air_df.columns:
+        print("⚠️ air_quality.csv 沒有資料建立時間，略過累計統計與彙總立方體")
+        print("✅ 成功載入空汙資料")
+        return air_df
+
+    # 新的快照併入各縣市 / 測站的累計統計（已處理過的快照不會重複計算）
+    with recorder.stage("air_rolling") as record:
+        import air_rolling
+        record["rows"] = air_rolling.update(air_df)
+
+    # 同一批快照併入「縣市 × 行政區 × 小時 × 污染物」彙總立方體
+    with recorder.stage("air_cube") as record:
+        import air_cube
+        record["rows"] = air_cube.update_air(air_df)
 
-    # 統一縣市名稱用字（臺 → 台），方便後續資料合併
-    air_df["county"] = air_df["county"].str.replace("臺", "台")
     print("✅ 成功載入空汙資料")
+    return air_df
+
+
+def station_counts(station_df, by, db_path=None):
+    """
+    各縣市（by=["city"]）或各「縣市 × 行政區」（by=["city", "district"]）的檢測站數量
+
+    db_path: 指定時讀該 SQLite 的彙總表（station_summary，不必掃描檢測站明細），
+             呼叫端須確定資料庫與 station_df 是同一份資料（例如剛由 ingest_stations 寫入）；
+             None 時由 station_df 計算
+    """
+    if db_path is not None:
+        if by == ["city"]:
+            return station_summary.city_counts(db_path)
+        return station_summary.district_counts(db_path=db_path)
+    return station_df.groupby(by, observed=True).size().reset_index(name="station_count")
+
+
+def analyze(station_df, air_df, export_csv=True, recorder=None, db_path=None, air_state=None):
+    """
+    執行縣市 / 行政區 / 最近測站分析並輸出中介檔
+
+    db_path  : 檢測站數量改讀此 SQLite 的彙總表與彙總立方體（內容須與 station_df 相同）；
+               None 時全部分析都由 station_df 計算，不混用其他來源
+    air_state: 各縣市平均改取自此空汙累計統計資料庫（air_rolling，須已併入 air_df），
+               並輸出累計 / 視窗統計；None（或資料庫還沒有統計）時由 air_df 計算
+    """
+    recorder = recorder or StageRecorder()
 
     # ==================================================
     # 3️⃣ 各縣市「空汙程度 × 檢測站數量」分析
     #    目的：比較空氣污染程度與檢測站設置密度
     # ==================================================
+    with recorder.stage("city_air_merge") as record:
+        # 每個縣市的機車檢測站總數
+        station_count = station_counts(station_df, ["city"], db_path)
+
+        # 各縣市平均 PM2.5 與 AQI：有指定累計統計時直接取用（load_air 時已增量更新，不重新掃描歷史資料），
+        # 否則直接由 air_df 計算
+        import air_rolling
+        if air_state is not None and air_rolling.has_state(air_state):
+            air_summary = air_rolling.county_means(air_state)
 
-    # 計算每個縣市的機車檢測站總數
-    station_count = (
-        station_df.groupby("city")
-        .size()
-        .reset_index(name="station_count")
-    )
-
-    # 計算各縣市平均 PM2.5 與 AQI
-    air_summary = (
-        air_df.groupby("county")[["pm2.5", "aqi"]]
-        .mean()
-        .reset_index()
-    )
-
-    # 合併「檢測站數量」與「空氣品質」資料
-    merged_city_df = pd.merge(
-        station_count,
-        air_summary,
-        left_on="city",
-        right_on="county",
-        how="inner"
-    ).drop(columns=["county"])
-
-    # 輸出分析結果供報告或後續使用
-    merged_city_df.to_csv(
-        "city_air_vs_station.csv",
-        index=False,
-        encoding="utf-8-sig"
-    )
-
-    print("✅ 已產生 city_air_vs_station.csv")
+            # 各縣市 / 測站的累計與視窗（24h / 7d）統計：筆數、平均、變異數、最小、最大
+            write_table(air_rolling.summary("county", air_state), "county_air_rolling", export_csv=export_csv)
+            write_table(air_rolling.summary("site", air_state), "site_air_rolling", export_csv=export_csv)
+        else:
+            air_summary = (
+                air_df.groupby("county", observed=True)[["pm2.5", "aqi"]]
+                .mean()
+                .reset_index()
+            )
+
+        # 合併「檢測站數量」與「空氣品質」資料
+        merged_city_df = pd.merge(
+            station_count,
+            air_summary,
+            left_on="city",
+            right_on="county",
+            how="inner"
+        ).drop(columns=["county"])
+
+        # 輸出分析結果供報告或後續使用
+        write_table(merged_city_df, "city_air_vs_station", export_csv=export_csv)
+
+        print("✅ 已產生 city_air_vs_station")
+        record["rows"] = len(merged_city_df)
 
     # ==================================================
     # 4️⃣ 高 PM2.5 縣市的行政區檢測站分布分析
     #    目的：找出空汙嚴重縣市中，檢測站集中在哪些行政區
     # ==================================================
+    with recorder.stage("high_pm25_districts") as record:
+        # 取 PM2.5 平均值最高的前 5 名縣市
+        top_pm25_cities = (
+            merged_city_df
+            .sort_values("pm2.5", ascending=False)
+            .head(5)["city"]
+            .tolist()
+        )
+
+        # 這些高空汙縣市「縣市 × 行政區」的檢測站數量：有指定資料庫、且彙總立方體的檢驗站數量
+        # 正是由該資料庫寫入時直接切立方體（air_cube），否則由彙總表 / station_df 計算
+        import air_cube
+        cube = air_cube.load_cube()
+        district_count = station_counts(station_df, ["city", "district"], db_path)
+        if db_path is not None and cube.stations_from(db_path) and cube.station_count.any():
+            district_summary = cube.station_counts(cities=top_pm25_cities)
+        else:
+            district_summary = district_count[district_count["city"].isin(top_pm25_cities)]
+
+        # 儲存高 PM2.5 縣市行政區分析結果
+        write_table(district_summary, "high_pm25_city_district_station", export_csv=export_csv)
+
+        # 最近一週這些縣市各行政區的平均 PM2.5 / AQI（立方體的時段切片）與檢測站數量
+        week_df = pd.merge(
+            district_summary,
+            cube.air_means(cities=top_pm25_cities, pollutants=["pm2.5", "aqi"], last="7D"),
+            on=["city", "district"],
+            how="left",
+        ) if cube.hours else district_summary.assign(**{"pm2.5": float("nan"), "aqi": float("nan")})
+        write_table(week_df, "high_pm25_district_week", export_csv=export_csv)
+
+        print("✅ 已產生 high_pm25_city_district_station、high_pm25_district_week")
+        record["rows"] = len(district_summary)
+
+    # ==================================================
+    # 5️⃣ 各行政區「空汙程度 × 檢測站數量」分析
+    #    目的：空品測站對應到所在行政區（gazetteer），
+    #          以行政區而非整個縣市比較空汙與檢測站數量
+    # ==================================================
+    with recorder.stage("district_air_merge") as record:
+        import gazetteer
+        site_map = gazetteer.map_sites(air_df, station_df)
+        merged_district_df = gazetteer.district_air_vs_station(district_count, air_df, site_map)
+        write_table(merged_district_df, "district_air_vs_station", export_csv=export_csv)
+        record["rows"] = len(merged_district_df)
+    print("✅ 已產生 district_air_vs_station")
 
-    # 取 PM2.5 平均值最高的前 5 名縣市
-    top_pm25_cities = (
-        merged_city_df
-        .sort_values("pm2.5", ascending=False)
-        .head(5)["city"]
-        .tolist()
-    )
-
-    # 篩選出這些高空汙縣市的檢測站資料
-    high_pm25_df = station_df[station_df["city"].isin(top_pm25_cities)]
-
-    # 計算「縣市 × 行政區」的檢測站數量
-    district_summary = (
-        high_pm25_df
-        .groupby(["city", "district"])
-        .size()
-        .reset_index(name="station_count")
-    )
-
-    # 儲存高 PM2.5 縣市行政區分析結果
-    district_summary.to_csv(
-        "high_pm25_city_district_station.csv",
-        index=False,
-        encoding="utf-8-sig"
-    )
-
-    print("✅ 已產生 high_pm25_city_district_station.csv")
+    # ==================================================
+    # 6️⃣ 每個檢測站最近的空品測站（空間最近鄰）
+    #    目的：以實際座標取代縣市平均，取得檢測站附近的 PM2.5 / AQI
+    # ==================================================
+    if {"latitude", "longitude"}.issubset(air_df.columns):
+        with recorder.stage("nearest_site") as record:
+            nearest_df = spatial.attach_nearest_site(station_df, air_df)
+            write_table(nearest_df, "station_nearest_site", export_csv=export_csv)
+            record["rows"] = len(nearest_df)
+        print("✅ 已產生 station_nearest_site")
+    else:
+        print("⚠️ air_quality.csv 沒有測站座標，略過最近測站分析")
+        return
 
     # ==================================================
-    # 5️⃣ ⭐ 自動產生最終分析圖表（報告重點）
+    # 7️⃣ 每個檢測站的 PM2.5 / AQI 推估值（反距離加權 IDW）
+    #    目的：大縣市（如屏東縣、花蓮縣）內各地空汙差異大，
+    #          以周邊最近幾個測站推估每個檢測站的暴露程度
     # ==================================================
-    print("\n📈 自動繪製最終分析圖表...")
-    final_plots.run_final_plots()
+    with recorder.stage("station_exposure") as record:
+        exposure_df = spatial.station_exposure(station_df, air_df)
+        write_table(exposure_df, "station_exposure", export_csv=export_csv)
+
+        # 依「縣市 × 行政區」彙總推估值
+        district_exposure = spatial.exposure_by_district(exposure_df)
+        write_table(district_exposure, "district_exposure", export_csv=export_csv)
+        record["rows"] = len(exposure_df)
+    print("✅ 已產生 station_exposure、district_exposure")
+
+
+# ==================================================
+# 8️⃣ ⭐ 自動產生最終分析圖表（報告重點）
+# ==================================================
+def plot(chart_dir=None, fmt="png", recorder=None):
+    """繪製最終分析圖表；chart_dir 有指定時輸出成圖檔（png / svg）"""
+    recorder = recorder or StageRecorder()
+
+    with recorder.stage("plot"):
+        import final_plots
+
+        print("\n📈 自動繪製最終分析圖表...")
+        final_plots.run_final_plots(chart_dir, fmt)
+
+
+def main(export_csv=True, chart_dir=None, metrics_path=METRICS_FILE, profile_dir=None, force=False):
+    """
+    export_csv  : 除了 Parquet 中介檔之外，是否也輸出各分析結果的 CSV
+    chart_dir   : 指定時圖表直接輸出成圖檔（無視窗模式），否則以視窗顯示
+    metrics_path: 各階段的時間 / CPU / 峰值記憶體 / 筆數附加到此 JSON Lines 檔（None 為不輸出）
+    profile_dir : 指定時每個階段另外以 cProfile 分析，輸出 .prof 檔到此目錄
+    force       : 全部重新執行（預設只執行輸入有變更的階段，見 pipeline.py）
+    """
+    import pipeline
+
+    print("=== 空汙 × 機車排氣檢測站 大數據分析專案 ===")
+    recorder = StageRecorder(profile_dir)
+
+    try:
+        stages = pipeline.build_stages(export_csv=export_csv, chart_dir=chart_dir)
+        if not pipeline.run_pipeline(stages, force=force, recorder=recorder):
+            return
+    finally:
+        # 中途失敗時也保留已完成階段的紀錄
+        if recorder.records:
+            recorder.report()
+            if metrics_path:
+                print(f"📊 各階段效能紀錄已附加到 {recorder.write(metrics_path)}")
 
     print("\n=== 專案分析完成 ===")
 
@@ -3,6 +3,30 @@ import xml.etree.ElementTree as ET
 import os
 import re
 
+import gazetteer
+from intermediates import compact, concat_frames
+
+
+# ==================================================
+# 台灣所有縣市清單
+# ==================================================
+CITIES = [
+    "台北市", "新北市", "桃園市", "台中市", "台南市", "高雄市",
+    "基隆市", "新竹市", "嘉義市",
+    "新竹縣", "苗栗縣", "彰化縣", "南投縣", "雲林縣",
+    "嘉義縣", "屏東縣", "宜蘭縣", "花蓮縣", "台東縣",
+    "澎湖縣", "金門縣", "連江縣"
+]
+
+# 批次用：一次比對「縣市開頭 + 行政區」
+# 行政區只接受 gazetteer 中的名稱（沒有任何名稱是另一個的前綴，比對結果唯一），
+# 比對後再以 gazetteer 確認行政區屬於該縣市
+ADDRESS_PATTERN = re.compile(
+    r"^(" + "|".join(CITIES) + r")("
+    + "|".join(sorted({d for names in gazetteer.DISTRICT_INDEX.values() for d in names}, key=len, reverse=True))
+    + r")?"
+)
+
 
 # ==================================================
 # 從地址字串中擷取「縣市名稱」
@@ -15,17 +39,8 @@ def extract_city(address):
     # 統一用字（臺 → 台）
     address = address.replace("臺", "台")
 
-    # 台灣所有縣市清單
-    cities = [
-        "台北市", "新北市", "桃園市", "台中市", "台南市", "高雄市",
-        "基隆市", "新竹市", "嘉義市",
-        "新竹縣", "苗栗縣", "彰化縣", "南投縣", "雲林縣",
-        "嘉義縣", "屏東縣", "宜蘭縣", "花蓮縣", "台東縣",
-        "澎湖縣", "金門縣", "連江縣"
-    ]
-
     # 判斷地址是否以縣市名稱開頭
-    for city in cities:
+    for city in CITIES:
         if address.startswith(city):
             return city
 
@@ -43,6 +58,9 @@ def extract_district(address, city):
     範例：
     台北市中正區忠孝西路 → 中正區
     新竹縣竹北市光明路 → 竹北市
+    臺南市新市區信義街 → 新市區
+
+    只接受該縣市的合法行政區（gazetteer），其他一律回傳空字串
     """
 
     # 若地址或縣市不存在，直接回傳空字串
@@ -55,61 +73,152 @@ def extract_district(address, city):
     # 擷取「縣市名稱之後」的地址內容
     rest = address[len(city):]
 
-    # 使用正則表達式擷取行政區名稱
-    # 區 / 鄉 / 鎮 / 市 結尾
-    match = re.search(r"^(.+?(區|鄉|鎮|市))", rest)
-    if match:
-        return match.group(1)
+    # 以行政區索引比對開頭（無法判斷行政區時回傳空值）
+    return gazetteer.match_district(city, rest)
 
-    # 無法判斷行政區時回傳空值
-    return ""
+
+# ==================================================
+# 批次擷取整欄地址的「縣市」與「行政區」
+# ==================================================
+def extract_city_district(addresses):
+    """
+    extract_city / extract_district 的向量化版本，結果與逐筆呼叫相同
+
+    - 相同地址只解析一次（先 factorize 去重，再對應回原本每一列）
+    - 臺 → 台 與縣市、行政區比對皆以 pandas 字串運算一次完成
+
+    回傳與輸入同 index、含 city / district 兩欄的 DataFrame
+    """
+
+    addresses = pd.Series(addresses, dtype=object).fillna("")
+
+    # 去重：codes 為每列對應到 uniques 的位置
+    codes, uniques = pd.factorize(addresses)
+    normalized = pd.Series(uniques, dtype=object).str.replace("臺", "台", regex=False)
+
+    # 無法比對的縣市 / 行政區一律為空字串
+    parts = normalized.str.extract(ADDRESS_PATTERN).fillna("")
+
+    # 行政區必須屬於比對到的縣市（例如台北市地址接到只有台中市才有的行政區）
+    parts.loc[~gazetteer.valid_mask(parts[0], parts[1]), 1] = ""
+
+    return pd.DataFrame(
+        {
+            "city": parts[0].to_numpy(dtype=object)[codes],
+            "district": parts[1].to_numpy(dtype=object)[codes],
+        },
+        index=addresses.index,
+    )
+
+
+# ==================================================
+# 串流解析：逐筆讀取 <item-N>，分批輸出欄位緩衝區
+# ==================================================
+# XML 子節點名稱 → 輸出欄位名稱
+STATION_FIELDS = {
+    "sno": "station_no",
+    "sname": "station_name",
+    "tel": "tel",
+    "address": "address",
+    "latitude": "latitude",
+    "longitude": "longitude",
+    "note": "note",
+}
+
+# 輸出欄位順序（與原本 DataFrame 相同）
+STATION_COLUMNS = list(STATION_FIELDS.values()) + ["city", "district"]
+
+
+def iter_station_batches(file_path, batch_size=10000):
+    """
+    以 iterparse 逐筆解析檢驗站 XML，每累積 batch_size 筆
+    就輸出一個 DataFrame 批次
+
+    - 每筆 <item-N> 讀完後立即 clear()，記憶體用量與檔案大小無關
+    - 資料先放進「欄位 → list」的緩衝區，整批再轉成 DataFrame，
+      縣市與行政區也是整批擷取
+    """
+
+    # 每個欄位各自一個 list（欄式緩衝區）
+    buffers = {col: [] for col in STATION_FIELDS.values()}
+    count = 0
+    root = None
+
+    for event, elem in ET.iterparse(file_path, events=("start", "end")):
+
+        # 記下根節點，之後用來釋放已處理完的子節點
+        if event == "start":
+            if root is None:
+                root = elem
+            continue
+
+        # 只處理 <item-N> 紀錄節點（其餘為欄位節點或根節點）
+        if elem is root or not elem.tag.startswith("item"):
+            continue
+
+        # 單次走訪子節點取出所有欄位
+        record = dict.fromkeys(STATION_FIELDS, "")
+        for child in elem:
+            if child.tag in record and child.text:
+                record[child.tag] = child.text.strip()
+
+        for tag, col in STATION_FIELDS.items():
+            buffers[col].append(record[tag])
+
+        # 釋放已處理的節點，避免整棵樹留在記憶體
+        elem.clear()
+        root.clear()
+
+        count += 1
+        if count == batch_size:
+            yield build_station_batch(buffers)
+            buffers = {col: [] for col in STATION_FIELDS.values()}
+            count = 0
+
+    # 輸出最後不足一批的資料
+    if count:
+        yield build_station_batch(buffers)
+
+
+def build_station_batch(buffers):
+    """
+    將欄位緩衝區轉成 DataFrame，並整批從地址擷取縣市與行政區
+
+    輸出為精簡型態：縣市 / 行政區 / 備註為 category、座標為 float32；
+    station_no 維持字串，是否轉成整數由合併後的整份資料決定（見 intermediates.CODE_COLUMNS）
+    """
+    df = pd.DataFrame(buffers)
+    df[["city", "district"]] = extract_city_district(df["address"])
+    return compact(df[STATION_COLUMNS], codes=False)
 
 
 # ==================================================
 # 爬取並解析環境部 XML 機車排氣檢驗站資料
 # ==================================================
-def crawl_moenv_xml(file_path="inspection_stations.xml"):
+def crawl_moenv_xml(file_path="inspection_stations.xml", stream=False, batch_size=10000):
+    """
+    參數說明：
+    file_path : 檢驗站 XML 檔案路徑
+    stream    : True 時回傳 DataFrame 批次的 generator，
+                可邊讀檔邊進行後續清洗
+    batch_size: 串流模式下每批筆數
+    """
 
     # 檢查檔案是否存在
     if not os.path.isfile(file_path):
         print(f"❌ 找不到檔案：{file_path}")
-        return pd.DataFrame()
-
-    # 解析 XML 檔案
-    tree = ET.parse(file_path)
-    root = tree.getroot()
-
-    data = []
-
-    # 逐筆讀取 XML 中的檢驗站資料
-    for item in root:
-        station_no = item.findtext("sno", default="").strip()
-        station_name = item.findtext("sname", default="").strip()
-        tel = item.findtext("tel", default="").strip()
-        address = item.findtext("address", default="").strip()
-        latitude = item.findtext("latitude", default="").strip()
-        longitude = item.findtext("longitude", default="").strip()
-        note = item.findtext("note", default="").strip()
-
-        # 從地址擷取縣市與行政區
-        city = extract_city(address)
-        district = extract_district(address, city)
-
-        # 將資料存成 dict
-        data.append({
-            "station_no": station_no,
-            "station_name": station_name,
-            "tel": tel,
-            "address": address,
-            "latitude": latitude,
-            "longitude": longitude,
-            "note": note,
-            "city": city,
-            "district": district
-        })
-
-    # 轉成 DataFrame
-    df = pd.DataFrame(data)
+        return iter(()) if stream else pd.DataFrame()
+
+    # 串流模式：直接交給呼叫端逐批處理
+    if stream:
+        return iter_station_batches(file_path, batch_size)
+
+    # 一般模式：將所有批次合併成單一 DataFrame
+    batches = list(iter_station_batches(file_path, batch_size))
+    if batches:
+        df = compact(concat_frames(batches))
+    else:
+        df = pd.DataFrame(columns=STATION_COLUMNS)
 
     print(f"✅ XML 解析抓到 {len(df)} 筆檢驗站資料")
     return df
@@ -0,0 +1,663 @@
+import asyncio
+import hashlib
+import io
+import json
+import os
+import queue
+import random
+import ssl
+import xml.etree.ElementTree as ET
+import zlib
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+
+# ==================================================
+# 非同步下載環境部開放資料：檢測站與空汙（AQI）
+# ==================================================
+# 取代原本分開執行的下載腳本：
+#   - 兩個資料集同時下載；空汙 API 以 offset / limit 分頁，多頁同時下載
+#   - 同一主機的連線放進連線池重複使用（HTTP/1.1 keep-alive），總連線數有上限
+#   - 記錄 ETag / Last-Modified，下次帶 If-None-Match / If-Modified-Since，
+#     伺服器回 304 時不重新下載
+#   - 連線錯誤、逾時、429 / 5xx 依指數退避（含隨機抖動）重試
+#   - 回應內容邊下載邊交給 iterparse 解析（在背景執行緒），不等整份下載完
+#
+# 下載結果寫回流程使用的 XML（機車排氣定檢站資料.xml、空汙.xml），
+# 內容有變更時 python cli.py all 才會重跑對應的階段
+#
+# 只使用標準函式庫（asyncio streams），不需額外安裝 HTTP 套件
+#
+# 用法：
+#   python cli.py fetch --station-url URL --api-key KEY
+#   MOENV_API_KEY=... MOENV_STATION_URL=... python moenv_fetcher.py
+AIR_URL = "https://data.moenv.gov.tw/api/v2/aqx_p_488"
+CACHE_DIR = "fetch_cache"
+
+# 值得重試的 HTTP 狀態碼
+RETRY_STATUS = frozenset({408, 429, 500, 502, 503, 504})
+
+CHUNK_SIZE = 64 * 1024
+
+# 網址中的憑證參數：不得出現在訊息、例外或快取索引中（見 redact）
+SECRET_PARAMS = frozenset({"api_key"})
+
+
+class FetchError(Exception):
+    """下載失敗（重試後仍失敗，或伺服器回應無法重試的錯誤）"""
+
+
+class RetryableStatus(Exception):
+    def __init__(self, status, retry_after=None):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+        self.retry_after = retry_after
+
+
+# ==================================================
+# HTTP/1.1 連線池
+# ==================================================
+class Response:
+    """
+    HTTP 回應：讀完標頭即回傳，內容以 iter_chunks() 串流讀取
+
+    內容讀完（或呼叫 release()）後連線才歸還連線池
+    """
+
+    def __init__(self, status, headers, reader, release, method):
+        self.status = status
+        self.headers = headers
+        self._reader = reader
+        self._release = release
+        self._method = method
+        self._done = False
+
+    def header(self, name, default=None):
+        return self.headers.get(name.lower(), default)
+
+    async def _raw_chunks(self):
+        """依 Content-Length / chunked / 關閉連線 判斷內容結尾"""
+        if self._method == "HEAD" or self.status in (204, 304) or 100 <= self.status < 200:
+            return
+
+        reader = self._reader
+        if "chunked" in self.header("transfer-encoding", "").lower():
+            while True:
+                line = await reader.readline()
+                if not line:
+                    # 還沒收到結尾的 0 區塊連線就關閉：內容不完整
+                    raise asyncio.IncompleteReadError(b"", None)
+                size = int(line.split(b";")[0].strip() or b"0", 16)
+                if size == 0:
+                    # 略過 trailer，直到空白行
+                    while (await reader.readline()).strip():
+                        pass
+                    return
+                yield await reader.readexactly(size)
+                await reader.readexactly(2)
+
+        elif self.header("content-length") is not None:
+            remaining = int(self.header("content-length"))
+            while remaining:
+                chunk = await reader.read(min(CHUNK_SIZE, remaining))
+                if not chunk:
+                    raise asyncio.IncompleteReadError(b"", remaining)
+                remaining -= len(chunk)
+                yield chunk
+
+        else:
+            # 沒有長度資訊：讀到伺服器關閉連線為止（連線不可重用）
+            self.headers["connection"] = "close"
+            while chunk := await reader.read(CHUNK_SIZE):
+                yield chunk
+
+    async def iter_chunks(self):
+        """逐塊讀取內容（gzip 壓縮的內容會邊讀邊解壓）"""
+        decoder = None
+        if self.header("content-encoding", "").lower() == "gzip":
+            decoder = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+        try:
+            async for chunk in self._raw_chunks():
+                if decoder:
+                    chunk = decoder.decompress(chunk)
+                if chunk:
+                    yield chunk
+            if decoder and (tail := decoder.flush()):
+                yield tail
+            if decoder and not decoder.eof:
+                # gzip 串流沒有結尾（例如沒有長度資訊、連線提早關閉）
+                raise asyncio.IncompleteReadError(b"", None)
+        except BaseException:
+            self.close()
+            raise
+        self.release()
+
+    async def read(self):
+        return b"".join([chunk async for chunk in self.iter_chunks()])
+
+    def release(self):
+        """內容已讀完：可重用的連線放回連線池"""
+        if not self._done:
+            self._done = True
+            reusable = self.header("connection", "").lower() != "close"
+            self._release(reusable)
+
+    def close(self):
+        """內容未讀完就放棄：關閉連線"""
+        if not self._done:
+            self._done = True
+            self._release(False)
+
+
+class ConnectionPool:
+    """
+    以 asyncio streams 實作的 HTTP/1.1 連線池
+
+    limit  : 同時進行中的請求（連線）數上限
+    timeout: 連線與每次讀取的逾時秒數
+    """
+
+    def __init__(self, limit=8, timeout=30):
+        self.timeout = timeout
+        self._slots = asyncio.Semaphore(limit)
+        self._idle = {}          # (scheme, host, port) → [(reader, writer)]
+        self._ssl = None
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        await self.close()
+
+    async def close(self):
+        for conns in self._idle.values():
+            for _, writer in conns:
+                writer.close()
+        self._idle.clear()
+
+    async def _open(self, key):
+        scheme, host, port = key
+        context = None
+        if scheme == "https":
+            self._ssl = self._ssl or ssl.create_default_context()
+            context = self._ssl
+        return await asyncio.wait_for(
+            asyncio.open_connection(host, port, ssl=context), self.timeout
+        )
+
+    def _checkout(self, key):
+        """取出一條閒置連線（已被伺服器關閉的直接丟棄）"""
+        conns = self._idle.get(key, [])
+        while conns:
+            reader, writer = conns.pop()
+            if not reader.at_eof() and not writer.is_closing():
+                return reader, writer
+            writer.close()
+        return None
+
+    async def request(self, method, url, headers=None):
+        """送出請求並讀取回應標頭；呼叫端需讀完內容或呼叫 close()"""
+
+        parts = urlsplit(url)
+        scheme = parts.scheme or "http"
+        port = parts.port or (443 if scheme == "https" else 80)
+        key = (scheme, parts.hostname, port)
+        target = urlunsplit(("", "", parts.path or "/", parts.query, ""))
+
+        lines = [f"{method} {target} HTTP/1.1", f"Host: {parts.netloc}"]
+        default = {"Accept-Encoding": "gzip", "Connection": "keep-alive"}
+        for name, value in {**default, **(headers or {})}.items():
+            lines.append(f"{name}: {value}")
+        payload = ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+        await self._slots.acquire()
+        try:
+            conn = self._checkout(key)
+            try:
+                return await self._send(conn or await self._open(key), payload, method, key)
+            except (ConnectionError, asyncio.IncompleteReadError):
+                # 重用的 keep-alive 連線可能已被伺服器關閉：換一條新連線再送一次
+                if conn is None:
+                    raise
+                return await self._send(await self._open(key), payload, method, key)
+        except BaseException:
+            self._slots.release()
+            raise
+
+    async def _send(self, conn, payload, method, key):
+        reader, writer = conn
+        try:
+            writer.write(payload)
+            await writer.drain()
+            head = await asyncio.wait_for(reader.readuntil(b"\r\n\r\n"), self.timeout)
+        except BaseException:
+            writer.close()
+            raise
+
+        status_line, *header_lines = head.decode("latin-1").split("\r\n")
+        status = int(status_line.split()[1])
+        headers = {}
+        for line in header_lines:
+            if ":" in line:
+                name, value = line.split(":", 1)
+                headers[name.strip().lower()] = value.strip()
+
+        def release(reusable):
+            if reusable:
+                self._idle.setdefault(key, []).append((reader, writer))
+            else:
+                writer.close()
+            self._slots.release()
+
+        return Response(status, headers, _TimeoutReader(reader, self.timeout), release, method)
+
+
+class _TimeoutReader:
+    """為每次讀取加上逾時（伺服器停住不回應時不會卡住）"""
+
+    def __init__(self, reader, timeout):
+        self._reader = reader
+        self._timeout = timeout
+
+    async def read(self, n):
+        return await asyncio.wait_for(self._reader.read(n), self._timeout)
+
+    async def readline(self):
+        return await asyncio.wait_for(self._reader.readline(), self._timeout)
+
+    async def readexactly(self, n):
+        return await asyncio.wait_for(self._reader.readexactly(n), self._timeout)
+
+
+# ==================================================
+# 條件式請求的快取（ETag / Last-Modified + 上次的內容）
+# ==================================================
+def redact(url):
+    """移除網址中的憑證參數（SECRET_PARAMS），用於訊息、例外與快取的鍵"""
+    parts = urlsplit(url)
+    query = [(k, v) for k, v in parse_qsl(parts.query, keep_blank_values=True) if k not in SECRET_PARAMS]
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+class HttpCache:
+    """
+    cache_dir/index.json 記錄每個網址的 {etag, last_modified, file, records}，
+    內容存在 cache_dir/<網址雜湊>.xml；伺服器回 304 時直接使用快取的內容
+
+    網址一律以 redact 後的形式為鍵（索引檔不會存下 API key）
+    """
+
+    def __init__(self, cache_dir=CACHE_DIR):
+        self.cache_dir = cache_dir
+        self.index_path = os.path.join(cache_dir, "index.json")
+        os.makedirs(cache_dir, exist_ok=True)
+        try:
+            with open(self.index_path, encoding="utf-8") as f:
+                self.index = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.index = {}
+
+        # 舊版索引以含 API key 的完整網址為鍵：改成 redact 後的網址（下次 save 時覆寫）
+        pages = self.index.pop("pages", {})
+        self.index = {redact(url): entry for url, entry in self.index.items()}
+        if pages:
+            self.index["pages"] = {redact(url): files for url, files in pages.items()}
+
+    def body_path(self, url):
+        name = hashlib.sha256(url.encode()).hexdigest()[:24]
+        return os.path.join(self.cache_dir, f"{name}.xml")
+
+    def get(self, url):
+        """有快取且內容檔還在時回傳紀錄"""
+        entry = self.index.get(url)
+        if entry and os.path.exists(entry["file"]):
+            return entry
+        return None
+
+    def conditional_headers(self, url):
+        entry = self.get(url)
+        headers = {}
+        if entry and entry.get("etag"):
+            headers["If-None-Match"] = entry["etag"]
+        if entry and entry.get("last_modified"):
+            headers["If-Modified-Since"] = entry["last_modified"]
+        return headers
+
+    def store(self, url, response, tmp_path, records):
+        path = self.body_path(url)
+        os.replace(tmp_path, path)
+        self.index[url] = {
+            "etag": response.header("etag"),
+            "last_modified": response.header("last-modified"),
+            "file": path,
+            "records": records,
+        }
+
+    def save(self):
+        tmp = f"{self.index_path}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.index, f, ensure_ascii=False, indent=1)
+        os.replace(tmp, self.index_path)
+
+
+# ==================================================
+# 邊下載邊解析
+# ==================================================
+_ABORT = object()
+
+
+class ChunkReader(io.RawIOBase):
+    """
+    把下載中的內容包成檔案物件，交給 ET.iterparse 在背景執行緒讀取
+
+    事件迴圈把每塊內容放進 queue；None 表示結束，_ABORT 表示下載中斷
+    """
+
+    def __init__(self, chunks):
+        self._chunks = chunks
+        self._pending = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        if not self._pending:
+            chunk = self._chunks.get()
+            if chunk is None:
+                return 0
+            if chunk is _ABORT:
+                raise OSError("下載中斷")
+            self._pending = chunk
+
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+
+async def _feed(chunks, item, parsing):
+    """放入一塊內容；queue 已滿時讓出事件迴圈等解析跟上（背壓）"""
+    while True:
+        try:
+            chunks.put_nowait(item)
+            return
+        except queue.Full:
+            if parsing.done():
+                # 解析已結束（通常是解析錯誤）：由呼叫端取得結果 / 例外
+                return
+            await asyncio.sleep(0.005)
+
+
+async def stream_body(response, path, parse=None):
+    """
+    將回應內容寫入 path，同時交給 parse(檔案物件) 在背景執行緒解析
+
+    回傳 parse 的結果（沒有 parse 時為 None）
+    """
+
+    if parse is None:
+        with open(path, "wb") as f:
+            async for chunk in response.iter_chunks():
+                f.write(chunk)
+        return None
+
+    chunks = queue.Queue(maxsize=64)
+    parsing = asyncio.get_running_loop().run_in_executor(None, parse, ChunkReader(chunks))
+    try:
+        with open(path, "wb") as f:
+            async for chunk in response.iter_chunks():
+                f.write(chunk)
+                await _feed(chunks, chunk, parsing)
+        await _feed(chunks, None, parsing)
+    except BaseException:
+        # 下載失敗：通知解析執行緒結束，等它收尾後再往外拋出
+        await _feed(chunks, _ABORT, parsing)
+        await asyncio.gather(parsing, return_exceptions=True)
+        raise
+
+    return await parsing
+
+
+def batch_rows(batches):
+    return sum(len(batch) for batch in batches)
+
+
+async def fetch_url(pool, cache, url, parse=None, retries=3, backoff=0.5):
+    """
+    下載單一網址（條件式請求 + 重試）
+
+    parse: 解析函式，接收檔案物件，回傳 DataFrame 批次的 list
+
+    回傳 dict：
+      changed: 內容是否有變更（False 表示伺服器回 304）
+      file   : 快取中的內容檔
+      records: 解析出的筆數
+      batches: 內容有變更時為解析結果（304 時為 None）
+
+    只有完整讀到內容結尾（chunked 的 0 區塊、Content-Length、gzip 結尾）才寫入快取；
+    不完整的內容視為下載失敗重試，不會以 ETag 記下而在之後的 304 一直沿用
+    """
+
+    # 訊息、例外與快取只使用不含 API key 的網址
+    name = redact(url)
+    for attempt in range(retries + 1):
+        delay = backoff * 2 ** attempt
+        try:
+            response = await pool.request("GET", url, cache.conditional_headers(name))
+
+            if response.status == 304:
+                response.release()
+                entry = cache.get(name)
+                return {"changed": False, "file": entry["file"], "records": entry["records"], "batches": None}
+
+            if response.status in RETRY_STATUS:
+                response.close()
+                retry_after = response.header("retry-after", "")
+                raise RetryableStatus(
+                    response.status, float(retry_after) if retry_after.isdigit() else None
+                )
+
+            if response.status != 200:
+                response.close()
+                raise FetchError(f"{name} 回應 HTTP {response.status}")
+
+            tmp = f"{cache.body_path(name)}.part"
+            batches = await stream_body(response, tmp, parse)
+            records = batch_rows(batches) if batches is not None else None
+            cache.store(name, response, tmp, records)
+            return {"changed": True, "file": cache.body_path(name), "records": records, "batches": batches}
+
+        except RetryableStatus as e:
+            error = e
+            delay = max(delay, e.retry_after or 0)
+        except (OSError, asyncio.TimeoutError, asyncio.IncompleteReadError, ET.ParseError) as e:
+            error = e
+
+        if attempt < retries:
+            # 指數退避 + 隨機抖動，避免多個請求同時重試
+            wait = delay * (0.5 + random.random())
+            print(f"⚠️ {name} 第 {attempt + 1} 次失敗（{error}），{wait:.1f} 秒後重試")
+            await asyncio.sleep(wait)
+
+    raise FetchError(f"{name} 重試 {retries} 次後仍失敗：{error}") from error
+
+
+# ==================================================
+# 兩個資料集
+# ==================================================
+def with_query(url, **params):
+    """在網址加上（或覆寫）查詢參數"""
+    parts = urlsplit(url)
+    query = dict(parse_qsl(parts.query))
+    query.update({k: str(v) for k, v in params.items() if v is not None})
+    return urlunsplit(parts._replace(query=urlencode(query)))
+
+
+def replace_file(src, dest):
+    """複製後改名，中斷時不會留下寫一半的檔案"""
+    tmp = f"{dest}.tmp"
+    with open(src, "rb") as fin, open(tmp, "wb") as fout:
+        while block := fin.read(1 << 20):
+            fout.write(block)
+    os.replace(tmp, dest)
+
+
+def parse_stations(fileobj):
+    from moenv_crawler import iter_station_batches
+
+    return list(iter_station_batches(fileobj))
+
+
+def parse_air(fileobj):
+    from air_quality_xml_to_csv import iter_air_quality_batches
+
+    return list(iter_air_quality_batches(fileobj))
+
+
+async def fetch_stations(pool, cache, url, dest, retries=3, backoff=0.5):
+    """下載檢測站 XML；內容有變更時寫到 dest，回傳 DataFrame 批次（沒變更時為 None）"""
+
+    result = await fetch_url(pool, cache, url, parse_stations, retries, backoff)
+    if not result["changed"]:
+        print(f"⏭️ 檢測站資料未變更（{result['records']} 筆），沿用 {dest}")
+        return None
+
+    replace_file(result["file"], dest)
+    print(f"✅ 檢測站資料已更新：{dest}，共 {result['records']} 筆")
+    return result["batches"]
+
+
+def merge_pages(paths, dest):
+    """
+    將分頁下載的空汙 XML 合併成單一 XML（根節點沿用第一頁）
+
+    只複製 <data> 紀錄，逐筆寫出，記憶體用量與資料量無關
+    """
+    root_tag = "aqx_p_488"
+    for _, elem in ET.iterparse(paths[0], events=("start",)):
+        root_tag = elem.tag
+        break
+
+    tmp = f"{dest}.tmp"
+    with open(tmp, "wb") as f:
+        f.write(f'<?xml version="1.0" encoding="UTF-8"?>\n<{root_tag}>'.encode())
+        for path in paths:
+            for _, elem in ET.iterparse(path):
+                if elem.tag == "data":
+                    elem.tail = None
+                    f.write(ET.tostring(elem, encoding="utf-8", xml_declaration=False))
+                    elem.clear()
+        f.write(f"</{root_tag}>\n".encode())
+    os.replace(tmp, dest)
+
+
+async def fetch_air(pool, cache, url, dest, api_key=None, limit=1000,
+                    concurrency=4, retries=3, backoff=0.5):
+    """
+    以 offset / limit 分頁下載空汙資料，每次同時下載 concurrency 頁，
+    某一頁不足 limit 筆即為最後一頁
+
+    有任何一頁變更時合併寫到 dest，回傳各頁的 DataFrame 批次（沒變更時為 None）
+    """
+
+    pages = []
+    offset = 0
+    last = False
+    while not last:
+        offsets = [offset + i * limit for i in range(concurrency)]
+        results = await asyncio.gather(*[
+            fetch_url(
+                pool, cache,
+                with_query(url, format="xml", offset=o, limit=limit, api_key=api_key),
+                parse_air, retries, backoff,
+            )
+            for o in offsets
+        ])
+        for result in results:
+            pages.append(result)
+            if result["records"] < limit:
+                last = True
+                break
+        offset += concurrency * limit
+
+    # 移除最後的空白頁（筆數剛好是 limit 的倍數時會多下載一頁）
+    while len(pages) > 1 and pages[-1]["records"] == 0:
+        pages.pop()
+
+    total = sum(page["records"] for page in pages)
+    previous = cache.index.get("pages", {}).get(redact(url))
+    files = [page["file"] for page in pages]
+    if not any(page["changed"] for page in pages) and previous == files and os.path.exists(dest):
+        print(f"⏭️ 空汙資料未變更（{len(pages)} 頁，{total} 筆），沿用 {dest}")
+        return None
+
+    loop = asyncio.get_running_loop()
+    if len(pages) == 1:
+        await loop.run_in_executor(None, replace_file, files[0], dest)
+    else:
+        await loop.run_in_executor(None, merge_pages, files, dest)
+    cache.index.setdefault("pages", {})[redact(url)] = files
+
+    # 未變更的頁面從快取的內容檔解析
+    batches = []
+    for page in pages:
+        if page["batches"] is None:
+            with open(page["file"], "rb") as f:
+                page["batches"] = await loop.run_in_executor(None, parse_air, f)
+        batches.extend(page["batches"])
+
+    print(f"✅ 空汙資料已更新：{dest}，{len(pages)} 頁，共 {total} 筆")
+    return batches
+
+
+async def fetch_feeds(
+    station_url=None,
+    air_url=AIR_URL,
+    api_key=None,
+    station_xml="機車排氣定檢站資料.xml",
+    air_xml="空汙.xml",
+    limit=1000,
+    concurrency=4,
+    cache_dir=CACHE_DIR,
+    retries=3,
+    backoff=0.5,
+    timeout=30,
+):
+    """
+    同時下載檢測站與空汙資料
+
+    未指定的網址不下載；回傳 {"stations": 批次或 None, "air": 批次或 None}，
+    None 表示沒有下載或內容未變更
+    """
+
+    cache = HttpCache(cache_dir)
+    tasks = {}
+    async with ConnectionPool(limit=concurrency + 1, timeout=timeout) as pool:
+        if station_url:
+            tasks["stations"] = fetch_stations(pool, cache, station_url, station_xml, retries, backoff)
+        if air_url:
+            tasks["air"] = fetch_air(
+                pool, cache, air_url, air_xml, api_key, limit, concurrency, retries, backoff
+            )
+        try:
+            results = await asyncio.gather(*tasks.values())
+        finally:
+            # 已下載成功的內容即使另一個資料集失敗也保留在快取
+            cache.save()
+
+    fetched = dict.fromkeys(["stations", "air"])
+    fetched.update(zip(tasks, results))
+    return fetched
+
+
+def fetch(**kwargs):
+    """fetch_feeds 的同步版本（參數相同）"""
+    return asyncio.run(fetch_feeds(**kwargs))
+
+
+# ---------- 主程式進入點 ----------
+if __name__ == "__main__":
+    fetch(
+        station_url=os.environ.get("MOENV_STATION_URL"),
+        api_key=os.environ.get("MOENV_API_KEY"),
+    )
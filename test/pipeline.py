@@ -0,0 +1,351 @@
+import hashlib
+import json
+import os
+
+from instrumentation import StageRecorder
+
+
+# ==================================================
+# 依相依關係執行的流程：輸入沒變的階段直接略過
+# ==================================================
+# 每個階段宣告自己的輸入檔與輸出檔，執行順序由「誰產生誰的輸入」決定。
+# 執行後記錄輸入的內容雜湊（SHA-256）與輸出檔的雜湊，下次執行時：
+#   - 輸入內容與參數都沒變、輸出檔也沒被改動或刪除 → 略過
+#   - 上游重跑但產生的輸出內容相同 → 下游仍然略過
+# 檔案大小與修改時間沒變時沿用上次的雜湊，不重新讀檔，
+# 因此什麼都沒變的執行只需要幾毫秒（不會載入 pandas / matplotlib）
+#
+# 程式碼本身也列為輸入：修改分析程式後，相關階段會自動重跑
+STATE_FILE = "pipeline_state.json"
+
+# 同 intermediates.INTERMEDIATE_DIR（這裡不匯入 intermediates，以免載入 pandas）
+INTERMEDIATE_DIR = "intermediate"
+
+# 檢測站 SQLite（含各縣市 / 行政區彙總表，見 station_summary.py）
+STATIONS_DB = "inspection_stations.db"
+
+# 同 air_rolling.STATE_DB（空汙累計統計）
+AIR_ROLLING_DB = "air_rolling.db"
+
+# 同 air_cube 的兩個陣列檔（空汙部分由 load_air、檢驗站部分由 ingest_stations 寫入）
+AIR_CUBE = os.path.join("air_cube", "air.npz")
+STATION_CUBE = os.path.join("air_cube", "stations.npz")
+
+# 檢驗站密度 / PM2.5 網格與熱度圖（raster.py）
+RASTER_DIR = "raster"
+
+# 程式碼檔案相對於本檔所在目錄，資料檔相對於目前目錄
+CODE_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def parquet(name):
+    return os.path.join(INTERMEDIATE_DIR, f"{name}.parquet")
+
+
+def code(*modules):
+    return [os.path.join(CODE_DIR, m) for m in modules]
+
+
+class Stage:
+    """
+    流程中的一個階段
+
+    func    : 執行函式，回傳 False 表示失敗（後續階段不執行）
+    inputs  : 輸入檔（資料檔與程式碼）
+    outputs : 輸出檔
+    params  : 傳給 func 的參數（關鍵字引數），變更時也會重跑
+    optional: 資料輸入檔不存在但輸出檔已存在時略過（沿用現有輸出）
+    """
+
+    def __init__(self, name, func, inputs, outputs, params=None, optional=False):
+        self.name = name
+        self.func = func
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.params = params or {}
+        self.optional = optional
+
+
+# ==================================================
+# 各階段的執行函式（只在需要執行時才匯入對應模組）
+# ==================================================
+def run_xml_to_csv(recorder, xml_path, csv_path):
+    from air_quality_xml_to_csv import xml_to_csv
+
+    recorder.run("xml_to_csv", xml_to_csv, xml_path, csv_path)
+    return True
+
+
+def run_ingest_stations(recorder, xml_path, export_csv):
+    import main
+
+    return main.ingest_stations(xml_path, export_csv=export_csv, recorder=recorder) is not None
+
+
+def run_load_air(recorder, csv_path):
+    import main
+
+    return main.load_air(csv_path, recorder=recorder) is not None
+
+
+def run_analyze(recorder, export_csv):
+    import main
+    from intermediates import read_table
+
+    with recorder.stage("read_intermediates"):
+        station_df = read_table("inspection_stations_clean")
+        air_df = read_table("air_quality")
+
+    # ingest_stations 以同一份資料寫入中介檔與資料庫，檢測站數量可直接讀彙總表
+    main.analyze(
+        station_df, air_df, export_csv=export_csv, recorder=recorder,
+        db_path=STATIONS_DB, air_state=AIR_ROLLING_DB,
+    )
+    return True
+
+
+def run_plot(recorder, chart_dir, fmt):
+    if chart_dir:
+        # 輸出成圖檔時使用非互動式後端
+        import matplotlib
+        matplotlib.use("Agg")
+
+    import main
+
+    main.plot(chart_dir, fmt, recorder=recorder)
+    return True
+
+
+def run_raster(recorder, output_dir, fmt):
+    import raster
+
+    with recorder.stage("raster") as record:
+        record["rows"] = raster.run_raster(output_dir, fmt=fmt)["points_inside"]
+    return True
+
+
+def build_stages(
+    station_xml="機車排氣定檢站資料.xml",
+    air_xml="空汙.xml",
+    air_csv="air_quality.csv",
+    export_csv=True,
+    chart_dir=None,
+    fmt="png",
+):
+    """建立 main.main 的各個階段（含空汙 XML → CSV）"""
+
+    def csv(*names):
+        return [f"{name}.csv" for name in names] if export_csv else []
+
+    analyze_tables = [
+        "city_air_vs_station",
+        "county_air_rolling",
+        "site_air_rolling",
+        "high_pm25_city_district_station",
+        "high_pm25_district_week",
+        "district_air_vs_station",
+        "station_nearest_site",
+        "station_exposure",
+        "district_exposure",
+    ]
+    charts = []
+    if chart_dir:
+        charts = [
+            os.path.join(chart_dir, f"{name}.{fmt}")
+            for name in ["final_top_district_by_city", "final_air_vs_station"]
+        ]
+
+    return [
+        Stage(
+            "xml_to_csv", run_xml_to_csv,
+            inputs=[air_xml] + code("air_quality_xml_to_csv.py", "intermediates.py"),
+            outputs=[air_csv],
+            params={"xml_path": air_xml, "csv_path": air_csv},
+            optional=True,
+        ),
+        Stage(
+            "ingest_stations", run_ingest_stations,
+            inputs=[station_xml] + code(
+                "moenv_crawler.py", "gazetteer.py", "analysis.py", "station_summary.py",
+                "intermediates.py", "snapshot_diff.py", "air_cube.py",
+            ),
+            outputs=[parquet("inspection_stations_clean"), STATIONS_DB, STATION_CUBE]
+            + csv("inspection_stations_clean"),
+            params={"xml_path": station_xml, "export_csv": export_csv},
+        ),
+        Stage(
+            "load_air", run_load_air,
+            # 名稱比對不到的空品測站以最近的檢驗站對應行政區（air_cube），因此也依賴檢驗站資料庫
+            inputs=[air_csv, STATIONS_DB] + code("main.py", "air_rolling.py", "air_cube.py", "intermediates.py"),
+            outputs=[parquet("air_quality"), AIR_ROLLING_DB, AIR_CUBE],
+            params={"csv_path": air_csv},
+        ),
+        Stage(
+            "analyze", run_analyze,
+            inputs=[
+                parquet("inspection_stations_clean"), parquet("air_quality"),
+                STATIONS_DB, AIR_ROLLING_DB, AIR_CUBE, STATION_CUBE,
+            ]
+            + code(
+                "main.py", "station_summary.py", "air_rolling.py", "air_cube.py", "gazetteer.py", "spatial.py",
+                "intermediates.py",
+            ),
+            outputs=[parquet(name) for name in analyze_tables] + csv(*analyze_tables),
+            params={"export_csv": export_csv},
+        ),
+        Stage(
+            "raster", run_raster,
+            inputs=[parquet("inspection_stations_clean"), parquet("air_quality")]
+            + code("raster.py", "chart_utils.py", "intermediates.py"),
+            outputs=[
+                os.path.join(RASTER_DIR, name)
+                for name in ["station_density.npz", f"station_density.{fmt}", f"pm25_surface.{fmt}"]
+            ],
+            params={"output_dir": RASTER_DIR, "fmt": fmt},
+        ),
+        Stage(
+            "plot", run_plot,
+            inputs=[STATIONS_DB, parquet("air_quality")]
+            + code("final_plots.py", "station_summary.py", "chart_utils.py"),
+            outputs=charts,
+            params={"chart_dir": chart_dir, "fmt": fmt},
+        ),
+    ]
+
+
+# ==================================================
+# 內容雜湊（以檔案大小 + 修改時間快取）
+# ==================================================
+def file_hash(path, cache):
+    """
+    檔案內容的 SHA-256
+
+    cache 以路徑記錄 {size, mtime_ns, hash}：大小與修改時間都沒變時直接沿用
+    """
+    st = os.stat(path)
+    entry = cache.get(path)
+    if entry and entry["size"] == st.st_size and entry["mtime_ns"] == st.st_mtime_ns:
+        return entry["hash"]
+
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for block in iter(lambda: f.read(1 << 20), b""):
+            digest.update(block)
+
+    cache[path] = {"size": st.st_size, "mtime_ns": st.st_mtime_ns, "hash": digest.hexdigest()}
+    return cache[path]["hash"]
+
+
+def stage_signature(stage, cache):
+    """階段的輸入指紋：所有輸入檔的雜湊 + 參數（路徑以相對路徑記錄，搬移目錄後仍可沿用）"""
+    payload = {
+        "inputs": {os.path.relpath(path): file_hash(path, cache) for path in stage.inputs},
+        "params": stage.params,
+    }
+    return hashlib.sha256(json.dumps(payload, sort_keys=True).encode()).hexdigest()
+
+
+def outputs_intact(stage, recorded, cache):
+    """輸出檔都還在，且內容與上次執行後相同"""
+    if sorted(recorded) != sorted(stage.outputs):
+        return False
+    return all(
+        os.path.exists(path) and file_hash(path, cache) == digest
+        for path, digest in recorded.items()
+    )
+
+
+def load_state(path):
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (FileNotFoundError, json.JSONDecodeError):
+        return {"files": {}, "stages": {}}
+
+
+def save_state(state, path):
+    # 先寫暫存檔再改名，中斷時不會留下寫一半的狀態檔
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(state, f, ensure_ascii=False, indent=1)
+    os.replace(tmp, path)
+
+
+# ==================================================
+# 執行順序與執行
+# ==================================================
+def execution_order(stages):
+    """
+    依宣告的輸入 / 輸出排序（拓撲排序）
+
+    產生某個輸入檔的階段一定排在使用它的階段之前；
+    沒有相依關係的階段維持原本的宣告順序
+    """
+
+    producer = {}
+    for stage in stages:
+        for path in stage.outputs:
+            producer[path] = stage.name
+
+    deps = {
+        stage.name: {producer[p] for p in stage.inputs if p in producer} - {stage.name}
+        for stage in stages
+    }
+
+    ordered, done = [], set()
+    while len(ordered) < len(stages):
+        ready = [s for s in stages if s.name not in done and deps[s.name] <= done]
+        if not ready:
+            raise ValueError("階段之間有循環相依")
+        ordered.append(ready[0])
+        done.add(ready[0].name)
+
+    return ordered
+
+
+def run_pipeline(stages, state_path=STATE_FILE, force=False, recorder=None):
+    """
+    依相依順序執行各階段，跳過輸入沒變的階段
+
+    force   : 不論輸入是否變更，全部重新執行
+    recorder: instrumentation.StageRecorder，記錄實際執行的各階段數據
+
+    回傳是否全部成功
+    """
+
+    recorder = recorder or StageRecorder()
+    state = load_state(state_path)
+    cache = state["files"]
+
+    for stage in execution_order(stages):
+        missing = [path for path in stage.inputs if not os.path.exists(path)]
+        if missing:
+            if stage.optional and all(os.path.exists(p) for p in stage.outputs):
+                print(f"⏭️ {stage.name}：找不到 {', '.join(missing)}，沿用現有輸出")
+                continue
+            print(f"❌ {stage.name}：找不到輸入檔 {', '.join(missing)}")
+            return False
+
+        signature = stage_signature(stage, cache)
+        previous = state["stages"].get(stage.name)
+        if (
+            not force
+            and previous
+            and previous["signature"] == signature
+            and outputs_intact(stage, previous["outputs"], cache)
+        ):
+            print(f"⏭️ {stage.name}：輸入未變更，略過")
+            continue
+
+        if stage.func(recorder, **stage.params) is False:
+            print(f"❌ {stage.name} 執行失敗，停止後續階段")
+            return False
+
+        # 每個階段完成就寫入狀態，中途失敗時已完成的階段下次不必重跑
+        state["stages"][stage.name] = {
+            "signature": signature,
+            "outputs": {path: file_hash(path, cache) for path in stage.outputs if os.path.exists(path)},
+        }
+        save_state(state, state_path)
+
+    return True
@@ -1,12 +1,12 @@
-import pandas as pd
 import matplotlib.pyplot as plt
-from matplotlib import font_manager
+
+from chart_utils import cjk_font, save_or_show
+from intermediates import read_table
 
 # ==================================================
 # 中文字型設定（避免中文亂碼）
 # ==================================================
-font_path = "C:/Windows/Fonts/msjh.ttc"
-font_prop = font_manager.FontProperties(fname=font_path)
+font_prop = cjk_font()
 
 # 避免負號顯示成亂碼
 plt.rcParams["axes.unicode_minus"] = False
@@ -15,17 +15,18 @@ plt.rcParams["axes.unicode_minus"] = False
 # ==================================================
 # 圖一：空汙程度 × 機車檢測站數量（散佈圖）
 # ==================================================
-def plot_air_vs_station():
+def plot_air_vs_station(output_dir=None, fmt="png"):
     """
-    讀取 city_air_vs_station.csv
+    讀取 city_air_vs_station 中介檔
     繪製「各縣市平均 PM2.5 與機車檢測站數量」的散佈圖
+    output_dir 有指定時輸出成圖檔（png / svg），否則以視窗顯示
     """
 
     # 讀取合併後的縣市資料（空汙 + 檢測站）
-    df = pd.read_csv("city_air_vs_station.csv")
+    df = read_table("city_air_vs_station", columns=["city", "station_count", "pm2.5"])
 
     # 建立圖表
-    plt.figure(figsize=(10, 7))
+    fig = plt.figure(figsize=(10, 7))
 
     # 繪製散佈圖
     plt.scatter(
@@ -60,62 +61,66 @@ def plot_air_vs_station():
 
     # 自動調整版面
     plt.tight_layout()
-    plt.show()
+    return save_or_show(fig, output_dir, "air_vs_station", fmt)
 
 
 # ==================================================
 # 圖二：高 PM2.5 縣市 → 行政區檢測站分布（長條圖）
 # ==================================================
-def plot_high_pm25_district():
+def plot_high_pm25_district(output_dir=None, fmt="png"):
     """
     針對 PM2.5 較高的縣市，
     繪製其各行政區機車檢測站數量分布圖
     """
 
     # 讀取高 PM2.5 縣市行政區統計資料
-    df = pd.read_csv("high_pm25_city_district_station.csv")
-
-    # 取得所有縣市清單
-    cities = df["city"].unique()
+    df = read_table(
+        "high_pm25_city_district_station",
+        columns=["city", "district", "station_count"]
+    )
 
     # 逐一為每個縣市畫一張圖
-    for city in cities:
-        city_df = df[df["city"] == city]
+    for city, city_df in df.groupby("city", observed=True, sort=False):
+        plot_high_pm25_city(city_df, city, output_dir, fmt)
 
-        plt.figure(figsize=(10, 6))
 
-        # 繪製長條圖
-        bars = plt.bar(
-            city_df["district"],       # X 軸：行政區
-            city_df["station_count"]   # Y 軸：檢測站數量
-        )
+def plot_high_pm25_city(city_df, city, output_dir=None, fmt="png"):
+    """繪製單一高 PM2.5 縣市的行政區檢測站分布圖"""
 
-        # 在每個長條上顯示數量（整數）
-        for bar in bars:
-            height = int(bar.get_height())
-            plt.text(
-                bar.get_x() + bar.get_width() / 2,
-                height,
-                f"{height}",
-                ha="center",
-                va="bottom",
-                fontsize=10
-            )
-
-        # 圖表標題與座標軸設定
-        plt.title(
-            f"{city}｜行政區機車檢測站分布（高 PM2.5 縣市）",
-            fontproperties=font_prop,
-            fontsize=14,
-            pad=15
+    fig = plt.figure(figsize=(10, 6))
+
+    # 繪製長條圖
+    bars = plt.bar(
+        city_df["district"].astype(str),   # X 軸：行政區
+        city_df["station_count"]           # Y 軸：檢測站數量
+    )
+
+    # 在每個長條上顯示數量（整數）
+    for bar in bars:
+        height = int(bar.get_height())
+        plt.text(
+            bar.get_x() + bar.get_width() / 2,
+            height,
+            f"{height}",
+            ha="center",
+            va="bottom",
+            fontsize=10
         )
-        plt.xlabel("行政區", fontproperties=font_prop)
-        plt.ylabel("檢測站數量", fontproperties=font_prop)
-        plt.xticks(rotation=45, ha="right", fontproperties=font_prop)
 
-        # 自動調整版面
-        plt.tight_layout()
-        plt.show()
+    # 圖表標題與座標軸設定
+    plt.title(
+        f"{city}｜行政區機車檢測站分布（高 PM2.5 縣市）",
+        fontproperties=font_prop,
+        fontsize=14,
+        pad=15
+    )
+    plt.xlabel("行政區", fontproperties=font_prop)
+    plt.ylabel("檢測站數量", fontproperties=font_prop)
+    plt.xticks(rotation=45, ha="right", fontproperties=font_prop)
+
+    # 自動調整版面
+    plt.tight_layout()
+    return save_or_show(fig, output_dir, f"high_pm25_{city}", fmt)
 
 
 # ==================================================
@@ -0,0 +1,551 @@
+import argparse
+import json
+import math
+import os
+import pathlib
+import queue
+import sqlite3
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlsplit
+
+
+# ==================================================
+# 唯讀查詢服務（HTTP / JSON）
+# ==================================================
+# 其他團隊不必再開啟 main.py 輸出的 CSV，直接查詢：
+#   GET /stations?city=&district=&limit=&offset=   營運中的檢驗站（依縣市 / 行政區）
+#   GET /stations/nearest?lat=&lon=&k=             離某個座標最近的 k 個檢驗站
+#   GET /districts/top?k=&ties=&city=              各縣市檢驗站最多的行政區（station_summary）
+#   GET /counties/air?county=&window=&metric=      各縣市空汙統計（air_rolling：all / 24h / 7d）
+#   GET /counties/air-vs-station                   縣市空汙 × 檢驗站數量（analyze 的 city_air_vs_station）
+#   GET /health                                    資料版本與快取命中率（不快取）
+#
+# - SQLite 以唯讀連線池存取（每個資料庫最多 pool_size 條連線，借出 / 歸還，不必每個請求重新開檔）
+# - 回應（編碼好的 JSON）存在 LRU 快取；資料版本（資料庫、WAL、分析輸出與 pipeline_state.json 的
+#   大小與修改時間）改變時整個快取清空，流程寫入新資料後不會讀到舊結果
+# - 可在同一個行程內啟動（start_server，測試用），也可以獨立執行（python cli.py serve）
+#
+# 負載測試見 bench_service.py
+DEFAULT_PORT = 8765
+
+# 同 air_rolling.STATE_DB / pipeline.STATE_FILE（這裡不匯入，以免啟動時載入 pandas）
+AIR_ROLLING_DB = "air_rolling.db"
+PIPELINE_STATE = "pipeline_state.json"
+
+STATION_FIELDS = ["station_no", "station_name", "tel", "address", "latitude", "longitude", "city", "district"]
+
+MAX_LIMIT = 1000
+MAX_NEAREST = 50
+
+# SQLite 的 OFFSET 是 64 位元整數，更大的值會在查詢時溢位
+MAX_OFFSET = 2**63 - 1
+
+# 最近檢驗站查詢接受的座標範圍（台灣本島與金門、馬祖、澎湖等離島），
+# 遠在範圍外的點網格索引要逐圈擴大很久才找得到
+LAT_RANGE = (20.0, 27.0)
+LON_RANGE = (117.0, 123.0)
+
+
+class ServiceError(Exception):
+    """回應錯誤（status 為 HTTP 狀態碼）"""
+
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+# ==================================================
+# SQLite 唯讀連線池
+# ==================================================
+class ConnectionPool:
+    """
+    SQLite 唯讀連線池
+
+    db_path: 資料庫路徑（以 mode=ro 開啟，服務不會寫入資料庫）
+    size   : 同時借出的連線數上限
+    """
+
+    def __init__(self, db_path, size=4):
+        self.db_path = db_path
+        self._uri = pathlib.Path(db_path).resolve().as_uri() + "?mode=ro"
+        self._slots = threading.BoundedSemaphore(size)
+        self._idle = queue.LifoQueue()
+
+    def _open(self):
+        if not os.path.exists(self.db_path):
+            raise ServiceError(503, f"找不到資料庫：{self.db_path}")
+        return sqlite3.connect(self._uri, uri=True, check_same_thread=False)
+
+    @contextmanager
+    def connection(self):
+        self._slots.acquire()
+        conn = None
+        try:
+            try:
+                conn = self._idle.get_nowait()
+            except queue.Empty:
+                conn = self._open()
+            yield conn
+        except sqlite3.DatabaseError:
+            # 連線可能已不可用（例如資料庫被替換）：不放回池中
+            if conn is not None:
+                conn.close()
+                conn = None
+            raise
+        finally:
+            if conn is not None:
+                self._idle.put(conn)
+            self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                return
+
+
+# ==================================================
+# LRU 回應快取
+# ==================================================
+class ResponseCache:
+    """
+    以資料版本區分的 LRU 快取
+
+    maxsize: 最多保留的回應數（0 為不快取）
+    """
+
+    def __init__(self, maxsize=1024):
+        self.maxsize = maxsize
+        self.version = None
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _check(self, version):
+        if version != self.version:
+            self._entries.clear()
+            self.version = version
+
+    def get(self, key, version):
+        with self._lock:
+            self._check(version)
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, version, value):
+        if not self.maxsize:
+            return
+        with self._lock:
+            self._check(version)
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            total = self.hits + self.misses
+            return {
+                "size": len(self._entries),
+                "maxsize": self.maxsize,
+                "hits": self.hits,
+                "misses": self.misses,
+                "hit_rate": round(self.hits / total, 4) if total else None,
+            }
+
+
+# ==================================================
+# 查詢參數
+# ==================================================
+def text_param(params, name, default=None):
+    value = params.get(name, default)
+    return value.strip() if isinstance(value, str) and value.strip() else default
+
+
+def number_param(params, name, default, kind=int, minimum=None, maximum=None):
+    value = params.get(name)
+    if value is None or value == "":
+        if default is None:
+            raise ServiceError(400, f"缺少參數 {name}")
+        return default
+    try:
+        number = kind(value)
+    except ValueError:
+        raise ServiceError(400, f"參數 {name} 必須是{'整數' if kind is int else '數字'}：{value}") from None
+    if not math.isfinite(number):
+        raise ServiceError(400, f"參數 {name} 必須是有限的數字：{value}")
+    if (minimum is not None and number < minimum) or (maximum is not None and number > maximum):
+        raise ServiceError(400, f"參數 {name} 必須介於 {minimum} ~ {maximum}：{value}")
+    return number
+
+
+def records(df):
+    """
+    DataFrame → JSON 可序列化的 list[dict]（缺值為 null）
+
+    逐欄 tolist() 轉成 Python 值再組成 dict，回應的表格都很小，
+    比 DataFrame.to_dict 少掉 pandas 逐列處理的固定成本
+    """
+    columns = [str(col) for col in df.columns]
+    rows = zip(*(df[col].tolist() for col in df.columns))
+    return [
+        {col: None if isinstance(value, float) and value != value else value for col, value in zip(columns, row)}
+        for row in rows
+    ]
+
+
+# ==================================================
+# 服務本體（與 HTTP 無關，可直接呼叫 handle 測試）
+# ==================================================
+class QueryService:
+    """
+    參數說明：
+    db_path      : 檢驗站 SQLite（含 station_summary 的彙總表）
+    air_db_path  : 空汙累計統計（air_rolling）
+    intermediate : analyze 輸出的中介檔目錄
+    pool_size    : 每個資料庫的連線池大小
+    cache_size   : LRU 快取的回應數（0 為不快取）
+    """
+
+    def __init__(
+        self,
+        db_path="inspection_stations.db",
+        air_db_path=AIR_ROLLING_DB,
+        intermediate="intermediate",
+        pool_size=4,
+        cache_size=1024,
+    ):
+        self.db_path = db_path
+        self.air_db_path = air_db_path
+        self.intermediate = intermediate
+        self.stations_pool = ConnectionPool(db_path, pool_size)
+        self.air_pool = ConnectionPool(air_db_path, pool_size)
+        self.cache = ResponseCache(cache_size)
+
+        # 由資料衍生的物件（最近鄰索引、分析輸出表格），資料版本改變時重建
+        self._derived = {}
+        self._derived_lock = threading.Lock()
+
+        self.routes = {
+            "/health": self.health,
+            "/stations": self.stations,
+            "/stations/nearest": self.nearest,
+            "/districts/top": self.top_districts,
+            "/counties/air": self.county_air,
+            "/counties/air-vs-station": self.air_vs_station,
+        }
+
+    def close(self):
+        self.stations_pool.close()
+        self.air_pool.close()
+
+    # ---------- 資料版本 ----------
+    def watched_files(self):
+        """流程寫入時會改變的檔案（SQLite 寫入先進 WAL，WAL 也要列入）"""
+        return [
+            self.db_path, f"{self.db_path}-wal",
+            self.air_db_path, f"{self.air_db_path}-wal",
+            os.path.join(self.intermediate, "city_air_vs_station.parquet"),
+            PIPELINE_STATE,
+        ]
+
+    def data_version(self):
+        version = []
+        for path in self.watched_files():
+            try:
+                st = os.stat(path)
+            except FileNotFoundError:
+                continue
+            # 空的 WAL 與不存在相同（連線開啟時會建立空的 WAL），不列入
+            if path.endswith("-wal") and st.st_size == 0:
+                continue
+            version.append((path, st.st_size, st.st_mtime_ns))
+        return tuple(version)
+
+    def derived(self, name, version, build):
+        """依資料版本快取衍生物件（同一版本只建立一次）"""
+        with self._derived_lock:
+            entry = self._derived.get(name)
+            if entry is None or entry[0] != version:
+                entry = (version, build())
+                self._derived[name] = entry
+            return entry[1]
+
+    # ---------- 請求處理 ----------
+    def handle(self, target):
+        """
+        處理一個 GET 請求（路徑含查詢字串）
+
+        回傳 (HTTP 狀態碼, JSON bytes, 是否命中快取)
+        """
+        parts = urlsplit(target)
+        path = parts.path.rstrip("/") or "/health"
+        params = dict(parse_qsl(parts.query))
+
+        route = self.routes.get(path)
+        if route is None:
+            return 404, encode({"error": f"未知的端點：{path}", "endpoints": sorted(self.routes)}), False
+        if route == self.health:
+            return 200, encode(self.health(params, self.data_version())), False
+
+        key = (path, tuple(sorted(params.items())))
+        version = self.data_version()
+        body = self.cache.get(key, version)
+        if body is not None:
+            return 200, body, True
+
+        try:
+            body = encode(route(params, version))
+        except ServiceError as e:
+            return e.status, encode({"error": str(e)}), False
+        except Exception as e:
+            # 資料表 / 中介檔還不存在（尚未執行對應的流程階段）；
+            # pandas 讀 SQL 時會把 sqlite3 的錯誤包成 pandas.errors.DatabaseError
+            cause = e.__cause__ or e
+            if isinstance(cause, (sqlite3.OperationalError, FileNotFoundError)):
+                return 503, encode({"error": f"資料尚未就緒：{cause}"}), False
+            return 500, encode({"error": f"{type(e).__name__}: {e}"}), False
+
+        self.cache.put(key, version, body)
+        return 200, body, False
+
+    # ---------- 各端點 ----------
+    def health(self, params, version):
+        return {
+            "endpoints": sorted(self.routes),
+            "data_version": [{"path": p, "size": size, "mtime_ns": mtime} for p, size, mtime in version],
+            "cache": self.cache.stats(),
+        }
+
+    def stations(self, params, version):
+        import gazetteer
+
+        city = text_param(params, "city")
+        district = text_param(params, "district")
+        limit = number_param(params, "limit", 100, minimum=1, maximum=MAX_LIMIT)
+        offset = number_param(params, "offset", 0, minimum=0, maximum=MAX_OFFSET)
+
+        # 條件為縣市 / 縣市 × 行政區時使用 stations 的索引
+        where, args = [], []
+        if city:
+            where.append("city = ?")
+            args.append(gazetteer.normalize(city))
+        if district:
+            where.append("district = ?")
+            args.append(district)
+        condition = f" WHERE {' AND '.join(where)}" if where else ""
+
+        with self.stations_pool.connection() as conn:
+            total = conn.execute(f"SELECT COUNT(*) FROM active_stations{condition}", args).fetchone()[0]
+            cursor = conn.execute(
+                f"SELECT {', '.join(STATION_FIELDS)} FROM active_stations{condition} "
+                "ORDER BY station_no LIMIT ? OFFSET ?",
+                args + [limit, offset],
+            )
+            rows = [dict(zip(STATION_FIELDS, row)) for row in cursor]
+        return {"total": total, "offset": offset, "stations": rows}
+
+    def station_index(self, version):
+        """營運中檢驗站的網格索引（spatial.GridIndex）與對應的資料列（list[dict]）"""
+        import pandas as pd
+        from spatial import GridIndex
+
+        def build():
+            with self.stations_pool.connection() as conn:
+                df = pd.read_sql_query(f"SELECT {', '.join(STATION_FIELDS)} FROM active_stations", conn)
+            return GridIndex(df["latitude"], df["longitude"]), records(df)
+
+        return self.derived("station_index", version, build)
+
+    def nearest(self, params, version):
+        lat = number_param(params, "lat", None, kind=float, minimum=LAT_RANGE[0], maximum=LAT_RANGE[1])
+        lon = number_param(params, "lon", None, kind=float, minimum=LON_RANGE[0], maximum=LON_RANGE[1])
+        k = number_param(params, "k", 1, minimum=1, maximum=MAX_NEAREST)
+
+        index, rows = self.station_index(version)
+        position, distance = index.nearest([lat], [lon])
+        if position[0] < 0:
+            return {"lat": lat, "lon": lon, "stations": []}
+
+        if k > 1:
+            position, distance = k_nearest(index, lat, lon, k, distance[0])
+
+        stations = [
+            dict(rows[i], distance_km=round(float(d), 3)) for i, d in zip(position.tolist(), distance.tolist())
+        ]
+        return {"lat": lat, "lon": lon, "stations": stations}
+
+    def top_districts(self, params, version):
+        import gazetteer
+        import station_summary
+
+        k = number_param(params, "k", 1, minimum=1, maximum=MAX_LIMIT)
+        ties = text_param(params, "ties", "first")
+        if ties not in station_summary.RANK_FUNCTIONS:
+            raise ServiceError(400, f"ties 必須是 {', '.join(station_summary.RANK_FUNCTIONS)} 其中之一")
+
+        with self.stations_pool.connection() as conn:
+            table = station_summary.top_districts(k, ties, conn=conn)
+        city = text_param(params, "city")
+        if city:
+            table = table[table["city"] == gazetteer.normalize(city)]
+        return {"k": k, "ties": ties, "districts": records(table)}
+
+    def county_air(self, params, version):
+        import air_rolling
+        import gazetteer
+
+        county = text_param(params, "county")
+        window = text_param(params, "window")
+        metric = text_param(params, "metric")
+        if window and window != "all" and window not in air_rolling.WINDOWS:
+            raise ServiceError(400, f"window 必須是 all、{'、'.join(air_rolling.WINDOWS)} 其中之一")
+        if metric and metric not in air_rolling.METRICS:
+            raise ServiceError(400, f"metric 必須是 {'、'.join(air_rolling.METRICS)} 其中之一")
+
+        # 視窗統計需合併各小時的桶，每個資料版本只計算一次
+        def build():
+            with self.air_pool.connection() as conn:
+                return air_rolling.summary("county", conn=conn)
+
+        table = self.derived("county_air", version, build)
+        if county:
+            table = table[table["name"] == gazetteer.normalize(county)]
+        if window:
+            table = table[table["window"] == window]
+        if metric:
+            table = table[table["metric"] == metric]
+        return {"counties": records(table.rename(columns={"name": "county"}))}
+
+    def air_vs_station(self, params, version):
+        from intermediates import read_table
+
+        table = self.derived(
+            "city_air_vs_station", version,
+            lambda: read_table("city_air_vs_station", directory=self.intermediate),
+        )
+        return {"cities": records(table)}
+
+
+def k_nearest(index, lat, lon, k, nearest_km):
+    """
+    離 (lat, lon) 最近的 k 個點（spatial.GridIndex），回傳 (原始位置, 距離公里)，依距離排序
+
+    以最近一點的距離為起點逐次加倍半徑做範圍查詢，直到涵蓋 k 點；
+    半徑涵蓋的網格數多於點數時（例如查詢點遠在索引範圍外）改為直接計算到每一點的距離
+    """
+    import numpy as np
+    from spatial import haversine_km
+
+    k = min(k, len(index))
+    radius = max(nearest_km, index.cell_km)
+    while (2 * radius / index.cell_km + 1) ** 2 <= len(index):
+        hits = index.within([lat], [lon], radius)
+        if len(hits) >= k:
+            hits = hits.nsmallest(k, "distance_km")
+            return hits["point"].to_numpy(), hits["distance_km"].to_numpy()
+        radius *= 2
+
+    distance = haversine_km(lat, lon, index.lat, index.lon)
+    nearest = np.argsort(distance, kind="stable")[:k]
+    return index.ids[nearest], distance[nearest]
+
+
+def encode(payload):
+    return json.dumps(payload, ensure_ascii=False, default=str).encode("utf-8")
+
+
+# ==================================================
+# HTTP 伺服器
+# ==================================================
+class RequestHandler(BaseHTTPRequestHandler):
+    # HTTP/1.1：連線保持（keep-alive），負載測試時不必每個請求重新連線
+    protocol_version = "HTTP/1.1"
+    # 標頭與內容分兩次寫出，不關閉 Nagle 時每個回應會多等一次延遲 ACK（約 40 毫秒）
+    disable_nagle_algorithm = True
+
+    def do_GET(self):
+        status, body, cached = self.server.service.handle(self.path)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        self.send_header("X-Cache", "hit" if cached else "miss")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            super().log_message(format, *args)
+
+
+class QueryServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, service, verbose=False):
+        super().__init__(address, RequestHandler)
+        self.service = service
+        self.verbose = verbose
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}"
+
+
+def start_server(host="127.0.0.1", port=0, verbose=False, **options):
+    """
+    在背景執行緒啟動服務（同一個行程內，測試 / 負載測試用），回傳 QueryServer
+
+    port=0 時由系統分配可用的埠號（見 server.url）；結束時呼叫 stop_server(server)
+    options 傳給 QueryService（db_path / air_db_path / pool_size / cache_size 等）
+    """
+    server = QueryServer((host, port), QueryService(**options), verbose)
+    threading.Thread(target=server.serve_forever, name="query-service", daemon=True).start()
+    return server
+
+
+def stop_server(server):
+    server.shutdown()
+    server.server_close()
+    server.service.close()
+
+
+def serve(host="127.0.0.1", port=DEFAULT_PORT, verbose=True, **options):
+    """在前景執行服務，直到 Ctrl+C"""
+    server = QueryServer((host, port), QueryService(**options), verbose)
+    print(f"✅ 查詢服務已啟動：{server.url}（Ctrl+C 結束）")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        server.service.close()
+        print("⏹️ 查詢服務已停止")
+
+
+# ---------- 主程式進入點 ----------
+# 用法：python query_service.py --port 8765（或 python cli.py serve）
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="唯讀查詢服務（HTTP / JSON）")
+    parser.add_argument("--host", default="127.0.0.1", help="監聽位址")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="監聽埠號")
+    parser.add_argument("--db", default="inspection_stations.db", help="檢驗站 SQLite")
+    parser.add_argument("--pool-size", type=int, default=4, help="每個資料庫的連線池大小")
+    parser.add_argument("--cache-size", type=int, default=1024, help="LRU 快取的回應數（0 為不快取）")
+    parser.add_argument("--quiet", action="store_true", help="不顯示每個請求的紀錄")
+    args = parser.parse_args()
+    serve(
+        args.host, args.port, verbose=not args.quiet,
+        db_path=args.db, pool_size=args.pool_size, cache_size=args.cache_size,
+    )
@@ -0,0 +1,359 @@
+import argparse
+import os
+
+import numpy as np
+
+
+# ==================================================
+# 檢驗站密度 / PM2.5 網格（NumPy 直方圖）
+# ==================================================
+# 行政區長條圖看不出檢驗站在空間上的分布，這裡把座標分箱到經緯度網格：
+#   counts      : 每格的檢驗站數（uint32）
+#   density     : 高斯平滑後的密度（每平方公里檢驗站數）
+#   pm25_mean   : 每格內空品測站的平均 PM2.5（沒有測站的格為 NaN）
+#   pm25_smooth : 以測站數加權的高斯平滑 PM2.5 面（離測站太遠的格為 NaN）
+#
+# - 分箱：座標換算成格編號後以 np.bincount 累加，O(點數)，不需要排序或 searchsorted
+# - 分段：座標以 CHUNK_POINTS 筆為一段讀入（Parquet 依 row group 批次讀取），
+#         記憶體只與網格大小和每段筆數有關，數千萬筆也不會一次載入
+# - 平滑：可分離的高斯核，沿兩個軸各做一次一維卷積（經度方向依平均緯度換算公里）
+#
+# 輸出（RASTER_DIR）：
+#   station_density.npz : 上述陣列與網格定義（壓縮；大部分格為 0，壓縮後很小）
+#   station_density.png / pm25_surface.png
+RASTER_DIR = "raster"
+RASTER_FILE = "station_density.npz"
+IMAGES = ["station_density", "pm25_surface"]
+
+# 預設範圍：台灣本島與澎湖、金門、馬祖、蘭嶼（緯度下限、上限、經度下限、上限）
+BOUNDS = (21.8, 26.4, 118.1, 122.1)
+CELL_DEG = 0.01            # 約 1.1 公里
+SIGMA_KM = 2.0             # 檢驗站密度的平滑半徑
+PM25_SIGMA_KM = 15.0       # 空品測站稀疏，PM2.5 面以較大的半徑平滑
+
+# 平滑後的測站權重低於此值（離測站太遠）不推估 PM2.5
+PM25_MIN_WEIGHT = 0.01
+
+CHUNK_POINTS = 2_000_000
+
+KM_PER_DEG = 111.195
+
+
+class RasterGrid:
+    """
+    經緯度網格
+
+    bounds  : (緯度下限, 緯度上限, 經度下限, 經度上限)
+    cell_deg: 每格的經緯度大小；第 0 列為最南邊
+    """
+
+    def __init__(self, bounds=BOUNDS, cell_deg=CELL_DEG):
+        self.lat_min, self.lat_max, self.lon_min, self.lon_max = map(float, bounds)
+        if self.lat_max <= self.lat_min or self.lon_max <= self.lon_min or cell_deg <= 0:
+            raise ValueError(f"網格範圍或大小不正確：{bounds}、{cell_deg}")
+        self.cell_deg = float(cell_deg)
+        self.rows = int(np.ceil(round((self.lat_max - self.lat_min) / self.cell_deg, 9)))
+        self.cols = int(np.ceil(round((self.lon_max - self.lon_min) / self.cell_deg, 9)))
+
+    @property
+    def shape(self):
+        return self.rows, self.cols
+
+    @property
+    def size(self):
+        return self.rows * self.cols
+
+    @property
+    def bounds(self):
+        return self.lat_min, self.lat_max, self.lon_min, self.lon_max
+
+    def cell_index(self, lat, lon):
+        """座標 → 攤平後的格編號（範圍外或缺漏的點不回傳），以及保留的點（布林陣列）"""
+        row = np.floor((np.asarray(lat, dtype="float64") - self.lat_min) / self.cell_deg)
+        col = np.floor((np.asarray(lon, dtype="float64") - self.lon_min) / self.cell_deg)
+        # NaN 的比較結果為 False，缺漏的座標一併排除
+        inside = (row >= 0) & (row < self.rows) & (col >= 0) & (col < self.cols)
+        return (row[inside] * self.cols + col[inside]).astype(np.int64), inside
+
+    def cell_area_km2(self):
+        """每一列格子的面積（平方公里），經度方向的寬度隨緯度變化"""
+        center = self.lat_min + (np.arange(self.rows) + 0.5) * self.cell_deg
+        side = self.cell_deg * KM_PER_DEG
+        return side * side * np.cos(np.radians(center))
+
+    def sigma_cells(self, sigma_km):
+        """平滑半徑（公里）→ (緯度方向, 經度方向) 的格數"""
+        side = self.cell_deg * KM_PER_DEG
+        center = (self.lat_min + self.lat_max) / 2
+        return sigma_km / side, sigma_km / (side * np.cos(np.radians(center)))
+
+
+# ==================================================
+# 分箱與平滑
+# ==================================================
+def bin_points(chunks, grid, weighted=False):
+    """
+    分段累加每格的點數（weighted=True 時另外累加權重總和）
+
+    chunks: 產生 (lat, lon) 或 (lat, lon, weight) 的可迭代物件
+    回傳 (counts, sums, 總點數, 網格內點數)；counts / sums 為 grid.shape 的陣列（未加權時 sums 為 None）
+    """
+    counts = np.zeros(grid.size, dtype=np.int64)
+    sums = np.zeros(grid.size) if weighted else None
+    total = inside = 0
+
+    for chunk in chunks:
+        lat, lon = chunk[0], chunk[1]
+        cell, keep = grid.cell_index(lat, lon)
+        if weighted:
+            weight = np.asarray(chunk[2], dtype="float64")[keep]
+            valid = ~np.isnan(weight)
+            cell, weight = cell[valid], weight[valid]
+            sums += np.bincount(cell, weights=weight, minlength=grid.size)
+        counts += np.bincount(cell, minlength=grid.size)
+        total += len(lat)
+        inside += len(cell)
+
+    return counts.reshape(grid.shape), None if sums is None else sums.reshape(grid.shape), total, inside
+
+
+def smooth_axis(values, sigma, axis):
+    """沿一個軸做一維高斯卷積（範圍外視為 0），核截斷在 3σ"""
+    if sigma <= 0:
+        return values
+    radius = int(np.ceil(3 * sigma))
+    offsets = np.arange(-radius, radius + 1)
+    kernel = np.exp(-0.5 * (offsets / sigma) ** 2)
+    kernel /= kernel.sum()
+
+    moved = np.moveaxis(values, axis, 0)
+    padded = np.pad(moved, [(radius, radius)] + [(0, 0)] * (moved.ndim - 1))
+    n = moved.shape[0]
+    result = np.zeros_like(moved, dtype="float64")
+    for k, weight in enumerate(kernel):
+        result += weight * padded[k:k + n]
+    return np.moveaxis(result, 0, axis)
+
+
+def gaussian_smooth(values, sigma_cells):
+    """可分離的二維高斯平滑；sigma_cells 為 (列方向, 欄方向) 的格數"""
+    result = smooth_axis(np.asarray(values, dtype="float64"), sigma_cells[0], 0)
+    return smooth_axis(result, sigma_cells[1], 1)
+
+
+# ==================================================
+# 資料來源（分段）
+# ==================================================
+def parquet_chunks(path, columns=("latitude", "longitude"), chunk_points=CHUNK_POINTS):
+    """依批次讀取 Parquet 的座標欄位（每次最多 chunk_points 筆）"""
+    import pyarrow.parquet as pq
+
+    for batch in pq.ParquetFile(path).iter_batches(batch_size=chunk_points, columns=list(columns)):
+        yield tuple(
+            batch.column(i).to_numpy(zero_copy_only=False).astype("float64", copy=False)
+            for i in range(len(columns))
+        )
+
+
+def array_chunks(lat, lon, chunk_points=CHUNK_POINTS):
+    """記憶體中的座標陣列分段"""
+    for start in range(0, len(lat), chunk_points):
+        yield lat[start:start + chunk_points], lon[start:start + chunk_points]
+
+
+def site_pm25(air_df):
+    """空品測站的平均 PM2.5 與座標（每站一列：latitude / longitude / pm2.5）"""
+    import pandas as pd
+
+    sites = pd.DataFrame({
+        "sitename": air_df["sitename"].astype(object).to_numpy(),
+        "latitude": pd.to_numeric(air_df["latitude"], errors="coerce").to_numpy(dtype="float64"),
+        "longitude": pd.to_numeric(air_df["longitude"], errors="coerce").to_numpy(dtype="float64"),
+        "pm2.5": pd.to_numeric(air_df["pm2.5"], errors="coerce").to_numpy(dtype="float64"),
+    })
+    return sites.groupby("sitename", sort=False).agg(
+        latitude=("latitude", "first"), longitude=("longitude", "first"), pm25=("pm2.5", "mean"),
+    ).rename(columns={"pm25": "pm2.5"}).reset_index()
+
+
+# ==================================================
+# 網格計算與輸出
+# ==================================================
+def build_rasters(station_chunks, grid=None, sites=None, sigma_km=SIGMA_KM, pm25_sigma_km=PM25_SIGMA_KM):
+    """
+    計算檢驗站密度與（有 sites 時）PM2.5 網格
+
+    station_chunks: 產生 (lat, lon) 的可迭代物件（見 parquet_chunks / array_chunks）
+    sites         : site_pm25 的結果（None 為不計算 PM2.5）
+
+    回傳 dict：counts / density /（pm25_mean / pm25_smooth）與 points / points_inside
+    """
+    grid = grid or RasterGrid()
+    counts, _, total, inside = bin_points(station_chunks, grid)
+    if total > inside:
+        print(f"⚠️ {total - inside} 個點不在網格範圍內或座標缺漏，不列入")
+
+    density = gaussian_smooth(counts, grid.sigma_cells(sigma_km)) / grid.cell_area_km2()[:, None]
+    rasters = {
+        "counts": counts.astype(np.uint32),
+        "density": density.astype(np.float32),
+        "points": total,
+        "points_inside": inside,
+    }
+
+    if sites is not None and len(sites):
+        chunk = (sites["latitude"].to_numpy(), sites["longitude"].to_numpy(), sites["pm2.5"].to_numpy())
+        site_counts, site_sums, _, _ = bin_points([chunk], grid, weighted=True)
+        with np.errstate(invalid="ignore", divide="ignore"):
+            rasters["pm25_mean"] = (site_sums / site_counts).astype(np.float32)
+
+            # 正規化卷積：平滑後的 PM2.5 總和 / 平滑後的測站數
+            sigma = grid.sigma_cells(pm25_sigma_km)
+            weight = gaussian_smooth(site_counts, sigma)
+            surface = gaussian_smooth(site_sums, sigma) / weight
+        surface[weight < PM25_MIN_WEIGHT * weight.max()] = np.nan
+        rasters["pm25_smooth"] = surface.astype(np.float32)
+
+    return rasters
+
+
+def save_rasters(rasters, grid, path, sigma_km=SIGMA_KM, pm25_sigma_km=PM25_SIGMA_KM):
+    """陣列與網格定義存成壓縮的 .npz（先寫暫存檔再改名）"""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    arrays = {name: value for name, value in rasters.items() if isinstance(value, np.ndarray)}
+    tmp = f"{path}.tmp"
+    with open(tmp, "wb") as f:
+        np.savez_compressed(
+            f,
+            bounds=np.array(grid.bounds),
+            cell_deg=np.array(grid.cell_deg),
+            sigma_km=np.array(sigma_km),
+            pm25_sigma_km=np.array(pm25_sigma_km),
+            **arrays,
+        )
+    os.replace(tmp, path)
+    return path
+
+
+def load_rasters(path=os.path.join(RASTER_DIR, RASTER_FILE)):
+    """讀回 save_rasters 的輸出：(dict 陣列, RasterGrid)"""
+    with np.load(path, allow_pickle=False) as data:
+        arrays = {name: data[name] for name in data.files}
+    grid = RasterGrid(tuple(arrays.pop("bounds")), float(arrays.pop("cell_deg")))
+    return arrays, grid
+
+
+def render_rasters(rasters, grid, output_dir=RASTER_DIR, fmt="png", sites=None):
+    """
+    繪製熱度圖並輸出成圖檔，回傳檔案路徑清單
+
+    不經過 pyplot（直接建立 Figure），不影響其他圖表使用的互動式後端
+    """
+    from matplotlib.colors import LogNorm
+    from matplotlib.figure import Figure
+
+    from chart_utils import cjk_font
+
+    font = cjk_font()
+    extent = (grid.lon_min, grid.lon_max, grid.lat_min, grid.lat_max)
+    os.makedirs(output_dir, exist_ok=True)
+    paths = []
+
+    def save(fig, name):
+        path = os.path.join(output_dir, f"{name}.{fmt}")
+        fig.savefig(path, format=fmt, dpi=150)
+        paths.append(path)
+
+    # 檢驗站密度（對數色階，密度極低的格不上色）
+    density = np.where(rasters["density"] > 1e-3, rasters["density"], np.nan)
+    fig = Figure(figsize=(7, 8))
+    ax = fig.add_subplot()
+    if np.isfinite(density).any():
+        image = ax.imshow(
+            density, origin="lower", extent=extent, cmap="magma",
+            norm=LogNorm(vmin=1e-3, vmax=np.nanmax(density)),
+        )
+        fig.colorbar(image, ax=ax, shrink=0.8).set_label("檢驗站 / 平方公里", fontproperties=font)
+    ax.set_title(f"機車排氣檢驗站密度（{int(rasters['counts'].sum())} 站）", fontproperties=font)
+    ax.set_xlabel("經度", fontproperties=font)
+    ax.set_ylabel("緯度", fontproperties=font)
+    ax.set_aspect(1 / np.cos(np.radians((grid.lat_min + grid.lat_max) / 2)))
+    fig.tight_layout()
+    save(fig, "station_density")
+
+    # PM2.5 平滑面與空品測站位置
+    fig = Figure(figsize=(7, 8))
+    ax = fig.add_subplot()
+    surface = rasters.get("pm25_smooth")
+    if surface is not None and np.isfinite(surface).any():
+        image = ax.imshow(surface, origin="lower", extent=extent, cmap="YlOrRd")
+        fig.colorbar(image, ax=ax, shrink=0.8).set_label("PM2.5（μg/m³）", fontproperties=font)
+        if sites is not None:
+            ax.scatter(sites["longitude"], sites["latitude"], s=6, c="black", marker="^", linewidths=0)
+    else:
+        ax.text(0.5, 0.5, "沒有 PM2.5 資料", ha="center", va="center", transform=ax.transAxes, fontproperties=font)
+    ax.set_xlim(grid.lon_min, grid.lon_max)
+    ax.set_ylim(grid.lat_min, grid.lat_max)
+    ax.set_title("PM2.5 平滑分布（空品測站加權）", fontproperties=font)
+    ax.set_xlabel("經度", fontproperties=font)
+    ax.set_ylabel("緯度", fontproperties=font)
+    ax.set_aspect(1 / np.cos(np.radians((grid.lat_min + grid.lat_max) / 2)))
+    fig.tight_layout()
+    save(fig, "pm25_surface")
+
+    return paths
+
+
+def run_raster(
+    output_dir=RASTER_DIR,
+    bounds=BOUNDS,
+    cell_deg=CELL_DEG,
+    sigma_km=SIGMA_KM,
+    pm25_sigma_km=PM25_SIGMA_KM,
+    pm25=True,
+    chunk_points=CHUNK_POINTS,
+    fmt="png",
+):
+    """
+    由中介檔計算並輸出網格（檢驗站：inspection_stations_clean，PM2.5：air_quality）
+
+    回傳 build_rasters 的結果
+    """
+    from intermediates import read_table, table_path
+
+    grid = RasterGrid(bounds, cell_deg)
+    sites = None
+    if pm25:
+        try:
+            sites = site_pm25(read_table("air_quality", columns=["sitename", "latitude", "longitude", "pm2.5"]))
+        except (FileNotFoundError, KeyError):
+            print("⚠️ 找不到空汙中介檔或測站座標，只計算檢驗站密度")
+
+    chunks = parquet_chunks(table_path("inspection_stations_clean"), chunk_points=chunk_points)
+    rasters = build_rasters(chunks, grid, sites, sigma_km, pm25_sigma_km)
+
+    path = save_rasters(rasters, grid, os.path.join(output_dir, RASTER_FILE), sigma_km, pm25_sigma_km)
+    images = render_rasters(rasters, grid, output_dir, fmt, sites)
+    print(
+        f"✅ 網格 {grid.rows} × {grid.cols}（{grid.cell_deg}°），{rasters['points_inside']} 個檢驗站 → "
+        f"{path}、{', '.join(images)}"
+    )
+    return rasters
+
+
+# ---------- 主程式進入點 ----------
+# 用法：python raster.py [--cell-deg 0.005] [--sigma-km 1] [--no-pm25]
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="檢驗站密度 / PM2.5 網格與熱度圖")
+    parser.add_argument("--output-dir", default=RASTER_DIR, help="輸出目錄")
+    parser.add_argument("--bounds", type=float, nargs=4, default=BOUNDS,
+                        metavar=("LAT_MIN", "LAT_MAX", "LON_MIN", "LON_MAX"), help="網格範圍")
+    parser.add_argument("--cell-deg", type=float, default=CELL_DEG, help="每格的經緯度大小")
+    parser.add_argument("--sigma-km", type=float, default=SIGMA_KM, help="密度的平滑半徑（公里，0 為不平滑）")
+    parser.add_argument("--pm25-sigma-km", type=float, default=PM25_SIGMA_KM, help="PM2.5 面的平滑半徑（公里）")
+    parser.add_argument("--no-pm25", action="store_true", help="不計算 PM2.5 網格")
+    args = parser.parse_args()
+    run_raster(
+        args.output_dir, args.bounds, args.cell_deg, args.sigma_km, args.pm25_sigma_km,
+        pm25=not args.no_pm25,
+    )
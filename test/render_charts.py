@@ -0,0 +1,100 @@
+import argparse
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+# 無視窗環境（批次主機）一律使用非互動式後端，必須在 pyplot 之前設定
+import matplotlib
+matplotlib.use("Agg")
+
+import analysis
+import final_plots
+import plot_analysis
+import station_summary
+from intermediates import read_table
+
+
+# ==================================================
+# 無視窗模式：將所有圖表輸出成圖檔
+# ==================================================
+def use_agg():
+    """子行程初始化：確保使用非互動式後端"""
+    matplotlib.use("Agg")
+
+
+def city_chart_tasks(output_dir, fmt):
+    """
+    建立每個縣市一張圖的工作清單
+
+    每個工作只帶該縣市的資料，傳給子行程的資料量很小
+    """
+
+    tasks = []
+
+    # 各縣市 → 行政區檢驗站數量長條圖（22 個縣市，讀 SQLite 的彙總表）
+    districts = station_summary.district_counts()
+    for city, city_df in districts.groupby("city", sort=True):
+        tasks.append((analysis.plot_district_bar_by_city, (city_df, city, output_dir, fmt)))
+
+    # 高 PM2.5 縣市 → 行政區分布圖
+    high = read_table(
+        "high_pm25_city_district_station",
+        columns=["city", "district", "station_count"],
+    )
+    for city, city_df in high.groupby("city", observed=True, sort=False):
+        tasks.append((plot_analysis.plot_high_pm25_city, (city_df, city, output_dir, fmt)))
+
+    return tasks
+
+
+def run_task(task):
+    func, args = task
+    return func(*args)
+
+
+def render_all(output_dir="charts", fmt="png", workers=None):
+    """
+    將所有分析圖表輸出到 output_dir
+
+    參數說明：
+    fmt    : 圖檔格式（png / svg）
+    workers: 平行繪圖的子行程數（None 為 CPU 核心數，1 為不開子行程）
+
+    回傳所有輸出的檔案路徑
+    """
+
+    start = time.perf_counter()
+
+    # 總覽圖只有幾張，直接在主行程繪製
+    paths = final_plots.run_final_plots(output_dir, fmt) + [
+        plot_analysis.plot_air_vs_station(output_dir, fmt),
+        analysis.plot_top_district_summary(
+            analysis.analyze_top_district_by_city(),
+            output_dir,
+            fmt,
+        ),
+    ]
+
+    # 每個縣市一張的圖表分散給多個子行程
+    tasks = city_chart_tasks(output_dir, fmt)
+    if workers == 1:
+        paths += [run_task(task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers, initializer=use_agg) as pool:
+            paths += list(pool.map(run_task, tasks))
+
+    paths = [p for p in paths if p]
+    elapsed = time.perf_counter() - start
+    print(f"✅ 已輸出 {len(paths)} 張圖表到 {output_dir}（{elapsed:.1f} 秒）")
+    return paths
+
+
+# ---------- 主程式進入點 ----------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="無視窗模式輸出所有分析圖表")
+    parser.add_argument("output_dir", nargs="?", default="charts", help="圖檔輸出目錄")
+    parser.add_argument("--format", choices=["png", "svg"], default="png", help="圖檔格式")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(), help="平行繪圖的子行程數")
+    args = parser.parse_args()
+
+    render_all(args.output_dir, args.format, args.workers)
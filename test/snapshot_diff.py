@@ -0,0 +1,257 @@
+import argparse
+import os
+import sqlite3
+
+import numpy as np
+import pandas as pd
+
+
+# ==================================================
+# 檢驗站快照比對：新增 / 移除 / 欄位變更
+# ==================================================
+# 以 station_no 為鍵比對兩份快照（例如上次匯入的 SQLite 與這次的 XML）：
+#   - 以雜湊索引（pd.Index.get_indexer）對應兩份快照的列，整體為線性時間
+#   - 各欄位整欄比較（類別欄位比較代碼），不逐列比對
+# 結果：
+#   added   : 新快照才有的檢驗站（新開設）
+#   removed : 舊快照才有的檢驗站（停業 / 下架）
+#   modified: 兩份都有但內容有變的檢驗站（新快照的資料）
+#   changes : 每個變更欄位一列（station_no, field, old_value, new_value）
+#
+# 匯入檢驗站時（main.ingest_stations）會與資料庫中的上一份快照比對，
+# 變更紀錄附加到 SQLite 的 station_changes 資料表
+KEY = "station_no"
+
+CHANGES_SCHEMA = """
+CREATE TABLE IF NOT EXISTS station_changes (
+    detected_at TEXT NOT NULL,
+    station_no  TEXT NOT NULL,
+    change      TEXT NOT NULL,
+    field       TEXT,
+    old_value   TEXT,
+    new_value   TEXT
+)
+"""
+CHANGES_INDEX = "CREATE INDEX IF NOT EXISTS idx_station_changes_no ON station_changes (station_no)"
+
+
+def unique_by_key(df, key=KEY):
+    """同一鍵出現多次時只保留最後一筆（比對需要唯一鍵）"""
+    duplicated = df[key].duplicated(keep="last")
+    if duplicated.any():
+        print(f"⚠️ {key} 重複 {int(duplicated.sum())} 筆，只保留最後一筆")
+        df = df[~duplicated.to_numpy()]
+    return df.reset_index(drop=True)
+
+
+def field_changed(old, new):
+    """
+    逐欄比較兩個等長的 Series，回傳「有變更」的布林陣列
+
+    - 類別欄位：兩邊的類別值對應到同一份類別清單後比較代碼
+    - 兩邊都是缺值視為相同
+    - 任一邊為 float32（座標）時以 float32 比較，與儲存精度一致
+    """
+    if isinstance(old.dtype, pd.CategoricalDtype) and isinstance(new.dtype, pd.CategoricalDtype):
+        categories = old.cat.categories.union(new.cat.categories)
+        # 代碼 -1（缺值）取到最後一個元素，仍為 -1
+        old_codes = np.append(categories.get_indexer(old.cat.categories), -1)[old.cat.codes.to_numpy()]
+        new_codes = np.append(categories.get_indexer(new.cat.categories), -1)[new.cat.codes.to_numpy()]
+        return old_codes != new_codes
+
+    if isinstance(old.dtype, pd.StringDtype) and isinstance(new.dtype, pd.StringDtype):
+        # 字串欄位底層為 Arrow 陣列，直接以 pyarrow 整欄比較，不轉成 Python 字串
+        import pyarrow as pa
+        import pyarrow.compute as pc
+
+        old_values = pa.array(old.array, type=pa.large_string(), from_pandas=True)
+        new_values = pa.array(new.array, type=pa.large_string(), from_pandas=True)
+        same = pc.or_(
+            pc.fill_null(pc.equal(old_values, new_values), False),
+            pc.and_(pc.is_null(old_values), pc.is_null(new_values)),
+        )
+        return ~same.to_numpy(zero_copy_only=False)
+
+    if np.float32 in (old.dtype, new.dtype):
+        old_values = pd.to_numeric(old, errors="coerce").to_numpy(dtype="float32")
+        new_values = pd.to_numeric(new, errors="coerce").to_numpy(dtype="float32")
+    else:
+        old_values = old.to_numpy(dtype=object)
+        new_values = new.to_numpy(dtype=object)
+
+    old_na = pd.isna(old_values)
+    new_na = pd.isna(new_values)
+    same = (old_values == new_values) | (old_na & new_na)
+    return ~same
+
+
+def as_text(values):
+    """變更紀錄的值統一存成文字（float32 取最短表示法，缺值為 None）"""
+    text = (values.astype(str) if values.dtype == np.float32 else values).astype(object)
+    text[pd.isna(values)] = None
+    return text
+
+
+def diff_snapshots(old, new, key=KEY, columns=None):
+    """
+    比對兩份檢驗站快照
+
+    參數說明：
+    old / new: 舊 / 新快照（DataFrame）
+    key      : 鍵欄位
+    columns  : 比較的欄位（None 為兩份都有的所有欄位）
+
+    回傳 dict：added / removed / modified / changes（皆為 DataFrame）
+    """
+
+    old = unique_by_key(old, key)
+    new = unique_by_key(new, key)
+    if columns is None:
+        columns = [c for c in new.columns if c in old.columns and c != key]
+
+    # 雜湊索引：新快照每一列在舊快照中的位置（-1 表示新增）
+    old_keys = pd.Index(old[key].astype(str))
+    new_keys = pd.Index(new[key].astype(str))
+    position = old_keys.get_indexer(new_keys)
+
+    matched_new = np.flatnonzero(position >= 0)
+    matched_old = position[matched_new]
+
+    # 舊快照中沒有被對應到的列即為移除（不必再反向查一次）
+    unmatched_old = np.ones(len(old), dtype=bool)
+    unmatched_old[matched_old] = False
+
+    added = new[position < 0].reset_index(drop=True)
+    removed = old[unmatched_old].reset_index(drop=True)
+    before = old.iloc[matched_old].reset_index(drop=True)
+    after = new.iloc[matched_new].reset_index(drop=True)
+
+    any_change = np.zeros(len(after), dtype=bool)
+    changes = []
+    for col in columns:
+        changed = field_changed(before[col], after[col])
+        if not changed.any():
+            continue
+        any_change |= changed
+        rows = np.flatnonzero(changed)
+        changes.append(pd.DataFrame({
+            key: after[key].to_numpy()[rows],
+            "field": col,
+            "old_value": pd.Series(as_text(before[col].to_numpy()[rows]), dtype=object),
+            "new_value": pd.Series(as_text(after[col].to_numpy()[rows]), dtype=object),
+        }))
+
+    if changes:
+        changes = pd.concat(changes, ignore_index=True)
+    else:
+        changes = pd.DataFrame(columns=[key, "field", "old_value", "new_value"])
+
+    return {
+        "added": added,
+        "removed": removed,
+        "modified": after[any_change].reset_index(drop=True),
+        "changes": changes,
+    }
+
+
+def summarize(diff):
+    """一行文字摘要（各欄位變更筆數）"""
+    per_field = diff["changes"]["field"].value_counts()
+    fields = "、".join(f"{field} {count}" for field, count in per_field.items())
+    return (
+        f"新增 {len(diff['added'])}、移除 {len(diff['removed'])}、變更 {len(diff['modified'])}"
+        + (f"（{fields}）" if fields else "")
+    )
+
+
+# ==================================================
+# 變更紀錄（SQLite station_changes 資料表）
+# ==================================================
+def change_records(diff, detected_at, key=KEY):
+    """將比對結果轉成 station_changes 的資料列"""
+    for no in diff["added"][key]:
+        yield (detected_at, no, "added", None, None, None)
+    for no in diff["removed"][key]:
+        yield (detected_at, no, "removed", None, None, None)
+    yield from (
+        (detected_at, no, "modified", field, old, new)
+        for no, field, old, new in diff["changes"].itertuples(index=False, name=None)
+    )
+
+
+def write_changes(conn, diff):
+    """
+    在已開啟的連線附加變更紀錄到 station_changes（不提交），回傳寫入筆數
+
+    analysis.upsert_stations 在寫入檢驗站的同一個交易內呼叫：寫入失敗時變更紀錄一併復原
+    """
+    detected_at = pd.Timestamp.now().strftime("%Y-%m-%d %H:%M:%S")
+    conn.execute(CHANGES_SCHEMA)
+    conn.execute(CHANGES_INDEX)
+    before = conn.total_changes
+    conn.executemany(
+        "INSERT INTO station_changes VALUES (?, ?, ?, ?, ?, ?)",
+        change_records(diff, detected_at),
+    )
+    return conn.total_changes - before
+
+
+def record_changes(diff, db_path="inspection_stations.db"):
+    """附加變更紀錄到 station_changes（單獨一個交易），回傳寫入筆數"""
+    conn = sqlite3.connect(db_path)
+    try:
+        with conn:
+            return write_changes(conn, diff)
+    finally:
+        conn.close()
+
+
+def diff_against_db(df, db_path="inspection_stations.db", record=True):
+    """
+    與資料庫中營運中的檢驗站（上一份快照）比對並記錄變更
+
+    record: False 時只比對、不寫入 station_changes；
+            由呼叫端交給 analysis.upsert_stations(changes=diff)，與檢驗站在同一個交易內寫入
+
+    資料庫還不存在時（第一次匯入）不比對，回傳 None
+    """
+    import analysis
+
+    if not os.path.exists(db_path):
+        return None
+    try:
+        previous = analysis.read_stations(db_path, active_only=True)
+    except pd.errors.DatabaseError:
+        # 舊版資料庫（整表覆寫、沒有 active_stations）的每一列都是上一份資料
+        try:
+            previous = analysis.read_stations(db_path, active_only=False)
+        except pd.errors.DatabaseError:
+            return None
+
+    diff = diff_snapshots(previous, df)
+    if record:
+        record_changes(diff, db_path)
+    print(f"✅ 與上一份檢驗站資料比對：{summarize(diff)}")
+    return diff
+
+
+# ---------- 主程式進入點 ----------
+# 用法：python snapshot_diff.py 舊.xml 新.xml [--output-dir diff]
+if __name__ == "__main__":
+    from analysis import clean_data
+    from moenv_crawler import crawl_moenv_xml
+
+    parser = argparse.ArgumentParser(description="比對兩份檢驗站 XML 快照")
+    parser.add_argument("old", help="舊的檢驗站 XML")
+    parser.add_argument("new", help="新的檢驗站 XML")
+    parser.add_argument("--output-dir", help="輸出 added / removed / modified / changes CSV 的目錄")
+    args = parser.parse_args()
+
+    result = diff_snapshots(clean_data(crawl_moenv_xml(args.old)), clean_data(crawl_moenv_xml(args.new)))
+    print(summarize(result))
+
+    if args.output_dir:
+        os.makedirs(args.output_dir, exist_ok=True)
+        for name, table in result.items():
+            table.to_csv(os.path.join(args.output_dir, f"{name}.csv"), index=False, encoding="utf-8-sig")
+        print(f"✅ 比對結果已輸出到 {args.output_dir}")
@@ -0,0 +1,485 @@
+import numpy as np
+import pandas as pd
+
+
+# ==================================================
+# 常數：地球半徑與經緯度換算（公里）
+# ==================================================
+EARTH_RADIUS_KM = 6371.0088
+KM_PER_DEG = np.pi * EARTH_RADIUS_KM / 180
+
+# 網格格數上限，避免點位很密時建立過大的索引陣列
+MAX_CELLS = 4_000_000
+
+# IDW 每段的距離矩陣元素數上限（檢測站數 × 測站數），約 16 MB 的 float64
+IDW_CHUNK_ELEMENTS = 2_000_000
+
+# 距離在此以內視為同一地點，直接採用該測站的數值（避免除以 0）
+SAME_PLACE_KM = 0.001
+
+
+def haversine_km(lat1, lon1, lat2, lon2):
+    """計算兩組經緯度之間的大圓距離（公里），可直接傳入 NumPy 陣列"""
+    lat1, lon1, lat2, lon2 = map(np.radians, (lat1, lon1, lat2, lon2))
+    a = (
+        np.sin((lat2 - lat1) / 2) ** 2
+        + np.cos(lat1) * np.cos(lat2) * np.sin((lon2 - lon1) / 2) ** 2
+    )
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.sqrt(a))
+
+
+def ragged_range(starts, counts):
+    """將多段 [start, start + count) 區間展開成一個索引陣列"""
+    total = counts.sum()
+    if total == 0:
+        return np.empty(0, dtype=np.int64)
+    shift = np.repeat(starts - np.cumsum(counts) + counts, counts)
+    return shift + np.arange(total)
+
+
+# ==================================================
+# 網格空間索引
+# ==================================================
+class GridIndex:
+    """
+    以固定大小網格建立的點位空間索引
+
+    - 經緯度先投影成以公里為單位的平面座標
+    - 點位依所在網格排序存放，每格只記錄起始位置（CSR），
+      查詢時只比對鄰近網格內的點，不會建立 n × m 的距離矩陣
+    - 所有查詢皆為整批 NumPy 運算，並分段處理以限制記憶體用量
+    """
+
+    def __init__(self, lat, lon, cell_km=None):
+        lat = np.asarray(lat, dtype="float64")
+        lon = np.asarray(lon, dtype="float64")
+
+        # 座標缺漏的點不納入索引，ids 記錄原始位置
+        valid = np.isfinite(lat) & np.isfinite(lon)
+        self.ids = np.flatnonzero(valid)
+        self.lat = lat[valid]
+        self.lon = lon[valid]
+
+        # 以所有點位的平均緯度做等距投影（台灣範圍內誤差極小）
+        ref_lat = self.lat.mean() if len(self.lat) else 0.0
+        self.ref_cos = np.cos(np.radians(ref_lat))
+        self.max_abs_lat = np.abs(self.lat).max() if len(self.lat) else 0.0
+
+        x, y = self.project(self.lat, self.lon)
+        self.x0 = x.min() if len(x) else 0.0
+        self.y0 = y.min() if len(y) else 0.0
+        width = (x.max() - self.x0) if len(x) else 0.0
+        height = (y.max() - self.y0) if len(y) else 0.0
+
+        # 預設網格大小：平均每格約 2 個點
+        if cell_km is None:
+            cell_km = np.sqrt(max(width * height, 1.0) * 2 / max(len(x), 1))
+        cell_km = max(cell_km, np.sqrt(max(width * height, 1.0) / MAX_CELLS), 0.01)
+        self.cell_km = float(cell_km)
+
+        self.nrows = int(height // self.cell_km) + 1
+        self.ncols = int(width // self.cell_km) + 1
+
+        # 依網格編號排序，starts[c] ~ starts[c + 1] 即為第 c 格內的點
+        row, col = self.cell_of(x, y)
+        cell = row * self.ncols + col
+        order = np.argsort(cell, kind="stable")
+        self.ids = self.ids[order]
+        self.x = x[order]
+        self.y = y[order]
+        self.lat = self.lat[order]
+        self.lon = self.lon[order]
+        self.starts = np.searchsorted(cell[order], np.arange(self.nrows * self.ncols + 1))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def project(self, lat, lon):
+        return lon * KM_PER_DEG * self.ref_cos, lat * KM_PER_DEG
+
+    def cell_of(self, x, y):
+        row = np.floor((y - self.y0) / self.cell_km).astype(np.int64)
+        col = np.floor((x - self.x0) / self.cell_km).astype(np.int64)
+        return row, col
+
+    def candidates(self, queries, row, col, offsets):
+        """
+        回傳 (查詢編號, 索引內點位位置) 配對：
+        每個查詢點 × 每個網格位移所涵蓋的所有點位
+        """
+        r = row[:, None] + offsets[:, 0]
+        c = col[:, None] + offsets[:, 1]
+        inside = (r >= 0) & (r < self.nrows) & (c >= 0) & (c < self.ncols)
+        qi, oi = np.nonzero(inside)
+
+        cell = r[qi, oi] * self.ncols + c[qi, oi]
+        start = self.starts[cell]
+        count = self.starts[cell + 1] - start
+
+        pair_q = np.repeat(queries[qi], count)
+        pair_p = ragged_range(start, count)
+        return pair_q, pair_p
+
+    # ----------------------------------------------
+    # 最近鄰查詢
+    # ----------------------------------------------
+    def nearest(self, lat, lon, chunk_size=200_000):
+        """
+        找出每個查詢點最近的索引點位
+
+        回傳 (位置, 距離公里)：位置為建立索引時的原始順序，
+        查詢座標缺漏或索引為空時位置為 -1、距離為 NaN
+        """
+        lat = np.asarray(lat, dtype="float64")
+        lon = np.asarray(lon, dtype="float64")
+        result = np.full(len(lat), -1, dtype=np.int64)
+        distance = np.full(len(lat), np.nan)
+
+        if len(self) == 0:
+            return result, distance
+
+        for start in range(0, len(lat), chunk_size):
+            part = slice(start, start + chunk_size)
+            best = self.nearest_chunk(lat[part], lon[part])
+            found = best >= 0
+            result[part][found] = self.ids[best[found]]
+            distance[part][found] = haversine_km(
+                lat[part][found], lon[part][found],
+                self.lat[best[found]], self.lon[best[found]],
+            )
+
+        return result, distance
+
+    def nearest_chunk(self, lat, lon):
+        """以「由內而外逐圈擴大網格」的方式找最近點，回傳索引內部位置"""
+        x, y = self.project(lat, lon)
+
+        # 座標缺漏的查詢點不參與搜尋（先填入網格原點避免轉型警告）
+        valid = np.isfinite(x) & np.isfinite(y)
+        row, col = self.cell_of(np.where(valid, x, self.x0), np.where(valid, y, self.y0))
+
+        best = np.full(len(x), -1, dtype=np.int64)
+        best_d = np.full(len(x), np.inf)
+
+        # 投影只用單一緯度換算經度，離參考緯度越遠越會高估距離；
+        # 以最高緯度的縮放比例修正「下一圈最小距離」的下界
+        max_lat = np.maximum(np.abs(np.where(valid, lat, 0.0)), self.max_abs_lat)
+        shrink = np.minimum(1.0, np.cos(np.radians(max_lat)) / self.ref_cos) * 0.99
+
+        # 查詢點在網格外時，從最接近網格的那一圈開始找
+        outside = np.maximum.reduce([
+            -row, row - (self.nrows - 1), -col, col - (self.ncols - 1),
+            np.zeros_like(row),
+        ])
+        last_ring = outside + max(self.nrows, self.ncols)
+
+        active = np.flatnonzero(valid)
+        ring = 0
+        while len(active):
+            # 中間沒有任何查詢點需要處理的圈直接跳過
+            ring = max(ring, outside[active].min())
+            todo = active[outside[active] <= ring]
+            if len(todo):
+                pair_q, pair_p = self.candidates(
+                    todo, row[todo], col[todo], ring_offsets(ring)
+                )
+                if len(pair_q):
+                    d = haversine_km(lat[pair_q], lon[pair_q], self.lat[pair_p], self.lon[pair_p])
+
+                    # 配對依查詢點連續排列，分段取最小值即為本圈最近的一點
+                    group = np.flatnonzero(np.r_[True, pair_q[1:] != pair_q[:-1]])
+                    nearest_d = np.minimum.reduceat(d, group)
+                    hit = np.flatnonzero(d == np.repeat(nearest_d, np.diff(np.r_[group, len(d)])))
+                    q = pair_q[hit]
+
+                    better = d[hit] < best_d[q]
+                    best[q[better]] = pair_p[hit][better]
+                    best_d[q[better]] = d[hit][better]
+
+            # 下一圈的點投影距離一定 > ring × 網格大小，已找到更近者即可結束
+            bound = ring * self.cell_km * shrink[active]
+            done = (best_d[active] <= bound) | (ring >= last_ring[active])
+            active = active[~done]
+            ring += 1
+
+        return best
+
+    # ----------------------------------------------
+    # 半徑查詢
+    # ----------------------------------------------
+    def within(self, lat, lon, radius_km, chunk_size=50_000):
+        """
+        找出距離每個查詢點 radius_km 公里以內的所有索引點位
+
+        回傳 DataFrame：query（查詢點位置）、point（索引點原始位置）、distance_km
+        """
+        lat = np.asarray(lat, dtype="float64")
+        lon = np.asarray(lon, dtype="float64")
+
+        # 多涵蓋一格，吸收投影與大圓距離之間的微小差異
+        reach = int(np.ceil(radius_km / self.cell_km)) + 1
+        offsets = square_offsets(reach)
+
+        parts = []
+        for start in range(0, len(lat), chunk_size):
+            q_lat = lat[start:start + chunk_size]
+            q_lon = lon[start:start + chunk_size]
+            x, y = self.project(q_lat, q_lon)
+
+            queries = np.flatnonzero(np.isfinite(x) & np.isfinite(y))
+            if len(self) == 0 or len(queries) == 0:
+                continue
+
+            row, col = self.cell_of(x[queries], y[queries])
+            pair_q, pair_p = self.candidates(queries, row, col, offsets)
+            d = haversine_km(q_lat[pair_q], q_lon[pair_q], self.lat[pair_p], self.lon[pair_p])
+            keep = d <= radius_km
+
+            parts.append(pd.DataFrame({
+                "query": pair_q[keep] + start,
+                "point": self.ids[pair_p[keep]],
+                "distance_km": d[keep],
+            }))
+
+        if not parts:
+            return pd.DataFrame({
+                "query": pd.Series(dtype="int64"),
+                "point": pd.Series(dtype="int64"),
+                "distance_km": pd.Series(dtype="float64"),
+            })
+        return pd.concat(parts, ignore_index=True)
+
+
+def ring_offsets(ring):
+    """第 ring 圈（與中心格的切比雪夫距離剛好為 ring）的所有網格位移"""
+    if ring == 0:
+        return np.zeros((1, 2), dtype=np.int64)
+    square = square_offsets(ring)
+    edge = np.abs(square).max(axis=1) == ring
+    return square[edge]
+
+
+def square_offsets(reach):
+    """中心格周圍 (2 × reach + 1)² 個網格的位移"""
+    steps = np.arange(-reach, reach + 1)
+    di, dj = np.meshgrid(steps, steps, indexing="ij")
+    return np.column_stack([di.ravel(), dj.ravel()])
+
+
+# ==================================================
+# 檢測站 × 空品測站：最近測站與半徑查詢
+# ==================================================
+def coordinates(df):
+    """取出 latitude / longitude 欄位並轉成數值（無法轉換者為 NaN）"""
+    lat = pd.to_numeric(df["latitude"], errors="coerce").to_numpy(dtype="float64")
+    lon = pd.to_numeric(df["longitude"], errors="coerce").to_numpy(dtype="float64")
+    return lat, lon
+
+
+def site_summary(air_df):
+    """
+    空汙資料可能含多個時段的快照，先整理成「每個測站一列」：
+    座標取第一筆，PM2.5 / AQI 取平均（與縣市平均的算法一致）
+    """
+    sites = air_df.assign(
+        latitude=pd.to_numeric(air_df["latitude"], errors="coerce"),
+        longitude=pd.to_numeric(air_df["longitude"], errors="coerce"),
+    ).dropna(subset=["latitude", "longitude"])
+
+    return (
+        sites.groupby("sitename", sort=False)
+        .agg({
+            "county": "first",
+            "latitude": "first",
+            "longitude": "first",
+            "pm2.5": "mean",
+            "aqi": "mean",
+        })
+        .reset_index()
+    )
+
+
+def attach_nearest_site(station_df, air_df):
+    """
+    為每個機車檢測站找出最近的空品測站（一次整批查詢）
+
+    新增欄位：
+    nearest_site     : 最近空品測站名稱
+    site_distance_km : 與該測站的距離（公里）
+    site_pm2.5       : 該測站平均 PM2.5
+    site_aqi         : 該測站平均 AQI
+    檢測站座標缺漏時以上欄位為空值
+    """
+
+    sites = site_summary(air_df)
+    index = GridIndex(*coordinates(sites))
+
+    position, distance = index.nearest(*coordinates(station_df))
+
+    # -1（找不到）在 reindex 後自動成為 NaN
+    matched = sites.reindex(position)
+
+    result = station_df.copy()
+    result["nearest_site"] = matched["sitename"].to_numpy()
+    result["site_distance_km"] = distance
+    result["site_pm2.5"] = matched["pm2.5"].to_numpy()
+    result["site_aqi"] = matched["aqi"].to_numpy()
+    return result
+
+
+def stations_within_radius(station_df, air_df, radius_km=3.0):
+    """
+    列出每個空品測站 radius_km 公里內的所有機車檢測站
+
+    回傳欄位：sitename, station_no, station_name, distance_km
+    """
+
+    sites = site_summary(air_df)
+    index = GridIndex(*coordinates(station_df))
+    pairs = index.within(*coordinates(sites), radius_km)
+
+    result = pd.DataFrame({
+        "sitename": sites["sitename"].to_numpy()[pairs["query"]],
+        "station_no": station_df["station_no"].to_numpy()[pairs["point"]],
+        "station_name": station_df["station_name"].to_numpy()[pairs["point"]],
+        "distance_km": pairs["distance_km"].to_numpy(),
+    })
+    return result.sort_values(["sitename", "distance_km"], ignore_index=True)
+
+
+# ==================================================
+# 反距離加權（IDW）：以周邊空品測站推估檢測站的 PM2.5 / AQI
+# ==================================================
+def unit_vectors(lat, lon):
+    """經緯度轉成單位球面上的三維座標（n × 3）"""
+    lat, lon = np.radians(lat), np.radians(lon)
+    return np.column_stack([np.cos(lat) * np.cos(lon), np.cos(lat) * np.sin(lon), np.sin(lat)])
+
+
+def chord_to_km(chord2):
+    """單位球面上的弦長平方 → 大圓距離（公里），與 haversine_km 相同"""
+    return 2 * EARTH_RADIUS_KM * np.arcsin(np.minimum(np.sqrt(chord2) / 2, 1.0))
+
+
+def idw_estimate(lat, lon, site_lat, site_lon, values, k=4, max_km=50.0, power=2.0):
+    """
+    以最近 k 個、距離 max_km 公里以內的測站做反距離加權平均
+
+    values: (測站數, 欄位數) 陣列；某欄位缺值的測站不參與該欄位的推估
+    查詢點分段處理，每段只建立「段內查詢點 × 測站」的距離矩陣，記憶體用量固定；
+    距離以弦長平方（一次矩陣乘法）排序，只有選出的候選測站才換算成公里
+
+    回傳 (estimate, used, nearest_km)：
+    estimate  : (查詢點數, 欄位數) 推估值，範圍內沒有測站時為 NaN
+    used      : 實際採用的測站數（最近 k 個中落在 max_km 以內者）
+    nearest_km: 最近測站距離（不論是否超過 max_km）
+    """
+    lat = np.asarray(lat, dtype="float64")
+    lon = np.asarray(lon, dtype="float64")
+    values = np.asarray(values, dtype="float64")
+    if values.ndim == 1:
+        values = values[:, None]
+
+    # 座標缺漏的測站不參與推估
+    site_lat = np.asarray(site_lat, dtype="float64")
+    site_lon = np.asarray(site_lon, dtype="float64")
+    site_ok = np.isfinite(site_lat) & np.isfinite(site_lon)
+    sites = unit_vectors(site_lat[site_ok], site_lon[site_ok])
+    values = values[site_ok]
+
+    n, m = len(lat), len(sites)
+    estimate = np.full((n, values.shape[1]), np.nan)
+    used = np.zeros(n, dtype=np.int64)
+    nearest_km = np.full(n, np.nan)
+    if n == 0 or m == 0:
+        return estimate, used, nearest_km
+
+    # 各欄位缺值的測站要跳過，多取幾個候選才保證每個欄位都有 k 個可用測站
+    valid_values = np.isfinite(values)
+    k = min(k, m)
+    candidates = min(m, k + int((~valid_values).sum(axis=0).max()))
+
+    chunk_size = max(1, IDW_CHUNK_ELEMENTS // m)
+    for start in range(0, n, chunk_size):
+        part = slice(start, start + chunk_size)
+        q_ok = np.isfinite(lat[part]) & np.isfinite(lon[part])
+
+        # |p - q|² = 2 - 2 p·q（一次矩陣乘法）；座標缺漏的查詢點之後設為空值
+        chord2 = 2.0 - 2.0 * (unit_vectors(lat[part], lon[part]) @ sites.T)
+        chord2[~q_ok] = 0.0
+
+        # 只用一次 argpartition 取出候選，再只對這幾個候選排序
+        if candidates < m:
+            nearest = np.argpartition(chord2, candidates - 1, axis=1)[:, :candidates]
+        else:
+            nearest = np.broadcast_to(np.arange(m), chord2.shape)
+        dist = chord_to_km(np.maximum(np.take_along_axis(chord2, nearest, axis=1), 0.0))
+        order = np.argsort(dist, axis=1, kind="stable")
+        nearest = np.take_along_axis(nearest, order, axis=1)
+        dist = np.take_along_axis(dist, order, axis=1)
+
+        nearest_km[part] = np.where(q_ok, dist[:, 0], np.nan)
+        used[part] = np.where(q_ok, (dist[:, :k] <= max_km).sum(axis=1), 0)
+
+        for j in range(values.shape[1]):
+            # 依距離由近到遠，取前 k 個該欄位有值的測站
+            ok = valid_values[nearest, j]
+            ok &= np.cumsum(ok, axis=1) <= k
+            result = idw_weighted(dist, values[nearest, j], ok & (dist <= max_km), power)
+            estimate[part, j] = np.where(q_ok, result, np.nan)
+
+    return estimate, used, nearest_km
+
+
+def idw_weighted(dist, value, selected, power):
+    """反距離加權平均：dist / value 為各查詢點的候選測站，只採用 selected 為 True 者"""
+    weight = np.where(selected, 1.0 / np.maximum(dist, SAME_PLACE_KM) ** power, 0.0)
+
+    # 與測站同一地點時只採用該測站的數值
+    same = selected & (dist <= SAME_PLACE_KM)
+    weight = np.where(same.any(axis=1, keepdims=True), same.astype("float64"), weight)
+
+    total = weight.sum(axis=1)
+    weighted = (weight * np.where(selected, value, 0.0)).sum(axis=1)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return np.where(total > 0, weighted / total, np.nan)
+
+
+def station_exposure(station_df, air_df, k=4, max_km=50.0, power=2.0):
+    """
+    每個機車檢測站的 PM2.5 / AQI 推估值（反距離加權）
+
+    回傳欄位：
+    station_no, station_name, city, district : 檢測站
+    idw_pm2.5, idw_aqi                       : 推估值（範圍內沒有測站時為空值）
+    idw_sites                                : 採用的測站數（最多 k 個）
+    idw_nearest_km                           : 最近空品測站距離
+    """
+
+    sites = site_summary(air_df)
+    estimate, used, nearest_km = idw_estimate(
+        *coordinates(station_df), *coordinates(sites),
+        sites[["pm2.5", "aqi"]].to_numpy(dtype="float64"),
+        k=k, max_km=max_km, power=power,
+    )
+
+    result = station_df[["station_no", "station_name", "city", "district"]].reset_index(drop=True)
+    result["idw_pm2.5"] = estimate[:, 0]
+    result["idw_aqi"] = estimate[:, 1]
+    result["idw_sites"] = used
+    result["idw_nearest_km"] = nearest_km
+    return result
+
+
+def exposure_by_district(exposure):
+    """依「縣市 × 行政區」彙總檢測站的推估值（檢測站數與平均推估 PM2.5 / AQI）"""
+    return (
+        exposure.groupby(["city", "district"], observed=True)
+        .agg(
+            station_count=("station_no", "size"),
+            idw_pm25_mean=("idw_pm2.5", "mean"),
+            idw_aqi_mean=("idw_aqi", "mean"),
+        )
+        .reset_index()
+        .sort_values("idw_pm25_mean", ascending=False, ignore_index=True)
+    )
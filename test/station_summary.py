@@ -0,0 +1,247 @@
+import os
+import sqlite3
+
+import pandas as pd
+
+
+# ==================================================
+# 檢驗站彙總表（SQLite，隨 stations 增量更新）
+# ==================================================
+# 分析只需要各群組的檢驗站數量，不必把整張 stations 讀進 pandas：
+#   city_summary     : 各縣市營運中的檢驗站數量
+#   district_summary : 各「縣市 × 行政區」營運中的檢驗站數量
+#   top_district     : 各縣市檢驗站最多的行政區（同數量時取名稱排序第一個）
+#
+# city_summary / district_summary 由 stations 的 trigger 維護：
+# 只有實際新增、刪除或改變縣市 / 行政區 / 營運狀態的列才會調整計數。
+# top_district 由 district_summary（最多 368 列）重新整理，每次 upsert 後執行一次。
+# 大量匯入（例如第一次匯入）時改為先移除 trigger、寫入後整表重算（見 analysis.upsert_stations）
+SUMMARY_SCHEMA = [
+    """
+    CREATE TABLE IF NOT EXISTS city_summary (
+        city          TEXT PRIMARY KEY,
+        station_count INTEGER NOT NULL
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS district_summary (
+        city          TEXT NOT NULL,
+        district      TEXT NOT NULL,
+        station_count INTEGER NOT NULL,
+        PRIMARY KEY (city, district)
+    ) WITHOUT ROWID
+    """,
+    """
+    CREATE TABLE IF NOT EXISTS top_district (
+        city          TEXT PRIMARY KEY,
+        district      TEXT NOT NULL,
+        station_count INTEGER NOT NULL
+    ) WITHOUT ROWID
+    """,
+]
+SUMMARY_TABLES = ["city_summary", "district_summary", "top_district"]
+
+# 計數 +1 / -1（縣市或行政區為空值的列不列入）
+ADD_STATION = """
+    INSERT INTO district_summary VALUES ({row}.city, {row}.district, 1)
+        ON CONFLICT (city, district) DO UPDATE SET station_count = station_count + 1;
+    INSERT INTO city_summary VALUES ({row}.city, 1)
+        ON CONFLICT (city) DO UPDATE SET station_count = station_count + 1;
+"""
+REMOVE_STATION = """
+    UPDATE district_summary SET station_count = station_count - 1
+        WHERE city = {row}.city AND district = {row}.district;
+    DELETE FROM district_summary
+        WHERE city = {row}.city AND district = {row}.district AND station_count <= 0;
+    UPDATE city_summary SET station_count = station_count - 1 WHERE city = {row}.city;
+    DELETE FROM city_summary WHERE city = {row}.city AND station_count <= 0;
+"""
+COUNTED = "{row}.is_active = 1 AND {row}.city IS NOT NULL AND {row}.district IS NOT NULL"
+
+SUMMARY_TRIGGERS = {
+    "stations_summary_insert": f"""
+        CREATE TRIGGER IF NOT EXISTS stations_summary_insert
+        AFTER INSERT ON stations WHEN {COUNTED.format(row="NEW")}
+        BEGIN {ADD_STATION.format(row="NEW")} END
+    """,
+    "stations_summary_delete": f"""
+        CREATE TRIGGER IF NOT EXISTS stations_summary_delete
+        AFTER DELETE ON stations WHEN {COUNTED.format(row="OLD")}
+        BEGIN {REMOVE_STATION.format(row="OLD")} END
+    """,
+    # 只改電話、地址等欄位的更新不影響計數
+    "stations_summary_remove": f"""
+        CREATE TRIGGER IF NOT EXISTS stations_summary_remove
+        AFTER UPDATE OF city, district, is_active ON stations
+        WHEN {COUNTED.format(row="OLD")} AND (
+            NEW.is_active IS NOT 1 OR NEW.city IS NOT OLD.city OR NEW.district IS NOT OLD.district
+        )
+        BEGIN {REMOVE_STATION.format(row="OLD")} END
+    """,
+    "stations_summary_add": f"""
+        CREATE TRIGGER IF NOT EXISTS stations_summary_add
+        AFTER UPDATE OF city, district, is_active ON stations
+        WHEN {COUNTED.format(row="NEW")} AND (
+            OLD.is_active IS NOT 1 OR NEW.city IS NOT OLD.city OR NEW.district IS NOT OLD.district
+        )
+        BEGIN {ADD_STATION.format(row="NEW")} END
+    """,
+}
+
+# 前 k 名的同分處理方式（同 analysis.TIE_METHODS）對應的 SQL 視窗函式
+RANK_FUNCTIONS = {"first": "ROW_NUMBER", "all": "RANK", "dense": "DENSE_RANK"}
+
+
+# ==================================================
+# 建立與維護
+# ==================================================
+def ensure_summary_tables(conn, rebuild=False):
+    """
+    建立彙總表與 trigger（需在 stations 資料表建立之後呼叫）
+
+    彙總表第一次建立（例如既有的資料庫）或 rebuild=True 時，依 stations 整表重算
+    """
+    existing = {
+        row[0] for row in conn.execute("SELECT name FROM sqlite_master WHERE type IN ('table', 'trigger')")
+    }
+    if not rebuild and set(SUMMARY_TABLES) | set(SUMMARY_TRIGGERS) <= existing:
+        return
+
+    for sql in SUMMARY_SCHEMA:
+        conn.execute(sql)
+    create_triggers(conn)
+
+    if rebuild or not set(SUMMARY_TABLES) <= existing:
+        rebuild_summaries(conn)
+
+
+def create_triggers(conn):
+    for sql in SUMMARY_TRIGGERS.values():
+        conn.execute(sql)
+
+
+def drop_triggers(conn):
+    """大量寫入前移除 trigger（寫入後以 rebuild_summaries 重算、create_triggers 重建）"""
+    for name in SUMMARY_TRIGGERS:
+        conn.execute(f"DROP TRIGGER IF EXISTS {name}")
+
+
+def rebuild_summaries(conn):
+    """依營運中的檢驗站整表重算彙總表"""
+    conn.execute("DELETE FROM district_summary")
+    conn.execute(
+        "INSERT INTO district_summary "
+        "SELECT city, district, COUNT(*) FROM stations "
+        f"WHERE {COUNTED.format(row='stations')} "
+        "GROUP BY city, district"
+    )
+    conn.execute("DELETE FROM city_summary")
+    conn.execute(
+        "INSERT INTO city_summary "
+        "SELECT city, SUM(station_count) FROM district_summary GROUP BY city"
+    )
+    refresh_top_districts(conn)
+
+
+def refresh_top_districts(conn):
+    """由 district_summary 重新整理 top_district"""
+    conn.execute("DELETE FROM top_district")
+    conn.execute(
+        "INSERT INTO top_district "
+        "SELECT city, district, station_count FROM ("
+        "    SELECT *, ROW_NUMBER() OVER ("
+        "        PARTITION BY city ORDER BY station_count DESC, district"
+        "    ) AS rank FROM district_summary"
+        ") WHERE rank = 1"
+    )
+
+
+# ==================================================
+# 查詢（只讀取彙總表）
+# ==================================================
+def available(db_path="inspection_stations.db"):
+    """資料庫中是否已有 stations 資料表（可以提供彙總表）"""
+    if not os.path.exists(db_path):
+        return False
+    conn = sqlite3.connect(db_path)
+    try:
+        return conn.execute(
+            "SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'stations'"
+        ).fetchone() is not None
+    finally:
+        conn.close()
+
+
+def query(sql, params=(), db_path="inspection_stations.db", conn=None):
+    """
+    查詢彙總表，回傳 DataFrame
+
+    舊版資料庫還沒有彙總表時先建立：stations 同時搬移成新結構（見 analysis.ensure_stations_table），
+    再依 stations 整表重算一次
+
+    conn: 直接使用已開啟的連線（例如 query_service 的唯讀連線池，不做上述搬移）
+    """
+    if conn is not None:
+        return pd.read_sql_query(sql, conn, params=params)
+    if not os.path.exists(db_path):
+        raise FileNotFoundError(f"找不到資料庫：{db_path}")
+
+    conn = sqlite3.connect(db_path)
+    try:
+        names = {row[0] for row in conn.execute("SELECT name FROM sqlite_master")}
+        if not set(SUMMARY_TABLES) | set(SUMMARY_TRIGGERS) <= names:
+            import analysis
+            with conn:
+                analysis.ensure_stations_table(conn)
+        return pd.read_sql_query(sql, conn, params=params)
+    finally:
+        conn.close()
+
+
+def city_counts(db_path="inspection_stations.db"):
+    """各縣市的檢驗站數量（city / station_count，依縣市排序）"""
+    return query("SELECT city, station_count FROM city_summary ORDER BY city", db_path=db_path)
+
+
+def district_counts(cities=None, db_path="inspection_stations.db"):
+    """
+    各「縣市 × 行政區」的檢驗站數量（city / district / station_count，依縣市、行政區排序）
+
+    cities: 只取這些縣市（字串或清單，None 為全部）
+    """
+    sql = "SELECT city, district, station_count FROM district_summary"
+    params = ()
+    if cities is not None:
+        params = tuple([cities] if isinstance(cities, str) else cities)
+        sql += f" WHERE city IN ({', '.join('?' * len(params))})"
+    return query(sql + " ORDER BY city, district", params, db_path)
+
+
+def top_districts(k=1, ties="first", db_path="inspection_stations.db", conn=None):
+    """
+    各縣市檢驗站最多的前 k 個行政區（city / district / station_count / rank）
+
+    k=1 且 ties="first" 時直接讀 top_district；其他情況以視窗函式由 district_summary 計算，
+    名次與 analysis.top_k_per_group 相同
+    """
+    if ties not in RANK_FUNCTIONS:
+        raise ValueError(f"ties 必須是 {', '.join(RANK_FUNCTIONS)} 其中之一")
+
+    if k == 1 and ties == "first":
+        return query(
+            "SELECT city, district, station_count, 1 AS rank FROM top_district ORDER BY city",
+            db_path=db_path,
+            conn=conn,
+        )
+
+    # RANK / DENSE_RANK 以排序欄位全部相同者為同分，行政區名稱只用於 first 的先後順序
+    order = "station_count DESC, district" if ties == "first" else "station_count DESC"
+    return query(
+        "SELECT city, district, station_count, rank FROM ("
+        f"    SELECT *, {RANK_FUNCTIONS[ties]}() OVER (PARTITION BY city ORDER BY {order}) AS rank"
+        "    FROM district_summary"
+        ") WHERE rank <= ? ORDER BY city, rank, district",
+        (k,),
+        db_path,
+        conn,
+    )
@@ -0,0 +1,263 @@
+import argparse
+import math
+import os
+import re
+from xml.sax.saxutils import escape
+
+import numpy as np
+import pandas as pd
+
+from air_quality_xml_to_csv import AIR_COLUMNS
+from moenv_crawler import crawl_moenv_xml
+
+
+# ==================================================
+# 合成資料產生器：以真實樣本為種子，產生任意規模的 XML
+# ==================================================
+# 檢測站 XML：縣市 / 行政區 / 路名 / 座標都取自真實檢測站，
+#             地址一定是有效的「縣市 + 行政區 + 路名 + 門牌」，座標在原站附近
+# 空汙 XML  ：以真實空品測站為基礎，可複製出更多測站，
+#             每小時一批快照（與環境部資料相同的欄位與順序）
+#
+# 兩種檔案都是邊產生邊寫入，產生 1,000 萬筆也只佔用一個批次的記憶體
+STATION_SAMPLE = "機車排氣定檢站資料.xml"
+AIR_SAMPLE = "空汙.xml"
+
+# 地址中行政區之後的路名（含「段」），門牌號碼另外產生
+ROAD_PATTERN = re.compile(r"^(.+?(?:路|街|道|巷)(?:.{1,2}段)?)")
+
+# 檢測站名稱常見的結尾
+NAME_SUFFIXES = ["機車行", "車業行", "機車材料行", "車業有限公司", "機車有限公司", "輪業行"]
+
+# 空汙 XML 的欄位（順序同環境部 aqx_p_488）
+AIR_FIELDS = AIR_COLUMNS
+
+# AQI 分級（上限值, 狀態）
+AQI_STATUS = [(50, "良好"), (100, "普通"), (150, "對敏感族群不健康"),
+              (200, "對所有族群不健康"), (300, "非常不健康"), (np.inf, "危害")]
+
+
+# ==================================================
+# 種子資料
+# ==================================================
+def station_seeds(sample_xml=STATION_SAMPLE):
+    """
+    從真實檢測站資料取出 (縣市原始寫法, 行政區, 路名, 座標, 電話區碼, 備註, 店名開頭)
+
+    縣市保留原始寫法（臺 / 台 混用），產生的資料才能測到 clean_data 的正規化
+    """
+
+    df = crawl_moenv_xml(sample_xml).dropna(subset=["city", "district", "latitude", "longitude"])
+    address = df["address"].str.strip()
+
+    rest = [a[len(c) + len(d):] for a, c, d in zip(address, df["city"], df["district"])]
+    roads = pd.Series(rest, index=df.index).str.extract(ROAD_PATTERN, expand=False)
+
+    seeds = pd.DataFrame({
+        "city_raw": address.str[:3],
+        "district": df["district"],
+        "road": roads,
+        "latitude": pd.to_numeric(df["latitude"], errors="coerce"),
+        "longitude": pd.to_numeric(df["longitude"], errors="coerce"),
+        "area_code": df["tel"].str.extract(r"^(0\d{1,3})-", expand=False),
+        "note": df["note"],
+        "sno_prefix": df["station_no"].str[:1],
+        "name_head": df["station_name"].str[:2],
+    }).dropna()
+
+    return seeds.reset_index(drop=True)
+
+
+def air_seeds(sample_xml=AIR_SAMPLE):
+    """從真實空汙 XML 取出每個空品測站的名稱、縣市、代碼與座標"""
+    import xml.etree.ElementTree as ET
+
+    sites = {}
+    for elem in ET.parse(sample_xml).getroot().iter("data"):
+        siteid = elem.findtext("siteid")
+        if siteid and siteid not in sites:
+            sites[siteid] = {
+                "sitename": elem.findtext("sitename"),
+                "county": elem.findtext("county"),
+                "siteid": int(siteid),
+                "latitude": float(elem.findtext("latitude")),
+                "longitude": float(elem.findtext("longitude")),
+            }
+
+    return pd.DataFrame(list(sites.values())).sort_values("siteid", ignore_index=True)
+
+
+# ==================================================
+# 檢測站 XML
+# ==================================================
+def write_station_xml(out_path, records, seed=0, batch_size=100_000, sample_xml=STATION_SAMPLE):
+    """
+    產生 records 筆檢測站資料
+
+    每筆隨機挑一個真實檢測站當範本：
+    沿用其縣市 / 行政區 / 路名，門牌與電話重新產生，座標在範本附近約 500 公尺內
+    """
+
+    rng = np.random.default_rng(seed)
+    seeds = station_seeds(sample_xml)
+    name_heads = seeds["name_head"].unique()
+
+    with open(out_path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n<download_content>')
+
+        for start in range(0, records, batch_size):
+            n = min(batch_size, records - start)
+            pick = seeds.iloc[rng.integers(0, len(seeds), n)]
+
+            numbers = rng.integers(1, 800, n)
+            heads = name_heads[rng.integers(0, len(name_heads), n)]
+            suffixes = rng.choice(NAME_SUFFIXES, n)
+            phones = rng.integers(1_000_000, 9_999_999, n)
+            lat = pick["latitude"].to_numpy() + rng.normal(0, 0.004, n)
+            lon = pick["longitude"].to_numpy() + rng.normal(0, 0.004, n)
+
+            rows = zip(
+                range(start, start + n), pick["sno_prefix"], pick["city_raw"],
+                pick["district"], pick["road"], numbers, heads, suffixes,
+                pick["area_code"], phones, lat, lon, pick["note"],
+            )
+            f.write("".join(
+                f"<item-{i}><sno>{prefix}{i}</sno>"
+                f"<sname>{escape(head + suffix)}</sname>"
+                f"<tel>{code}-{phone}</tel>"
+                f"<address>{escape(f'{city}{district}{road}{number}號')}</address>"
+                f"<latitude>{la:.6f}</latitude><longitude>{lo:.6f}</longitude>"
+                f"<note>{escape(note)}</note></item-{i}>"
+                for i, prefix, city, district, road, number, head, suffix,
+                code, phone, la, lo, note in rows
+            ))
+
+        f.write("</download_content>")
+
+
+# ==================================================
+# 空汙 XML
+# ==================================================
+def expand_sites(base, sites, rng):
+    """測站數超過真實測站時，複製既有測站並將座標平移約 5 公里內"""
+
+    if sites <= len(base):
+        return base.iloc[:sites].reset_index(drop=True)
+
+    extra = base.iloc[np.arange(sites - len(base)) % len(base)].reset_index(drop=True)
+    copy_no = np.arange(sites - len(base)) // len(base) + 1
+    extra["sitename"] = extra["sitename"] + "-" + copy_no.astype(str)
+    extra["siteid"] = np.arange(len(extra)) + 10_000
+    extra["latitude"] += rng.normal(0, 0.03, len(extra))
+    extra["longitude"] += rng.normal(0, 0.03, len(extra))
+
+    return pd.concat([base, extra], ignore_index=True)
+
+
+def format_value(values, decimals, missing):
+    """數值轉成字串，missing 為 True 的位置輸出環境部的缺值符號「-」"""
+    text = np.char.mod(f"%.{decimals}f", values)
+    return np.where(missing, "-", text)
+
+
+def air_snapshot(sites, baseline, when, rng, missing_rate):
+    """產生某一小時所有測站的一批資料（字串欄位）"""
+
+    n = len(sites)
+    pm25 = np.clip(baseline * rng.lognormal(0, 0.35, n), 0, 500)
+    aqi = np.clip(np.rint(pm25 * 2.2 + rng.normal(10, 8, n)), 0, 500)
+    status = np.select(
+        [aqi <= limit for limit, _ in AQI_STATUS], [s for _, s in AQI_STATUS], default=""
+    )
+
+    def miss():
+        return rng.random(n) < missing_rate
+
+    return {
+        "sitename": sites["sitename"].to_numpy(),
+        "county": sites["county"].to_numpy(),
+        "aqi": format_value(aqi, 0, miss()),
+        "pollutant": np.where(aqi > 50, "細懸浮微粒", ""),
+        "status": status,
+        "so2": format_value(rng.gamma(2, 0.8, n), 1, miss()),
+        "so2_avg": format_value(rng.gamma(2, 0.8, n), 0, miss()),
+        "co": format_value(rng.gamma(3, 0.1, n), 2, miss()),
+        "co_8hr": format_value(rng.gamma(3, 0.1, n), 1, miss()),
+        "o3": format_value(rng.gamma(3, 10, n), 0, miss()),
+        "o3_8hr": format_value(rng.gamma(3, 10, n), 0, miss()),
+        "pm10": format_value(pm25 * 1.6, 0, miss()),
+        "pm10_avg": format_value(pm25 * 1.5, 0, miss()),
+        "pm2.5": format_value(pm25, 0, miss()),
+        "pm2.5_avg": format_value(pm25 * rng.uniform(0.8, 1.2, n), 1, miss()),
+        "no2": format_value(rng.gamma(2, 6, n), 0, miss()),
+        "nox": format_value(rng.gamma(2, 8, n), 1, miss()),
+        "no": format_value(rng.gamma(1, 2, n), 1, miss()),
+        "windspeed": format_value(rng.gamma(2, 1, n), 1, miss()),
+        "winddirec": format_value(rng.uniform(0, 360, n), 1, miss()),
+        "datacreationdate": np.full(n, when.strftime("%Y-%m-%d %H:%M")),
+        "longitude": np.char.mod("%.6f", sites["longitude"].to_numpy()),
+        "latitude": np.char.mod("%.6f", sites["latitude"].to_numpy()),
+        "siteid": sites["siteid"].to_numpy().astype(str),
+        "unit": np.full(n, ""),
+    }
+
+
+def write_air_xml(out_path, records, sites=None, start="2025-01-01 00:00",
+                  seed=0, missing_rate=0.01, sample_xml=AIR_SAMPLE):
+    """
+    產生 records 筆空汙資料：sites 個測站 × 所需的小時數
+
+    sites       : 測站數（預設為樣本中的真實測站數，超過時複製出新測站）
+    start       : 第一批快照的時間，之後每小時一批
+    missing_rate: 各數值欄位輸出「-」（缺值）的比例
+    """
+
+    rng = np.random.default_rng(seed)
+    base = air_seeds(sample_xml)
+    site_df = expand_sites(base, sites or len(base), rng)
+    hours = math.ceil(records / len(site_df))
+
+    # 每個測站固定一個 PM2.5 基準值，讓各縣市平均值有差異
+    baseline = rng.gamma(4, 4, len(site_df))
+
+    written = 0
+    with open(out_path, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n<aqx_p_488>')
+
+        for when in pd.date_range(start, periods=hours, freq="h"):
+            snapshot = site_df.iloc[: records - written]
+            columns = air_snapshot(snapshot, baseline[: len(snapshot)], when, rng, missing_rate)
+
+            f.write("".join(
+                "<data>" + "".join(
+                    f"<{tag}>{escape(value)}</{tag}>" if value else f"<{tag}></{tag}>"
+                    for tag, value in zip(AIR_FIELDS, row)
+                ) + "</data>"
+                for row in zip(*(columns[field] for field in AIR_FIELDS))
+            ))
+            written += len(snapshot)
+
+        f.write("</aqx_p_488>")
+
+    return hours
+
+
+# ---------- 主程式進入點 ----------
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="產生合成的檢測站 / 空汙 XML")
+    parser.add_argument("--stations", type=int, default=100_000, help="檢測站筆數")
+    parser.add_argument("--air-records", type=int, default=100_000, help="空汙資料筆數")
+    parser.add_argument("--sites", type=int, default=None, help="空品測站數（預設同樣本）")
+    parser.add_argument("--seed", type=int, default=0, help="亂數種子")
+    parser.add_argument("--output-dir", default="synthetic", help="輸出目錄")
+    args = parser.parse_args()
+
+    os.makedirs(args.output_dir, exist_ok=True)
+    station_xml = os.path.join(args.output_dir, "stations.xml")
+    air_xml = os.path.join(args.output_dir, "air.xml")
+
+    write_station_xml(station_xml, args.stations, seed=args.seed)
+    hours = write_air_xml(air_xml, args.air_records, sites=args.sites, seed=args.seed)
+
+    print(f"✅ 檢測站 {args.stations} 筆 → {station_xml}")
+    print(f"✅ 空汙 {args.air_records} 筆（{hours} 小時）→ {air_xml}")